@@ -1,16 +1,32 @@
+import functools
+import hmac
+import threading
 import traceback
 import logging
+import click
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from pymongo import MongoClient
 from bson import json_util
 import os
-from datetime import datetime, timedelta
-from ariadne import load_schema_from_path, make_executable_schema, graphql_sync, QueryType
+from datetime import datetime
+from ariadne import load_schema_from_path, make_executable_schema, graphql_sync, EnumType, QueryType
 from prometheus_flask_exporter import PrometheusMetrics
+import rollups
+import export
+import serialization
+import slow_operations
+import structured_logging
+import indexes
+import live
+import loaders
+import mongo_client
+import trends
+from graphql_cache import DocumentCache, PersistedQueryError, PersistedQueryRegistry
+from instrumentation import MongoCommandMetrics, MongoPoolMetrics, ResolverMetrics
+from query_cost import FieldCost, QueryCostLimiter
+from cache import LocalCacheBackend, ResultCache, SharedCacheBackend
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Set up the Flask application and integrate Prometheus metrics for monitoring
@@ -26,13 +42,108 @@ user = "testuser"
 mongo_uri = os.getenv('MONGO_URI')
 mongo_db = os.getenv('MONGO_DB')
 
-client = MongoClient(mongo_uri)
-db = client[mongo_db]
+# Structured, sampled logging written off the request threads, see structured_logging.py
+# LOG_FORMAT is json (default) or text; LOG_SAMPLING keeps a fraction of the INFO records of
+# chosen loggers, e.g. "app=0.1,werkzeug=0.01"; LOG_ASYNC=false writes from the request thread
+async_logging = structured_logging.configure_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    sampling=structured_logging.parse_sampling(os.getenv('LOG_SAMPLING')),
+    asynchronous=os.getenv('LOG_ASYNC', 'true').lower() == 'true',
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+    registry=metrics.registry
+)
+
+# Resolver and MongoDB command timings on /metrics, see instrumentation.py
+resolver_metrics = ResolverMetrics(metrics.registry)
+mongo_command_metrics = MongoCommandMetrics(metrics.registry)
+mongo_pool_metrics = MongoPoolMetrics(metrics.registry)
+
+# Opt-in recorder of slow GraphQL operations, see slow_operations.py
+# SLOW_OPERATION_THRESHOLD_MS enables it; the recorded operations are served on
+# /analytics/admin/slow-operations to requests bearing ADMIN_TOKEN
+slow_operation_threshold = os.getenv('SLOW_OPERATION_THRESHOLD_MS')
+slow_operation_recorder = slow_operations.SlowOperationRecorder(
+    threshold_seconds=float(slow_operation_threshold) / 1000 if slow_operation_threshold else None,
+    max_entries=int(os.getenv('SLOW_OPERATION_MAX_ENTRIES', '100')),
+    sample_interval=float(os.getenv('SLOW_OPERATION_SAMPLE_MS', '10')) / 1000
+)
+admin_token = os.getenv('ADMIN_TOKEN')
+
+# Encoding and compression of the GraphQL responses, see serialization.py
+# JSON_SERIALIZER is auto (orjson when installed), orjson or json; RESPONSE_COMPRESSION lists
+# the encodings offered to clients, in order of preference
+response_serializer = serialization.ResponseSerializer(
+    backend=os.getenv('JSON_SERIALIZER', 'auto'),
+    encodings=serialization.parse_encodings(os.getenv('RESPONSE_COMPRESSION', 'br,gzip')),
+    min_size=int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+)
+
+# MongoDB client created on first use in each process, so gunicorn workers never share the
+# master's connections, see mongo_client.py; MONGO_MAX_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS
+# and the other MONGO_* pool and timeout settings are passed to the driver
+mongo_settings = mongo_client.settings_from_env()
+client = mongo_client.ManagedClient(
+    mongo_uri,
+    factory=MongoClient,
+    event_listeners=[mongo_command_metrics, mongo_pool_metrics, slow_operation_recorder],
+    **mongo_settings
+)
+slow_operation_recorder.client = client
+db = client.database(mongo_db)
+
+# The stats, weekly, trends and export reads; ANALYTICS_READ_PREFERENCE=secondaryPreferred
+# routes them to secondaries, at most ANALYTICS_MAX_STALENESS_SECONDS behind the primary
+analytics_read_preference = mongo_client.read_preference(
+    os.getenv('ANALYTICS_READ_PREFERENCE', 'primary'), os.getenv('ANALYTICS_MAX_STALENESS_SECONDS')
+)
+analytics_db = client.database(mongo_db, read_preference=analytics_read_preference)
 
 metrics.info('app_info', 'Application info', version='1.0.3')
 
+# Create the indexes the hot-path queries rely on; a failure is logged rather than fatal so the
+# service still starts when the database is briefly unavailable
+if os.getenv('ENSURE_INDEXES', 'true').lower() == 'true':
+    try:
+        indexes.ensure_indexes(db)
+    except Exception as error:
+        logger.warning(f"Could not ensure indexes: {error}")
+
+
+# Result cache for the resolvers; shared between workers through Redis when CACHE_REDIS_URL is set
+def create_result_cache():
+    ttl = float(os.getenv('CACHE_TTL_SECONDS', '60'))
+    redis_url = os.getenv('CACHE_REDIS_URL')
+    if redis_url:
+        import redis  # optional dependency, only needed for the shared backend
+        backend = SharedCacheBackend(redis.Redis.from_url(redis_url))
+    else:
+        backend = LocalCacheBackend(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '1024')))
+    return ResultCache(backend, ttl=ttl, registry=metrics.registry)
+
+
+result_cache = create_result_cache()
+# A local cache only sees the syncs of its own worker; the others' are found from the rollup
+# version they commit, so no worker keeps serving results they invalidated
+rollup_changes = rollups.RollupChanges() if isinstance(result_cache.backend, LocalCacheBackend) else None
+
+# Live per-user exercise totals pushed to subscribers, see live.py
+# LIVE_UPDATES_MODE is auto (change stream, polling when unavailable), changestream or poll
+live_updates = live.LiveUpdates(
+    db,
+    mode=os.getenv('LIVE_UPDATES_MODE', 'auto'),
+    poll_seconds=float(os.getenv('LIVE_POLL_SECONDS', '2')),
+    resync_seconds=float(os.getenv('LIVE_RESYNC_SECONDS', '300')),
+    registry=metrics.registry
+)
+live_keepalive_seconds = float(os.getenv('LIVE_KEEPALIVE_SECONDS', '15'))
+# Every SSE stream of the Flask app holds a worker thread for as long as it is open; past this
+# many per worker new streams are turned away, so the other requests keep their threads
+live_stream_slots = threading.BoundedSemaphore(int(os.getenv('LIVE_MAX_FLASK_STREAMS', '2')))
+
 # initialise the query type, load the schema and make it executable
 query = QueryType()
+granularity_enum = EnumType("Granularity", {"DAY": "day", "WEEK": "week", "MONTH": "month"})
 
 
 # GraphQL resolver for the 'stats' field
@@ -43,7 +154,7 @@ def resolve_stats(_, info):
         logger.info("Resolver called")
         # Fetch statistics from the database
         loadedStats = stats()
-        logger.info("Number of stats found:", len(loadedStats))
+        logger.info("Stats resolved", extra={"results": len(loadedStats)})
         payload = {
             "success": True,
             "results": loadedStats
@@ -58,11 +169,12 @@ def resolve_stats(_, info):
 
 
 # grapqhql resolver field filteredStats
+# All filteredStats aliases of a request are loaded together by the request's batching loader
 @query.field("filteredStats")
-def resolve_filteredStats(*_, name=None):
+def resolve_filteredStats(_, info, name=None):
     try:
-        loadedStats = user_stats(name)
-        logger.info("Number of user stats found:", len(loadedStats))
+        loadedStats = loaders.get_user_stats_loader(info, user_stats_many).load(name)
+        logger.info("User stats resolved", extra={"results": len(loadedStats)})
         payload = {
             "success": True,
             "results": loadedStats
@@ -76,13 +188,32 @@ def resolve_filteredStats(*_, name=None):
     return payload
 
 
+# GraphQL resolver for the 'multiUserStats' field
+# Fetches the stats of several users with a single rollup query
+@query.field("multiUserStats")
+def resolve_multiUserStats(_, info, names):
+    try:
+        loadedStats = loaders.get_user_stats_loader(info, user_stats_many).load_many(names)
+        payload = {
+            "success": True,
+            "results": [stats for user_results in loadedStats for stats in user_results]
+        }
+    except Exception as error:
+        logger.error(f"Error resolving multiUserStats: {error}")
+        payload = {
+            "success": False,
+            "errors": [str(error)]
+        }
+    return payload
+
+
 # GraphQL resolver for the 'weekly' field
 # Fetches aggregated exercise statistics for a specific user within a given time range
 # Calls the helper function 'get_weekly_stats' to query the MongoDB database
 @query.field("weekly")
-def resolve_weekly(_, info, user, start, end):
+def resolve_weekly(_, info, user, start, end, granularity=None):
     try:
-        weeklyStats = get_weekly_stats(user, start, end)
+        weeklyStats = get_weekly_stats(user, start, end, granularity)
         if not weeklyStats:
             logger.warning(f"No data found for user {user} from {start} to {end}.")
             return {
@@ -105,81 +236,102 @@ def resolve_weekly(_, info, user, start, end):
         }
 
 
+# GraphQL resolver for the 'trends' field
+# Long-range totals, weekly histogram, rolling average and streaks of a user, or of all users
+# when no user is given
+@query.field("trends")
+def resolve_trends(_, info, start, end, user=None, window=7):
+    try:
+        return {"success": True, "errors": [], "trends": get_trends(user, start, end, window)}
+    except Exception as error:
+        logger.error(f"Error resolving trends: {error}")
+        return {"success": False, "errors": [str(error)], "trends": None}
+
+
+# GraphQL resolver for the 'distribution' field
+# Count, mean, median, p90, min, max and standard deviation of the exercise durations per user
+# and exercise type, read from the duration sketches of the rollups
+@query.field("distribution")
+def resolve_distribution(_, info, user=None, exerciseType=None):
+    try:
+        return {"success": True, "errors": [], "results": get_distributions(user, exerciseType)}
+    except Exception as error:
+        logger.error(f"Error resolving distribution: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+# GraphQL resolver for the 'leaderboard' field
+# Top users by total duration of an exercise type (or all types) between two dates (or all
+# time); users with the same total share a rank and are listed by username
+@query.field("leaderboard")
+def resolve_leaderboard(_, info, exerciseType=None, start=None, end=None, limit=10):
+    try:
+        return {"success": True, "errors": [], "entries": get_leaderboard(exerciseType, start, end, limit)}
+    except Exception as error:
+        logger.error(f"Error resolving leaderboard: {error}")
+        return {"success": False, "errors": [str(error)], "entries": []}
+
+
+# Brings the rollups up to date with any exercises saved or deleted since the last call
+# Only the changes are read, so this is cheap when nothing changed
+# Cached results of the users whose exercises changed are invalidated
+def sync_and_invalidate():
+    touched = rollups.sync_rollups(db)
+    if rollup_changes is not None:
+        touched = rollups.run_steps(db, rollup_changes.steps())
+    invalidate_rollup_changes(touched)
+    return touched
+
+
+# The sync runs in the background every ROLLUP_SYNC_SECONDS; 0 syncs on every read instead
+rollup_refresher = rollups.RollupRefresher(
+    sync_and_invalidate, interval=float(os.getenv('ROLLUP_SYNC_SECONDS', str(rollups.DEFAULT_SYNC_SECONDS)))
+)
+
+
+# Called by every read of the rollups, see RollupRefresher
+def refresh_rollups():
+    rollup_refresher.refresh()
+
+
+# Invalidates the cached results of the changed users, or all of them when changed is None
+def invalidate_rollup_changes(changed):
+    if changed is None:
+        result_cache.clear()
+    else:
+        result_cache.invalidate_users(changed)
+
+
 # Fetches overall exercise stats grouped by user and exercise type
+# Served from the incrementally maintained rollups instead of aggregating every exercise
 def stats():
-    pipeline = [
-        {
-            "$group": {
-                "_id": {
-                    "username": "$username",
-                    "exerciseType": "$exerciseType"
-                },
-                "totalDuration": {"$sum": "$duration"}
-            }
-        },
-        {
-            "$group": {
-                "_id": "$_id.username",
-                "exercises": {
-                    "$push": {
-                        "exerciseType": "$_id.exerciseType",
-                        "totalDuration": "$totalDuration"
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "username": "$_id",
-                "exercises": 1,
-                "_id": 0
-            }
-        }
-    ]
-
-    stats = list(db.exercises.aggregate(pipeline))
-    return stats
+    refresh_rollups()
+    return result_cache.get_or_compute("stats", {}, None, lambda: rollups.read_stats(analytics_db))
 
 
 # Function to fetch user-specific stats
 def user_stats(username):
-    print(f"Fetching stats for user: {username}")
-
-    pipeline = [
-        {
-            "$match": {"username": username}
-        },
-        {
-            "$group": {
-                "_id": {
-                    "username": "$username",
-                    "exerciseType": "$exerciseType"
-                },
-                "totalDuration": {"$sum": "$duration"}
-            }
-        },
-        {
-            "$group": {
-                "_id": "$_id.username",
-                "exercises": {
-                    "$push": {
-                        "exerciseType": "$_id.exerciseType",
-                        "totalDuration": "$totalDuration"
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "username": "$_id",
-                "exercises": 1,
-                "_id": 0
-            }
-        }
-    ]
-
-    stats = list(db.exercises.aggregate(pipeline))
-    return stats
+    return user_stats_many([username])[username]
+
+
+# Fetches the stats of several users at once, returning {username: [stats]}
+# Cached users are served from the result cache, the rest with one {$in: [...]} rollup query
+def user_stats_many(usernames):
+    refresh_rollups()
+    results = {}
+    missing = {}
+    for username in usernames:
+        key, value = result_cache.lookup("filteredStats", {"name": username}, username)
+        if value is None:
+            missing[username] = key
+        else:
+            results[username] = value
+    if missing:
+        loaded = {row["username"]: [row] for row in rollups.read_stats(analytics_db, list(missing))}
+        for username, key in missing.items():
+            results[username] = loaded.get(username, [])
+            result_cache.store(key, results[username])
+    return results
 
 
 # rest endpoint for weekly to compare to newly implemented graphql endpoint
@@ -187,12 +339,13 @@ def weekly_user_stats_route():
     user = request.args.get("user")
     start = request.args.get("start")
     end = request.args.get("end")
+    granularity = request.args.get("granularity")
 
     if not user or not start or not end:
         return jsonify({"error": "Missing required parameters"}), 400
 
     try:
-        stats = get_weekly_stats(user, start, end)
+        stats = get_weekly_stats(user, start, end, granularity)
         return jsonify({"results": stats, "success": True}), 200
     except Exception as e:
         logger.error(f"Error fetching weekly stats: {e}")
@@ -200,10 +353,11 @@ def weekly_user_stats_route():
 
 
 # Helper function to fetch weekly exercise statistics for a specific user within a date range
-# Queries the MongoDB 'exercises' collection using an aggregation pipeline
-# Returns a list of exercises grouped by type and total duration
-def get_weekly_stats(user, start, end):
-    logger.info(f"Fetching weekly stats for user: {user}, time period: {start} - {end}")
+# Sums the daily rollup buckets, so the cost grows with the number of days rather than workouts
+# Returns a list of exercises grouped by type and total duration, one entry per period
+# when a granularity (day, week or month) is given
+def get_weekly_stats(user, start, end, granularity=None):
+    logger.info("Fetching weekly stats for user: %s, time period: %s - %s", user, start, end)
 
     # Parse the dates
     date_format = "%Y-%m-%d"
@@ -214,45 +368,76 @@ def get_weekly_stats(user, start, end):
         logger.error(f"Date parsing failed: {e}")
         return []
 
-    pipeline = [
-        {
-            "$match": {
-                "username": user,
-                "date": {
-                    "$gte": start_date,
-                    "$lte": end_date + timedelta(days=1)  # Include the entire end date
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": "$username",
-                "exercises": {
-                    "$push": {
-                        "exerciseType": "$exerciseType",
-                        "totalDuration": "$duration"
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "username": "$_id",
-                "exercises": 1,
-                "_id": 0
-            }
-        }
-    ]
-
     try:
-        stats = list(db.exercises.aggregate(pipeline))
-        logger.info(f"Pipeline results: {stats}")
+        refresh_rollups()
+        stats = result_cache.get_or_compute(
+            "weekly",
+            {"user": user, "start": start, "end": end, "granularity": granularity},
+            user,
+            lambda: rollups.read_period_stats(analytics_db, user, start_date, end_date, granularity)
+        )
+        logger.info("Weekly stats resolved", extra={"periods": len(stats)})
         return stats
     except Exception as e:
         logger.error(f"Error during aggregation: {e}")
         return []
 
 
+# Engine and data source of the trends field, see trends.py
+# ANALYTICS_ENGINE defaults to numpy when it is installed; TRENDS_SOURCE=exercises reads the
+# raw exercises instead of the daily rollups
+trends_engine = os.getenv('ANALYTICS_ENGINE') or trends.default_engine()
+trends_source = os.getenv('TRENDS_SOURCE', 'rollups')
+
+
+def parse_period(start, end):
+    date_format = "%Y-%m-%d"
+    return datetime.strptime(start, date_format), datetime.strptime(end, date_format)
+
+
+# Dates of an optional period; both or neither of start and end are expected
+def parse_optional_period(start, end):
+    if start is None and end is None:
+        return None, None
+    if start is None or end is None:
+        raise ValueError("'start' and 'end' must be given together")
+    return parse_period(start, end)
+
+
+def get_trends(user, start, end, window=7):
+    start_date, end_date = parse_period(start, end)
+    if trends_source == "rollups":
+        refresh_rollups()
+    return result_cache.get_or_compute(
+        "trends",
+        {"user": user, "start": start, "end": end, "window": window},
+        user,
+        lambda: trends.compute_trends(analytics_db, user, start_date, end_date, window, trends_source, trends_engine)
+    )
+
+
+def get_distributions(user, exercise_type):
+    refresh_rollups()
+    return result_cache.get_or_compute(
+        "distribution",
+        {"user": user, "exerciseType": exercise_type},
+        user,
+        lambda: rollups.read_distributions(analytics_db, user, exercise_type)
+    )
+
+
+# Leaderboards are cached for all users, so any new exercise invalidates them
+def get_leaderboard(exercise_type, start, end, limit=10):
+    start_date, end_date = parse_optional_period(start, end)
+    refresh_rollups()
+    return result_cache.get_or_compute(
+        "leaderboard",
+        {"exerciseType": exercise_type, "start": start, "end": end, "limit": limit},
+        None,
+        lambda: rollups.read_leaderboard(analytics_db, exercise_type, start_date, end_date, limit)
+    )
+
+
 # Global error handler for unhandled exceptions
 # Logs the error with traceback details and returns a generic 500 error response
 @app.errorhandler(Exception)
@@ -266,43 +451,194 @@ def handle_error(e):
 schema_directory = os.path.dirname(os.path.abspath(__file__))
 schema_path = os.path.join(schema_directory, "schema.graphql")
 type_defs = load_schema_from_path(schema_path)
-logger.info("Type Definitions Loaded: %s", type_defs)
-
-schema = make_executable_schema(type_defs, query)
+logger.info("Type definitions loaded", extra={"characters": len(type_defs)})
+
+schema = make_executable_schema(type_defs, query, granularity_enum)
+
+# Persisted queries (APQ) and the parsed/validated document cache for the GraphQL endpoint
+# PERSISTED_QUERIES_FILE optionally points to a JSON file of {sha256 hash: query} to preload
+persisted_queries = PersistedQueryRegistry(
+    max_entries=int(os.getenv('PERSISTED_QUERIES_MAX_ENTRIES', '1000')),
+    registry=metrics.registry,
+    path=os.getenv('PERSISTED_QUERIES_FILE')
+)
+document_cache = DocumentCache(
+    max_entries=int(os.getenv('GRAPHQL_DOCUMENT_CACHE_SIZE', '500')),
+    registry=metrics.registry
+)
+
+# Static cost, depth, alias and field limits checked before an operation is executed, see query_cost.py
+# The fields reading the rollups cost more than the fields nested in their results
+FIELD_COSTS = {
+    "Query.stats": FieldCost(50),
+    "Query.filteredStats": FieldCost(5),
+    "Query.multiUserStats": FieldCost(5, multiplier="names"),
+    "Query.weekly": FieldCost(10),
+    "Query.trends": FieldCost(20),
+    "Query.distribution": FieldCost(20),
+    "Query.leaderboard": FieldCost(20, multiplier="limit", default=10),
+    "Subscription.exerciseTotals": FieldCost(10)
+}
+query_cost_limiter = QueryCostLimiter(
+    schema,
+    FIELD_COSTS,
+    max_cost=int(os.getenv('GRAPHQL_MAX_COST', '2000')),
+    max_depth=int(os.getenv('GRAPHQL_MAX_DEPTH', '15')),
+    max_aliases=int(os.getenv('GRAPHQL_MAX_ALIASES', '30')),
+    max_fields=int(os.getenv('GRAPHQL_MAX_FIELDS', '2000')),
+    registry=metrics.registry
+)
 
 
 @app.route('/analytics/graphql', methods=['POST', 'OPTIONS'])
 def graphql_server():
     logger.info("Received a POST request")
     data = request.get_json()
-    success, result = graphql_sync(
-        schema,
-        data,
-        context_value=request,
-        debug=True
-    )
+    try:
+        data = persisted_queries.resolve(data)
+    except PersistedQueryError as error:
+        return jsonify(error.response), error.status_code
+    with slow_operation_recorder.track(data):
+        success, result = graphql_sync(
+            schema,
+            data,
+            context_value={"request": request},
+            query_parser=document_cache.parse,
+            query_validator=document_cache.validate,
+            validation_rules=query_cost_limiter.validation_rules,
+            middleware=[resolver_metrics],
+            debug=True
+        )
     status_code = 200 if success else 400
-    return jsonify(result), status_code
+    body, headers = response_serializer.encode(result, request.headers.get("Accept-Encoding"))
+    return Response(body, status=status_code, headers=headers)
+
 
+# Define the HTML for the GraphQL Playground, read on its first request
+GRAPHQL_PLAYGROUND_HTML_FP = os.path.join(schema_directory, "templates", "graphql_playground.html")
 
-# Define the HTML for GraphQL Playground
-GRAPHQL_PLAYGROUND_HTML_FP = "templates/graphql_playground.html"
-with open(GRAPHQL_PLAYGROUND_HTML_FP, 'r', encoding='utf-8') as file:
-    html_content = file.read()
+
+@functools.lru_cache(maxsize=None)
+def playground_html():
+    with open(GRAPHQL_PLAYGROUND_HTML_FP, 'r', encoding='utf-8') as file:
+        return file.read()
 
 
 # graphql playground for health check
 @app.route('/analytics/graphql', methods=['GET'])
 def graphql_playground():
-    return html_content, 200
+    return playground_html(), 200
 
 
 # rest endpoint serving as a health check and welcome page
+# Only pings the database; use /analytics/export to dump the exercises
 @app.route('/', methods=['GET'])
 def index():
-    exercises = db.exercises.find()
-    exercises_list = list(exercises)
-    return json_util.dumps(exercises_list)
+    client['admin'].command('ping')
+    return jsonify({"status": "ok", "service": heading}), 200
+
+
+# rest endpoint streaming the exercises as NDJSON (default) or CSV in constant memory
+# Query parameters: format, batch_size, fields (comma separated), username, start, end
+# and after_id to resume an interrupted export after the last exported _id
+@app.route('/analytics/export', methods=['GET'])
+def export_exercises():
+    try:
+        export_request = export.build_export_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = export.stream_exercises(analytics_db.exercises, export_request)
+    return Response(stream_with_context(rows), mimetype=export.FORMATS[export_request["format"]])
+
+
+# rest endpoint streaming the live exercise totals of a user as server-sent events
+# The first event is a snapshot of the totals; the following ones carry the exercise types
+# whose totals changed, with the new totals and the deltas
+# Answers 503 once LIVE_MAX_FLASK_STREAMS streams are open in this worker; the async serving
+# mode has no such limit
+@app.route('/analytics/live', methods=['GET'])
+def live_totals():
+    username = request.args.get("user")
+    if not username:
+        return jsonify({"error": "Missing required parameter: user"}), 400
+    if not live_stream_slots.acquire(blocking=False):
+        logger.warning("Live update stream rejected, all slots are taken")
+        response = jsonify({"error": "Too many live update streams, try again later"})
+        response.headers["Retry-After"] = str(int(live_keepalive_seconds))
+        return response, 503
+    try:
+        subscription = live_updates.subscribe(live.Subscription(username))
+    except Exception:
+        live_stream_slots.release()
+        raise
+
+    def events():
+        while True:
+            update = subscription.get(timeout=live_keepalive_seconds)
+            yield live.SSE_KEEPALIVE if update is None else live.sse_message(update)
+
+    # Runs when the stream is closed, also when the client leaves before the first event
+    def close():
+        live_updates.unsubscribe(subscription)
+        live_stream_slots.release()
+
+    # The events need no request context, which would otherwise stay pushed for as long as the
+    # stream is open
+    response = Response(events(), mimetype="text/event-stream", headers=live.SSE_HEADERS)
+    response.call_on_close(close)
+    return response
+
+
+# admin endpoint listing the recorded slow GraphQL operations, most recent first
+# Only served when the recorder and ADMIN_TOKEN are configured; expects 'Authorization: Bearer <ADMIN_TOKEN>'
+@app.route('/analytics/admin/slow-operations', methods=['GET'])
+def slow_operations_route():
+    if not slow_operation_recorder.enabled or not admin_token:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {admin_token}"):
+        return jsonify({"error": "Unauthorized"}), 401
+    entries = slow_operation_recorder.entries(request.args.get("limit", type=int))
+    return Response(slow_operations.dumps(entries), mimetype="application/json")
+
+
+# CLI command to backfill the rollups from the full exercises collection
+# Usage: flask --app app rebuild-rollups
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    touched = rollups.rebuild_rollups(db)
+    result_cache.clear()
+    click.echo(f"Rebuilt rollups for {len(touched)} users")
+
+
+# CLI command to compare the rollups with a full aggregation over the exercises
+# Usage: flask --app app check-rollups
+@app.cli.command("check-rollups")
+def check_rollups_command():
+    mismatches = rollups.check_consistency(db)
+    for mismatch in mismatches:
+        click.echo(json_util.dumps(mismatch))
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} rollups out of date, run rebuild-rollups")
+    click.echo("Rollups are consistent")
+
+
+# CLI command to create the declared indexes
+# Usage: flask --app app ensure-indexes
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    for collection, names in indexes.ensure_indexes(db).items():
+        click.echo(f"{collection}: {', '.join(names)}")
+
+
+# CLI command failing when a hot-path query would scan a whole collection
+# Usage: flask --app app check-query-plans
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    violations = indexes.check_query_plans(db)
+    if violations:
+        raise click.ClickException(f"COLLSCAN in query plans: {', '.join(violations)}")
+    click.echo("All hot-path queries use an index")
 
 
 if __name__ == "__main__":
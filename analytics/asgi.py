@@ -0,0 +1,392 @@
+import asyncio
+import contextlib
+import logging
+from datetime import datetime
+
+from ariadne import QueryType, SubscriptionType, make_executable_schema
+from ariadne.asgi import GraphQL
+from ariadne.asgi.handlers import GraphQLHTTPHandler, GraphQLTransportWSHandler
+from ariadne.exceptions import HttpError
+from motor.motor_asyncio import AsyncIOMotorClient
+from prometheus_client import make_asgi_app
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+
+import live
+import loaders
+import rollups
+import trends
+from app import (
+    analytics_read_preference, document_cache, granularity_enum, invalidate_rollup_changes, live_keepalive_seconds, live_updates,
+    metrics, mongo_command_metrics, mongo_db, mongo_pool_metrics, mongo_settings, mongo_uri, parse_optional_period, parse_period,
+    persisted_queries, query_cost_limiter, resolver_metrics, response_serializer, result_cache, rollup_changes, rollup_refresher,
+    trends_engine, trends_source, type_defs
+)
+from cache import LocalCacheBackend
+from graphql_cache import PersistedQueryError
+
+# Async serving mode for the analytics service
+# Run with: uvicorn asgi:app --host 0.0.0.0 --port 5050
+# The resolvers use the non-blocking Motor driver, so one worker serves many requests
+# concurrently while a request waits on Mongo. The Flask app in app.py is unchanged.
+
+logger = logging.getLogger(__name__)
+
+query = QueryType()
+subscription = SubscriptionType()
+
+# The Motor client is bound to the event loop, so it is created on startup rather than import
+mongo = {}
+
+
+def get_db():
+    return mongo["db"]
+
+
+# Database of the stats, weekly and trends reads, with ANALYTICS_READ_PREFERENCE as in app.py
+def get_analytics_db():
+    return mongo["analytics_db"]
+
+
+# Runs the steps of a rollups.RollupSync (or RollupChanges) with Motor, as rollups.run_steps
+# does with pymongo
+async def run_steps(adb, steps):
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = await execute_step(adb[step.collection], step)
+
+
+async def execute_step(collection, step):
+    if step.method == "find":
+        query, projection, sort, limit = step.args
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return await cursor.limit(limit).to_list(None)
+    if step.method == "aggregate":
+        return await collection.aggregate(*step.args).to_list(None)
+    return await getattr(collection, step.method)(*step.args, **step.kwargs)
+
+
+# Runs a result cache call off the event loop when the cache is shared: every call is then a
+# blocking round trip to Redis. The local cache only takes a lock, so it is called in place.
+async def cache_call(function, *args):
+    if isinstance(result_cache.backend, LocalCacheBackend):
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+
+async def sync_and_invalidate():
+    touched = await run_steps(get_db(), rollups.RollupSync().steps())
+    if rollup_changes is not None:
+        touched = await run_steps(get_db(), rollup_changes.steps())
+    if touched is None or touched:
+        await cache_call(invalidate_rollup_changes, touched)
+
+
+# Reads only sync in place with ROLLUP_SYNC_SECONDS=0; otherwise sync_periodically does,
+# as a task of the app's lifespan, like RollupRefresher does for the Flask app
+async def refresh_rollups():
+    if rollup_refresher.interval <= 0:
+        await sync_and_invalidate()
+
+
+async def sync_periodically():
+    while True:
+        try:
+            await sync_and_invalidate()
+        except Exception as error:
+            logger.warning(f"Rollup sync failed: {error}")
+        await asyncio.sleep(rollup_refresher.interval)
+
+
+# Serves resolver(arguments) from the result cache, awaiting load() on a miss
+async def cached(resolver, arguments, user, load):
+    key, value = await cache_call(result_cache.lookup, resolver, arguments, user)
+    if value is None:
+        value = await load()
+        await cache_call(result_cache.store, key, value)
+    return value
+
+
+# Lookups and stores of user_stats_many, batched so the misses cost one thread hop each way
+def lookup_users(resolver, usernames):
+    return {username: result_cache.lookup(resolver, {"name": username}, username) for username in usernames}
+
+
+def store_all(entries):
+    for key, value in entries:
+        result_cache.store(key, value)
+
+
+async def stats():
+    await refresh_rollups()
+
+    async def load():
+        cursor = get_analytics_db()[rollups.ROLLUPS_COLLECTION].find(rollups.stats_query(), rollups.STATS_PROJECTION)
+        return rollups.shape_stats(await cursor.sort(rollups.STATS_SORT).to_list(None))
+    return await cached("stats", {}, None, load)
+
+
+# Batch function of the per-request loader: one {$in: [...]} rollup query for the cache misses
+async def user_stats_many(usernames):
+    await refresh_rollups()
+    results = {}
+    missing = {}
+    for username, (key, value) in (await cache_call(lookup_users, "filteredStats", usernames)).items():
+        if value is None:
+            missing[username] = key
+        else:
+            results[username] = value
+    if missing:
+        cursor = get_analytics_db()[rollups.ROLLUPS_COLLECTION].find(rollups.stats_query(list(missing)), rollups.STATS_PROJECTION)
+        rows = rollups.shape_stats(await cursor.sort(rollups.STATS_SORT).to_list(None))
+        loaded = {row["username"]: [row] for row in rows}
+        for username in missing:
+            results[username] = loaded.get(username, [])
+        await cache_call(store_all, [(key, results[username]) for username, key in missing.items()])
+    return results
+
+
+async def get_weekly_stats(user, start, end, granularity=None):
+    date_format = "%Y-%m-%d"
+    try:
+        start_date = datetime.strptime(start, date_format)
+        end_date = datetime.strptime(end, date_format)
+    except ValueError as e:
+        logger.error(f"Date parsing failed: {e}")
+        return []
+    rollups.check_granularity(granularity)
+    await refresh_rollups()
+
+    async def load():
+        cursor = get_analytics_db()[rollups.DAILY_COLLECTION].find(
+            rollups.period_query(user, start_date, end_date), rollups.PERIOD_PROJECTION
+        )
+        return rollups.shape_period_stats(await cursor.to_list(None), user, granularity)
+    arguments = {"user": user, "start": start, "end": end, "granularity": granularity}
+    return await cached("weekly", arguments, user, load)
+
+
+async def get_trends(user, start, end, window=7):
+    start_date, end_date = parse_period(start, end)
+    if trends_source == "rollups":
+        await refresh_rollups()
+
+    async def load():
+        if trends_source == "rollups":
+            cursor = get_analytics_db()[rollups.DAILY_COLLECTION].find(
+                trends.rollup_query(user, start_date, end_date), trends.DAILY_PROJECTION
+            )
+            rows = await cursor.to_list(None)
+        else:
+            cursor = get_analytics_db().exercises.aggregate(trends.exercise_pipeline(user, start_date, end_date))
+            rows = trends.shape_pipeline_rows(await cursor.to_list(None))
+        return trends.trends_from_rows(rows, user, start_date, end_date, window, trends_engine)
+    return await cached("trends", {"user": user, "start": start, "end": end, "window": window}, user, load)
+
+
+async def get_distributions(user, exercise_type):
+    await refresh_rollups()
+
+    async def load():
+        cursor = get_analytics_db()[rollups.ROLLUPS_COLLECTION].find(
+            rollups.distribution_query(user, exercise_type), rollups.DISTRIBUTION_PROJECTION
+        )
+        return rollups.shape_distributions(await cursor.sort(rollups.STATS_SORT).to_list(None))
+    return await cached("distribution", {"user": user, "exerciseType": exercise_type}, user, load)
+
+
+async def get_leaderboard(exercise_type, start, end, limit=10):
+    start_date, end_date = parse_optional_period(start, end)
+    rollups.check_leaderboard(start_date, end_date, limit)
+    await refresh_rollups()
+
+    async def load():
+        adb = get_analytics_db()
+        if rollups.leaderboard_from_totals_index(exercise_type, start_date):
+            cursor = adb[rollups.ROLLUPS_COLLECTION].find(rollups.leaderboard_query(exercise_type), rollups.LEADERBOARD_PROJECTION)
+            cursor = cursor.sort(rollups.LEADERBOARD_SORT).limit(limit)
+        else:
+            collection = rollups.DAILY_COLLECTION if start_date is not None else rollups.ROLLUPS_COLLECTION
+            cursor = adb[collection].aggregate(rollups.leaderboard_pipeline(exercise_type, start_date, end_date, limit))
+        return rollups.rank_leaderboard(await cursor.to_list(None))
+    arguments = {"exerciseType": exercise_type, "start": start, "end": end, "limit": limit}
+    return await cached("leaderboard", arguments, None, load)
+
+
+# Wraps a resolver result in the StatsResult payload used by the Flask resolvers
+async def stats_payload(field, load):
+    try:
+        return {"success": True, "results": await load, "errors": []}
+    except Exception as error:
+        logger.error(f"Error resolving {field}: {error}")
+        return {"success": False, "results": [], "errors": [str(error) if str(error) else "Unknown error occurred."]}
+
+
+@query.field("stats")
+async def resolve_stats(_, info):
+    return await stats_payload("stats", stats())
+
+
+@query.field("filteredStats")
+async def resolve_filteredStats(_, info, name=None):
+    loader = loaders.get_async_user_stats_loader(info, user_stats_many)
+    return await stats_payload("filteredStats", loader.load(name))
+
+
+@query.field("multiUserStats")
+async def resolve_multiUserStats(_, info, names):
+    loader = loaders.get_async_user_stats_loader(info, user_stats_many)
+
+    async def load():
+        return [stats for user_results in await loader.load_many(names) for stats in user_results]
+    return await stats_payload("multiUserStats", load())
+
+
+@query.field("weekly")
+async def resolve_weekly(_, info, user, start, end, granularity=None):
+    return await stats_payload("weekly", get_weekly_stats(user, start, end, granularity))
+
+
+@query.field("trends")
+async def resolve_trends(_, info, start, end, user=None, window=7):
+    try:
+        return {"success": True, "errors": [], "trends": await get_trends(user, start, end, window)}
+    except Exception as error:
+        logger.error(f"Error resolving trends: {error}")
+        return {"success": False, "errors": [str(error)], "trends": None}
+
+
+@query.field("distribution")
+async def resolve_distribution(_, info, user=None, exerciseType=None):
+    try:
+        return {"success": True, "errors": [], "results": await get_distributions(user, exerciseType)}
+    except Exception as error:
+        logger.error(f"Error resolving distribution: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+@query.field("leaderboard")
+async def resolve_leaderboard(_, info, exerciseType=None, start=None, end=None, limit=10):
+    try:
+        return {"success": True, "errors": [], "entries": await get_leaderboard(exerciseType, start, end, limit)}
+    except Exception as error:
+        logger.error(f"Error resolving leaderboard: {error}")
+        return {"success": False, "errors": [str(error)], "entries": []}
+
+
+# Live updates come from the watcher thread of live_updates; the snapshot aggregation runs
+# in a thread so it does not block the event loop
+async def subscribe_live(username):
+    loop = asyncio.get_running_loop()
+    return await asyncio.to_thread(live_updates.subscribe, live.AsyncSubscription(username, loop))
+
+
+@subscription.source("exerciseTotals")
+async def exercise_totals_source(_, info, user):
+    updates = await subscribe_live(user)
+    try:
+        while True:
+            yield await updates.get()
+    finally:
+        live_updates.unsubscribe(updates)
+
+
+@subscription.field("exerciseTotals")
+def resolve_exercise_totals(update, info, user):
+    return update
+
+
+schema = make_executable_schema(type_defs, query, subscription, granularity_enum)
+
+
+# HTTP handler resolving persisted queries (APQ) before the query is executed
+class PersistedQueryHTTPHandler(GraphQLHTTPHandler):
+    async def graphql_http_server(self, request):
+        try:
+            data = await self.extract_data_from_request(request)
+        except HttpError as error:
+            return PlainTextResponse(error.message or error.status, status_code=400)
+        try:
+            data = persisted_queries.resolve(data)
+        except PersistedQueryError as error:
+            return JSONResponse(error.response, status_code=error.status_code)
+        success, result = await self.execute_graphql_query(request, data)
+        return await self.create_json_response(request, result, success)
+
+    # Encoded and compressed like the responses of the Flask app, see serialization.py
+    async def create_json_response(self, request, result, success):
+        body, headers = response_serializer.encode(result, request.headers.get("accept-encoding"))
+        return Response(body, status_code=200 if success else 400, headers=headers)
+
+
+# The cost limiter of the Flask app looks types up in its schema, built from the same type_defs
+graphql_app = GraphQL(
+    schema,
+    query_parser=document_cache.parse,
+    query_validator=document_cache.validate,
+    validation_rules=query_cost_limiter.validation_rules,
+    http_handler=PersistedQueryHTTPHandler(middleware=[resolver_metrics]),
+    websocket_handler=GraphQLTransportWSHandler(),
+    debug=True
+)
+
+
+async def health(request):
+    await get_db().command("ping")
+    return JSONResponse({"status": "ok"})
+
+
+# Server-sent events with the live exercise totals of a user, as /analytics/live in app.py
+async def live_totals(request):
+    username = request.query_params.get("user")
+    if not username:
+        return JSONResponse({"error": "Missing required parameter: user"}, status_code=400)
+    updates = await subscribe_live(username)
+
+    async def events():
+        try:
+            while True:
+                update = await updates.get(timeout=live_keepalive_seconds)
+                yield live.SSE_KEEPALIVE if update is None else live.sse_message(update)
+        finally:
+            live_updates.unsubscribe(updates)
+    return StreamingResponse(events(), media_type="text/event-stream", headers=live.SSE_HEADERS)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    client = AsyncIOMotorClient(mongo_uri, event_listeners=[mongo_command_metrics, mongo_pool_metrics], **mongo_settings)
+    mongo["db"] = client[mongo_db]
+    mongo["analytics_db"] = (
+        mongo["db"] if analytics_read_preference is None
+        else client.get_database(mongo_db, read_preference=analytics_read_preference)
+    )
+    syncing = asyncio.create_task(sync_periodically()) if rollup_refresher.interval > 0 else None
+    try:
+        yield
+    finally:
+        if syncing is not None:
+            syncing.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await syncing
+        live_updates.stop()
+        client.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/", health),
+        Route("/analytics/graphql", graphql_app, methods=["GET", "POST"]),
+        WebSocketRoute("/analytics/graphql", graphql_app),
+        Route("/analytics/live", live_totals),
+        Mount("/metrics", make_asgi_app(registry=metrics.registry))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,141 @@
+"""Benchmark of the request latency added by logging.
+
+Synthetic exercises (see synthetic.py) are loaded into a local MongoDB or mongomock, then
+the stats, filteredStats, weekly, distribution and leaderboard queries are sent to the
+GraphQL endpoint of the Flask app in-process under each logging configuration:
+
+    off           logging disabled, the baseline
+    sync text     text lines written by the request thread
+    sync json     JSON lines written by the request thread
+    async json    JSON lines handed to the listener thread (the default configuration)
+    async sampled as async json, keeping 10% of the INFO records of the app and werkzeug
+
+Records are written to a file (--log-file, a temporary file by default) so the numbers
+include real I/O. The result cache is kept between requests unless --uncached is passed,
+which leaves the request mostly to GraphQL and logging.
+
+    docker run --rm -p 27017:27017 mongo:7
+    python benchmarks/logging_overhead.py --sizes 100000 --output logging.json
+
+    python benchmarks/logging_overhead.py --mongomock --sizes 10000 --iterations 200
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from resolvers import QUERIES, benchmark_resolver, current_commit, import_service, parse_sizes, variables_for
+from synthetic import add_generator_arguments, generate_exercises, generator_options, load_exercises
+
+SAMPLING = {"app": 0.1, "werkzeug": 0.1}
+
+CONFIGURATIONS = {
+    "off": None,
+    "sync text": {"fmt": "text", "asynchronous": False},
+    "sync json": {"fmt": "json", "asynchronous": False},
+    "async json": {"fmt": "json", "asynchronous": True},
+    "async sampled": {"fmt": "json", "asynchronous": True, "sampling": SAMPLING}
+}
+
+
+# Applies one configuration; returns the AsyncLogging to stop once the requests are sent
+def configure(service, options, stream):
+    if options is None:
+        logging.disable(logging.CRITICAL)
+        return None
+    logging.disable(logging.NOTSET)
+    return service.structured_logging.configure_logging(stream=stream, **options)
+
+
+def run_configuration(service, client, name, args, stream):
+    async_logging = configure(service, CONFIGURATIONS[name], stream)
+    variables = variables_for(args)
+    started = time.perf_counter()
+    resolvers = {
+        query_name: benchmark_resolver(service, client, query, variables[query_name], args.iterations, not args.uncached)
+        for query_name, query in QUERIES.items()
+    }
+    if async_logging is not None:
+        # Time for the listener to write what the requests queued
+        async_logging.stop()
+    return resolvers, time.perf_counter() - started
+
+
+def run_size(service, size, args, stream):
+    db = service.db
+    db.exercises.delete_many({})
+    load_exercises(db.exercises, generate_exercises(size, **generator_options(args)))
+    service.rollups.rebuild_rollups(db)
+    service.result_cache.clear()
+
+    results = {}
+    with service.app.test_client() as client:
+        for name in CONFIGURATIONS:
+            written = stream.tell()
+            resolvers, seconds = run_configuration(service, client, name, args, stream)
+            stream.flush()
+            results[name] = {
+                "resolvers": resolvers,
+                "seconds_until_written": round(seconds, 2),
+                "log_bytes": stream.tell() - written
+            }
+    return {"documents": size, "configurations": results}
+
+
+def print_table(report):
+    print(f"{'documents':>10}  {'logging':<15}{'resolver':<14}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'log KB':>10}")
+    for run in report["runs"]:
+        for name, configuration in run["configurations"].items():
+            for resolver, result in configuration["resolvers"].items():
+                print(
+                    f"{run['documents']:>10}  {name:<15}{resolver:<14}{result['req_per_sec']:>10}{result['p50_ms']:>10}"
+                    f"{result['p90_ms']:>10}{result['p99_ms']:>10}{configuration['log_bytes'] / 1024:>10.0f}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[100000], help="comma separated document counts")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark_analytics")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a MongoDB server")
+    parser.add_argument("--iterations", type=int, default=500, help="timed requests per resolver and configuration")
+    parser.add_argument("--uncached", action="store_true", help="clear the result cache before every request")
+    parser.add_argument("--log-file", help="file the records are written to (default: a temporary file)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print the JSON report")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    service = import_service(args.mongo_uri, args.database, args.mongomock)
+    args.end = args.start + timedelta(days=args.days - 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_file = args.log_file or os.path.join(directory, "benchmark.log")
+        with open(log_file, "a", encoding="utf-8") as stream:
+            report = {
+                "commit": current_commit(),
+                "backend": "mongomock" if args.mongomock else "mongodb",
+                "cached": not args.uncached,
+                "generator": dict(generator_options(args), start=args.start.strftime("%Y-%m-%d")),
+                "runs": [run_size(service, size, args, stream) for size in args.sizes]
+            }
+    logging.disable(logging.CRITICAL)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Benchmark of the GraphQL resolvers (stats, filteredStats, weekly, distribution and
+leaderboard) as the exercise history grows.
+
+For every size, synthetic exercises (see synthetic.py) are loaded into a local MongoDB or
+mongomock, the rollups are rebuilt, and each resolver is queried through the GraphQL
+endpoint of the Flask app in-process. Reported per resolver: latency percentiles,
+throughput and the peak Python memory allocated by one request. The result cache is
+cleared before every request unless --cached is passed, so the numbers reflect the
+database work rather than cache hits.
+
+    docker run --rm -p 27017:27017 mongo:7
+    python benchmarks/resolvers.py --sizes 10000,1000000,10000000 --output results.json
+
+    python benchmarks/resolvers.py --mongomock --sizes 10000 --iterations 20
+
+mongomock scans documents in Python, so it is only practical for the smallest sizes; use
+it to check the harness, and a real MongoDB for numbers worth comparing. The JSON output
+records the commit so runs can be compared across commits.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess  # nosec B404 - only reads the current git commit
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest.mock import patch
+
+from serving_modes import percentile
+from synthetic import add_generator_arguments, generate_exercises, generator_options, load_exercises, username
+
+STATS_FIELDS = "success errors results { username period exercises { exerciseType totalDuration } }"
+
+QUERIES = {
+    "stats": "query { stats { %s } }" % STATS_FIELDS,
+    "filteredStats": "query($name: String) { filteredStats(name: $name) { %s } }" % STATS_FIELDS,
+    "weekly": "query($user: String!, $start: String!, $end: String!) {"
+              " weekly(user: $user, start: $start, end: $end, granularity: WEEK) { %s } }" % STATS_FIELDS,
+    "distribution": "query($user: String) { distribution(user: $user) {"
+                    " success errors results { username exercises { exerciseType count mean median p90 stddev } } } }",
+    "leaderboard": "query($start: String, $end: String) {"
+                   " leaderboard(exerciseType: \"Running\", start: $start, end: $end, limit: 50) {"
+                   " success errors entries { rank username totalDuration count } } }"
+}
+
+
+def parse_sizes(value):
+    return [int(size.replace("_", "")) for size in value.split(",") if size]
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(  # nosec B603 B607 - fixed command line
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Imports the Flask app against the benchmark database; with mongomock the client is
+# patched the same way the tests do it
+def import_service(mongo_uri, database, use_mongomock):
+    os.environ.update(MONGO_URI=mongo_uri, MONGO_DB=database)
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    if use_mongomock:
+        import mongomock
+
+        with patch("pymongo.MongoClient", return_value=mongomock.MongoClient()):
+            import app
+    else:
+        import app
+    return app
+
+
+def variables_for(args):
+    # The first user is the most active one under any skew
+    period = {"start": args.start.strftime("%Y-%m-%d"), "end": args.end.strftime("%Y-%m-%d")}
+    return {
+        "stats": {},
+        "filteredStats": {"name": username(0)},
+        "weekly": dict(period, user=username(0)),
+        "distribution": {"user": username(0)},
+        "leaderboard": period
+    }
+
+
+def run_query(client, query, variables):
+    response = client.post("/analytics/graphql", json={"query": query, "variables": variables})
+    payload = response.get_json()
+    result = next(iter(payload["data"].values()))
+    if response.status_code != 200 or not result["success"]:
+        raise RuntimeError(f"Query failed: {payload}")
+
+
+def benchmark_resolver(service, client, query, variables, iterations, cached):
+    run_query(client, query, variables)  # warm up
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if not cached:
+            service.result_cache.clear()
+        request_started = time.perf_counter()
+        run_query(client, query, variables)
+        latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    # Measured separately, tracemalloc slows down every allocation
+    if not cached:
+        service.result_cache.clear()
+    tracemalloc.start()
+    run_query(client, query, variables)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "req_per_sec": round(iterations / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+
+def run_size(service, size, args):
+    db = service.db
+    db.exercises.delete_many({})
+    started = time.perf_counter()
+    load_exercises(db.exercises, generate_exercises(size, **generator_options(args)))
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    service.rollups.rebuild_rollups(db)
+    rollup_seconds = time.perf_counter() - started
+    service.result_cache.clear()
+
+    variables = variables_for(args)
+    with service.app.test_client() as client:
+        resolvers = {
+            name: benchmark_resolver(service, client, query, variables[name], args.iterations, args.cached)
+            for name, query in QUERIES.items()
+        }
+    return {
+        "documents": size,
+        "load_seconds": round(load_seconds, 2),
+        "rollup_rebuild_seconds": round(rollup_seconds, 2),
+        "resolvers": resolvers
+    }
+
+
+def print_table(report):
+    print(f"{'documents':>10}  {'resolver':<14}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'peak KiB':>10}")
+    for run in report["runs"]:
+        for name, result in run["resolvers"].items():
+            print(
+                f"{run['documents']:>10}  {name:<14}{result['req_per_sec']:>10}{result['p50_ms']:>10}"
+                f"{result['p90_ms']:>10}{result['p99_ms']:>10}{result['peak_memory_kb']:>10}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[10000], help="comma separated document counts")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark_analytics")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a MongoDB server")
+    parser.add_argument("--iterations", type=int, default=100, help="timed requests per resolver")
+    parser.add_argument("--cached", action="store_true", help="keep the result cache between requests")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print the JSON report")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    service = import_service(args.mongo_uri, args.database, args.mongomock)
+    args.end = args.start + timedelta(days=args.days - 1)
+
+    report = {
+        "commit": current_commit(),
+        "backend": "mongomock" if args.mongomock else "mongodb",
+        "cached": args.cached,
+        "generator": dict(generator_options(args), start=args.start.strftime("%Y-%m-%d")),
+        "runs": []
+    }
+    for size in args.sizes:
+        report["runs"].append(run_size(service, size, args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark of the GraphQL response encoding: JSON backends and compression.
+
+For every size, synthetic exercises (see synthetic.py) are loaded into a local MongoDB or
+mongomock and the rollups are rebuilt. Two payloads are then encoded repeatedly:
+
+    stats      the result of the stats query, as returned by the GraphQL endpoint
+    exercises  the raw exercise documents, with their ObjectIds and dates
+
+with Flask's jsonify encoder (the previous GraphQL response path) and bson.json_util.dumps
+(the extended JSON of the CLI and admin outputs) as baselines, and every backend and
+encoding of serialization.ResponseSerializer. Reported per combination: latency
+percentiles, the encoded and sent sizes, and the throughput in MB of JSON per second.
+
+    docker run --rm -p 27017:27017 mongo:7
+    python benchmarks/serialization.py --sizes 1000000 --output serialization.json
+
+    python benchmarks/serialization.py --mongomock --sizes 20000 --iterations 5
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from bson import json_util
+
+from resolvers import QUERIES, current_commit, import_service, parse_sizes
+from serving_modes import percentile
+from synthetic import add_generator_arguments, generate_exercises, generator_options, load_exercises
+
+ENCODINGS = [None, "gzip", "br"]
+
+
+def stats_payload(service):
+    success, result = service.graphql_sync(service.schema, {"query": QUERIES["stats"]})
+    if not success or result.get("errors"):
+        raise RuntimeError(f"stats query failed: {result}")
+    return result
+
+
+def encoders(service, payload_name):
+    serialization = service.serialization
+    backends = ["json"] + (["orjson"] if serialization.orjson is not None else [])
+    combinations = {}
+    if payload_name == "stats":
+        combinations["flask jsonify"] = lambda data: service.app.json.dumps(data).encode("utf-8")
+    else:
+        combinations["bson json_util"] = lambda data: json_util.dumps(data).encode("utf-8")
+    for backend in backends:
+        for encoding in ENCODINGS:
+            if encoding is not None and encoding not in serialization.ResponseSerializer(encodings=[encoding]).encodings:
+                continue
+            serializer = serialization.ResponseSerializer(backend=backend, encodings=[encoding] if encoding else [], min_size=0)
+            name = f"{backend}/{encoding or 'identity'}"
+            combinations[name] = lambda data, serializer=serializer, encoding=encoding: serializer.encode(data, encoding)[0]
+    return combinations
+
+
+def benchmark_encoder(encode, data, json_bytes, iterations):
+    body = encode(data)  # warm up
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        encode(data)
+        latencies.append(time.perf_counter() - started)
+    median = percentile(latencies, 0.50)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(median * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "sent_bytes": len(body),
+        "ratio": round(len(body) / json_bytes, 3),
+        "mb_per_second": round(json_bytes / median / 1e6, 1)
+    }
+
+
+def run_size(service, size, args):
+    db = service.db
+    db.exercises.delete_many({})
+    load_exercises(db.exercises, generate_exercises(size, **generator_options(args)))
+    service.rollups.rebuild_rollups(db)
+    service.result_cache.clear()
+
+    payloads = {
+        "stats": stats_payload(service),
+        "exercises": {"results": list(db.exercises.find().limit(args.documents))}
+    }
+    results = {}
+    for payload_name, data in payloads.items():
+        # Throughput is counted in bytes of compact JSON, whatever the encoder produces
+        json_bytes = len(service.serialization.ResponseSerializer(backend="json").dumps(data))
+        results[payload_name] = {"json_bytes": json_bytes, "encoders": {
+            name: benchmark_encoder(encode, data, json_bytes, args.iterations)
+            for name, encode in encoders(service, payload_name).items()
+        }}
+    return {"documents": size, "payloads": results}
+
+
+def print_table(report):
+    print(f"{'documents':>10}  {'payload':<10}{'encoder':<20}{'p50 ms':>10}{'p90 ms':>10}{'sent KB':>10}{'ratio':>8}{'MB/s':>8}")
+    for run in report["runs"]:
+        for payload_name, payload in run["payloads"].items():
+            for name, result in payload["encoders"].items():
+                print(
+                    f"{run['documents']:>10}  {payload_name:<10}{name:<20}{result['p50_ms']:>10}{result['p90_ms']:>10}"
+                    f"{result['sent_bytes'] / 1024:>10.0f}{result['ratio']:>8}{result['mb_per_second']:>8}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[1000000], help="comma separated document counts")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark_analytics")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a MongoDB server")
+    parser.add_argument("--iterations", type=int, default=20, help="timed encodings per combination")
+    parser.add_argument("--documents", type=int, default=50000, help="raw exercises in the exercises payload")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print the JSON report")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    service = import_service(args.mongo_uri, args.database, args.mongomock)
+
+    report = {
+        "commit": current_commit(),
+        "backend": "mongomock" if args.mongomock else "mongodb",
+        "generator": dict(generator_options(args), start=args.start.strftime("%Y-%m-%d")),
+        "runs": [run_size(service, size, args) for size in args.sizes]
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Load benchmark comparing the sync (gunicorn + Flask) and async (uvicorn + ASGI) serving modes.
+
+Both modes of a service are started against the same Mongo instance, the same GraphQL query
+is fired at each from a pool of concurrent clients, and req/s plus latency percentiles are
+reported. Use a throwaway local Mongo as the stand-in for the production database, e.g.
+
+    docker run --rm -p 27017:27017 mongo:7
+    poetry install --with asgi
+    python benchmarks/serving_modes.py --service analytics --seed 20000
+
+Pass --json to get the results as JSON so runs can be compared across commits.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess  # nosec B404 - only starts the local servers under test
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from synthetic import generate_exercises, load_exercises
+
+SERVICES = {
+    "analytics": {
+        "dir": os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+        "path": "/analytics/graphql",
+        "database": "benchmark_analytics",
+        "query": "query { stats { success results { username exercises { exerciseType totalDuration } } } }"
+    },
+    "recipes": {
+        "dir": os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "recipes")),
+        "path": "/recipes/graphql",
+        "database": "benchmark_recipes",
+        "query": "query { recipes(first: 50) { success results { recipeName calories } } }"
+    }
+}
+
+MODES = {
+    "sync": ["gunicorn", "-b", "127.0.0.1:{port}", "-w", "{workers}", "app:app"],
+    "async": ["uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", "{port}", "--workers", "{workers}"]
+}
+
+
+def seed(mongo_uri, service, database, count):
+    from pymongo import MongoClient
+
+    db = MongoClient(mongo_uri)[database]
+    rng = random.Random(42)
+    if service == "analytics":
+        db.exercises.delete_many({})
+        load_exercises(db.exercises, generate_exercises(count, users=200))
+    else:
+        db.recipes.delete_many({})
+        db.recipes.insert_many([{
+            "recipeName": f"Recipe {n}",
+            "ingredients": [{"itemName": "item", "amount": rng.randint(1, 500)}],
+            "calories": rng.randint(100, 1500),
+            "nutrients": [{"nutrient": "Protein", "amount": rng.randint(0, 80)}]
+        } for n in range(count)])
+
+
+def start_server(mode, service, port, workers, mongo_uri):
+    command = [part.format(port=port, workers=workers) for part in MODES[mode]]
+    env = dict(os.environ, MONGO_URI=mongo_uri, MONGO_DB=SERVICES[service]["database"])
+    process = subprocess.Popen(  # nosec B603 - fixed command line
+        command, cwd=SERVICES[service]["dir"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)  # nosec B310 - local server
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:  # nosec B310 - local server
+        response.read()
+    return time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_load(url, query, requests, concurrency):
+    body = json.dumps({"query": query}).encode()
+    post(url, body)  # warm up
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda _: post(url, body), range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "req_per_sec": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=SERVICES, default="analytics")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--seed", type=int, default=0, help="replace the benchmark data with this many documents")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5950)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    service = SERVICES[args.service]
+    if args.seed:
+        seed(args.mongo_uri, args.service, service["database"], args.seed)
+
+    results = {}
+    for mode in MODES:
+        process = start_server(mode, args.service, args.port, args.workers, args.mongo_uri)
+        try:
+            url = f"http://127.0.0.1:{args.port}{service['path']}"
+            results[mode] = run_load(url, service["query"], args.requests, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        json.dump({"service": args.service, "workers": args.workers, "results": results}, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<8}{result['req_per_sec']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark of the start up time of the services: how long importing the app takes.
+
+Every run imports app.py in a fresh interpreter, as a container or a gunicorn master without
+preloading does on start, and reports the import time measured in that interpreter and the
+wall time of the whole process. Nothing is read from MongoDB: the client is only created on
+first use, and ENSURE_INDEXES is turned off. One untimed run first compiles the bytecode.
+
+With --top, the modules are also imported once under -X importtime, and the packages that
+take the longest to import (own time of all their modules) are listed per service.
+
+    python benchmarks/startup.py --runs 20 --top 10 --output startup.json
+
+    python benchmarks/startup.py --services analytics,recipes --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess  # nosec B404 - runs the Python interpreter on the services
+import sys
+import time
+from collections import defaultdict
+
+from resolvers import current_commit
+from serving_modes import percentile
+
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+IMPORT_APP = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+
+ENVIRONMENT = {
+    "MONGO_URI": "mongodb://localhost:27017",
+    "MONGO_DB": "benchmark_startup",
+    "ENSURE_INDEXES": "false",
+    "LOG_LEVEL": "WARNING"
+}
+
+
+def run_python(directory, arguments):
+    return subprocess.run(  # nosec B603 - fixed command line
+        [sys.executable] + arguments, cwd=directory, env=dict(os.environ, **ENVIRONMENT),
+        capture_output=True, text=True, check=True
+    )
+
+
+def time_import(directory):
+    started = time.perf_counter()
+    output = run_python(directory, ["-c", IMPORT_APP]).stdout
+    return float(output.strip().splitlines()[-1]), time.perf_counter() - started
+
+
+# Own import time per top-level package, in seconds, from the -X importtime report
+def package_times(directory):
+    report = run_python(directory, ["-X", "importtime", "-c", "import app"]).stderr
+    times = defaultdict(int)
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        times[name.strip().split(".")[0]] += int(own)
+    return {name: microseconds / 1e6 for name, microseconds in times.items()}
+
+
+def run_service(service, args):
+    directory = os.path.join(REPOSITORY, service)
+    time_import(directory)  # compiles the bytecode
+    imports, processes = zip(*(time_import(directory) for _ in range(args.runs)))
+    result = {
+        "service": service,
+        "runs": args.runs,
+        "import_p50_ms": round(percentile(imports, 0.50) * 1000, 1),
+        "import_p90_ms": round(percentile(imports, 0.90) * 1000, 1),
+        "process_p50_ms": round(percentile(processes, 0.50) * 1000, 1)
+    }
+    if args.top:
+        packages = sorted(package_times(directory).items(), key=lambda item: item[1], reverse=True)
+        result["packages_ms"] = {name: round(seconds * 1000, 1) for name, seconds in packages[:args.top]}
+    return result
+
+
+def print_table(report):
+    print(f"{'service':<12}{'import p50 ms':>15}{'import p90 ms':>15}{'process p50 ms':>16}")
+    for result in report["services"]:
+        print(f"{result['service']:<12}{result['import_p50_ms']:>15}{result['import_p90_ms']:>15}{result['process_p50_ms']:>16}")
+    for result in report["services"]:
+        if "packages_ms" in result:
+            print(f"\n{result['service']}: slowest packages to import (own time)")
+            for name, milliseconds in result["packages_ms"].items():
+                print(f"  {name:<30}{milliseconds:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default="analytics,recipes", help="comma separated service directories")
+    parser.add_argument("--runs", type=int, default=20, help="timed imports per service")
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest packages to import")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print the JSON report")
+    args = parser.parse_args()
+
+    report = {
+        "commit": current_commit(),
+        "python": sys.version.split()[0],
+        "services": [run_service(service, args) for service in args.services.split(",") if service]
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
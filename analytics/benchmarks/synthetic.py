@@ -0,0 +1,109 @@
+"""Synthetic exercise histories for benchmarks.
+
+Documents have the shape the activity-tracking service stores (username, exerciseType,
+description, duration, date and the mongoose timestamps). Activity is skewed across users
+with a Zipf-like distribution, every user has their own mix of exercise types, and dates
+are spread over a configurable span. Generation is deterministic for a given seed.
+
+Load 100k documents into a local MongoDB:
+
+    python benchmarks/synthetic.py --count 100000 --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import itertools
+import random
+from datetime import datetime, timedelta
+
+# Values of the exerciseType enum in activity-tracking/models/exercise.model.js
+EXERCISE_TYPES = ["Running", "Cycling", "Swimming", "Gym", "Other"]
+
+# Typical session length in minutes per exercise type
+DURATIONS = {
+    "Running": (15, 90),
+    "Cycling": (20, 180),
+    "Swimming": (15, 75),
+    "Gym": (30, 120),
+    "Other": (10, 60)
+}
+
+DEFAULT_START = datetime(2023, 1, 1)
+DEFAULT_BATCH_SIZE = 10000
+
+
+def username(rank):
+    return f"user{rank:06d}"
+
+
+# Relative activity of each user; skew 0 spreads exercises evenly, higher values
+# concentrate them on the first users
+def user_weights(users, skew):
+    return [1 / (rank + 1) ** skew for rank in range(users)]
+
+
+# Yields count exercise documents
+def generate_exercises(count, users=1000, start=DEFAULT_START, days=365, skew=1.0, seed=42):
+    if users < 1 or days < 1:
+        raise ValueError("users and days must be positive")
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(user_weights(users, skew)))
+    type_weights = [[rng.random() for _ in EXERCISE_TYPES] for _ in range(users)]
+    span = days * 24 * 60 * 60
+    for _ in range(count):
+        rank = rng.choices(range(users), cum_weights=cum_weights)[0]
+        exercise_type = rng.choices(EXERCISE_TYPES, weights=type_weights[rank])[0]
+        date = start + timedelta(seconds=rng.randrange(span))
+        yield {
+            "username": username(rank),
+            "exerciseType": exercise_type,
+            "description": f"{exercise_type} session",
+            "duration": rng.randint(*DURATIONS[exercise_type]),
+            "date": date,
+            "createdAt": date,
+            "updatedAt": date
+        }
+
+
+# Inserts the documents in unordered batches and returns how many were inserted
+def load_exercises(collection, documents, batch_size=DEFAULT_BATCH_SIZE):
+    inserted = 0
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, batch_size))
+        if not batch:
+            return inserted
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="length of the date span")
+    parser.add_argument("--start", type=lambda value: datetime.strptime(value, "%Y-%m-%d"), default=DEFAULT_START)
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of the activity per user")
+    parser.add_argument("--random-seed", type=int, default=42)
+
+
+def generator_options(args):
+    return {"users": args.users, "start": args.start, "days": args.days, "skew": args.skew, "seed": args.random_seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark_analytics")
+    parser.add_argument("--append", action="store_true", help="keep the existing exercises")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    collection = MongoClient(args.mongo_uri)[args.database].exercises
+    if not args.append:
+        collection.delete_many({})
+    inserted = load_exercises(collection, generate_exercises(args.count, **generator_options(args)))
+    print(f"Inserted {inserted} exercises into {args.database}.exercises")
+
+
+if __name__ == "__main__":
+    main()
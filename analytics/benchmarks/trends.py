@@ -0,0 +1,120 @@
+"""Benchmark of the trends computation per source and engine.
+
+For every size, synthetic exercises (see synthetic.py) are loaded into a local MongoDB or
+mongomock and the rollups are rebuilt. trends.compute_trends is then timed for the most
+active user and for all users over the whole span, with every combination of:
+
+    exercises / python  group by day and type in a Mongo pipeline, then loop in Python
+    exercises / numpy   load the raw exercises as columns and reduce them with NumPy
+    rollups / python    read the daily rollups and loop in Python
+    rollups / numpy     read the daily rollups as columns and reduce them with NumPy
+
+The first one is the baseline: it is what a plain aggregation pipeline costs.
+
+    docker run --rm -p 27017:27017 mongo:7
+    python benchmarks/trends.py --sizes 1000000 --output trends.json
+
+    python benchmarks/trends.py --mongomock --sizes 5000 --iterations 3
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import timedelta
+
+from resolvers import current_commit, import_service, parse_sizes
+from serving_modes import percentile
+from synthetic import add_generator_arguments, generate_exercises, generator_options, load_exercises, username
+
+COMBINATIONS = [("exercises", "python"), ("exercises", "numpy"), ("rollups", "python"), ("rollups", "numpy")]
+
+
+def benchmark_trends(service, user, args, source, engine):
+    def compute():
+        return service.trends.compute_trends(service.db, user, args.start, args.end, args.window, source, engine)
+
+    expected = compute()  # warm up
+    latencies = []
+    for _ in range(args.iterations):
+        started = time.perf_counter()
+        compute()
+        latencies.append(time.perf_counter() - started)
+    return expected, {
+        "iterations": args.iterations,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2)
+    }
+
+
+def run_size(service, size, args, combinations):
+    db = service.db
+    db.exercises.delete_many({})
+    load_exercises(db.exercises, generate_exercises(size, **generator_options(args)))
+    started = time.perf_counter()
+    service.rollups.rebuild_rollups(db)
+    rollup_seconds = time.perf_counter() - started
+
+    results = {}
+    for scope, user in (("user", username(0)), ("all", None)):
+        baseline = None
+        for source, engine in combinations:
+            trends, timings = benchmark_trends(service, user, args, source, engine)
+            # Every combination must return the same trends as the first one
+            if baseline is None:
+                baseline = trends
+            elif trends != baseline:
+                raise RuntimeError(f"{source}/{engine} trends differ from {combinations[0][0]}/{combinations[0][1]}")
+            results[f"{scope} {source}/{engine}"] = timings
+    return {"documents": size, "rollup_rebuild_seconds": round(rollup_seconds, 2), "trends": results}
+
+
+def print_table(report):
+    print(f"{'documents':>10}  {'scope source/engine':<26}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}")
+    for run in report["runs"]:
+        for name, result in run["trends"].items():
+            print(f"{run['documents']:>10}  {name:<26}{result['p50_ms']:>10}{result['p90_ms']:>10}{result['max_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[1000000], help="comma separated document counts")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark_analytics")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a MongoDB server")
+    parser.add_argument("--iterations", type=int, default=10, help="timed computations per combination")
+    parser.add_argument("--window", type=int, default=7, help="rolling average window in days")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print the JSON report")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    service = import_service(args.mongo_uri, args.database, args.mongomock)
+    args.end = args.start + timedelta(days=args.days - 1)
+    combinations = [
+        (source, engine) for source, engine in COMBINATIONS
+        if engine == "python" or service.trends.NUMPY_AVAILABLE
+    ]
+
+    report = {
+        "commit": current_commit(),
+        "backend": "mongomock" if args.mongomock else "mongodb",
+        "window": args.window,
+        "generator": dict(generator_options(args), start=args.start.strftime("%Y-%m-%d")),
+        "runs": [run_size(service, size, args, combinations) for size in args.sizes]
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
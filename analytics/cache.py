@@ -0,0 +1,219 @@
+import fnmatch
+import json
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+# Generation counter bumped whenever any user's data changes; queries spanning all users
+# (e.g. 'stats') are keyed on it so they are invalidated by every write
+ALL_USERS = "*"
+
+
+# Interface every cache backend implements
+# Values are opaque to the backend; ttl is in seconds
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    # Generation counters are never evicted; bumping one makes keys built on it unreachable
+    def generation(self, key):
+        raise NotImplementedError
+
+    def bump(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# In-process LRU cache with a size bound and per-entry expiry
+# on_evict is called with the number of entries dropped to make room
+class LocalCacheBackend(CacheBackend):
+    def __init__(self, max_entries=1024, on_evict=None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    def generation(self, key):
+        return self._counters.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Cache shared between workers, backed by a Redis-compatible client
+# The client only needs get, set(ex=...), incr, scan_iter and delete, so redis.Redis works as is
+# Generations are stored in the shared store too, so an invalidation reaches every worker
+class SharedCacheBackend(CacheBackend):
+    # Keys deleted per DEL command by clear()
+    CLEAR_BATCH_SIZE = 500
+
+    def __init__(self, client, prefix="analytics:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None  # nosec B301 - values are written by this service only
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def generation(self, key):
+        return int(self.client.get(self.prefix + "gen:" + key) or 0)
+
+    def bump(self, key):
+        return self.client.incr(self.prefix + "gen:" + key)
+
+    # Deletes the keys under this backend's prefix only; the database may be shared with
+    # other services or caches. SCAN walks the keyspace incrementally, without blocking the
+    # server the way KEYS would.
+    def clear(self):
+        pattern = re.sub(r"([*?\[\]])", r"\\\1", self.prefix) + "*"
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=self.CLEAR_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == self.CLEAR_BATCH_SIZE:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+
+# Local stand-in for a Redis server, used by tests and in development
+# Implements just the commands SharedCacheBackend relies on
+class InMemorySharedStore:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, (0, None))[0]) + 1
+            self._data[key] = (value, None)
+            return value
+
+    def scan_iter(self, match="*", count=None):
+        with self._lock:
+            keys = [key for key in self._data if fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+# Caches resolver results keyed by resolver name and arguments
+# Each key embeds the generation of the users it depends on, so invalidating a user only
+# bumps a counter and never has to enumerate keys; stale entries age out through the LRU/TTL
+class ResultCache:
+    def __init__(self, backend, ttl=60, registry=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = None
+        if registry is not None:
+            self.hits = Counter('analytics_cache_hits_total', 'Result cache hits', ['resolver'], registry=registry)
+            self.misses = Counter('analytics_cache_misses_total', 'Result cache misses', ['resolver'], registry=registry)
+            self.evictions = Counter('analytics_cache_evictions_total', 'Result cache entries evicted to stay within the size bound', registry=registry)
+        if isinstance(backend, LocalCacheBackend) and backend.on_evict is None:
+            backend.on_evict = self._record_evictions
+
+    def _record_evictions(self, count):
+        if self.evictions is not None:
+            self.evictions.inc(count)
+
+    def _key(self, resolver, arguments, user):
+        generation = self.backend.generation(ALL_USERS if user is None else user)
+        encoded = json.dumps(arguments, sort_keys=True, default=str)
+        return f"{resolver}:{user}:{generation}:{encoded}"
+
+    # Looks up resolver(arguments) and returns (key, value); value is None on a miss
+    # and the key can be passed to store() once the result is computed
+    # user is the username the result depends on, or None when it spans all users
+    def lookup(self, resolver, arguments, user):
+        key = self._key(resolver, arguments, user)
+        value = self.backend.get(key)
+        counter = self.hits if value is not None else self.misses
+        if counter is not None:
+            counter.labels(resolver=resolver).inc()
+        return key, value
+
+    def store(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    # Returns the cached result for resolver(arguments) or computes and stores it
+    def get_or_compute(self, resolver, arguments, user, compute):
+        key, value = self.lookup(resolver, arguments, user)
+        if value is None:
+            value = compute()
+            self.store(key, value)
+        return value
+
+    # Invalidation hook: drops every cached result that depends on one of the users
+    def invalidate_users(self, usernames):
+        usernames = list(usernames)
+        if not usernames:
+            return
+        for username in usernames:
+            self.backend.bump(username)
+        self.backend.bump(ALL_USERS)
+
+    def clear(self):
+        self.backend.clear()
@@ -0,0 +1,90 @@
+import math
+
+# Duration distributions of a user and exercise type, answered from the rollups
+# Each rollup row keeps, besides the count and total duration, the sum of squared durations,
+# the min and max, and a sketch of the durations: a DDSketch-style histogram counting the
+# durations per logarithmic bucket. Bucket i holds the durations in (GAMMA^(i-1), GAMMA^i], so
+# any quantile read from the sketch is within RELATIVE_ACCURACY of the exact one, and durations
+# from 1 minute to a day need under 400 buckets. Sketches are merged by adding their bucket
+# counts, which is what the rollup updates do with $inc, and a duration is removed by
+# decrementing its bucket; they can therefore be combined across rows in any order.
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Bucket of the durations of 0 (and below), which have no logarithm
+ZERO_BUCKET = "z"
+
+SKETCH_FIELD = "sketch"
+
+
+# Sketch bucket of a duration, as stored in the rollups (field names are strings)
+def bucket_key(duration):
+    if duration <= 0:
+        return ZERO_BUCKET
+    return str(math.ceil(math.log(duration) / LOG_GAMMA))
+
+
+# Value standing for the durations of a bucket: the one within RELATIVE_ACCURACY of both ends
+def bucket_value(key):
+    if key == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+
+# $inc of the distribution fields for adding (sign 1) or removing (sign -1) a duration
+def distribution_inc(duration, sign=1):
+    return {"sumSquares": sign * duration * duration, f"{SKETCH_FIELD}.{bucket_key(duration)}": sign}
+
+
+# The q quantile (0 to 1) of the durations in a sketch by nearest rank, i.e. the value of the
+# ceil(q x count)-th smallest duration, clamped to the exact min and max
+def quantile(sketch, q, minimum=None, maximum=None):
+    count = sum(sketch.values())
+    if not count:
+        return None
+    # Rounded first so that e.g. 0.9 x 10 (9.000000000000002) is rank 9
+    rank = max(math.ceil(round(q * count, 9)), 1)
+    seen = sketch.get(ZERO_BUCKET, 0)
+    value = 0.0
+    if seen < rank:
+        for key in sorted((key for key in sketch if key != ZERO_BUCKET), key=int):
+            seen += sketch[key]
+            if seen >= rank:
+                value = bucket_value(key)
+                break
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def _rounded(value):
+    return round(value, 2) if value is not None else None
+
+
+# Count, mean, median, p90, min, max and (population) standard deviation of a rollup row
+# Rows written before the sketches were added have no sketch, min, max or sum of squares
+# until the rollups are rebuilt; their median, p90, min, max and stddev are None
+def summarize(row):
+    count = row.get("count", 0)
+    sketch = row.get(SKETCH_FIELD) or {}
+    minimum, maximum = row.get("minDuration"), row.get("maxDuration")
+    summary = {
+        "exerciseType": row["exerciseType"],
+        "count": count,
+        "mean": None,
+        "median": _rounded(quantile(sketch, 0.5, minimum, maximum)),
+        "p90": _rounded(quantile(sketch, 0.9, minimum, maximum)),
+        "min": minimum,
+        "max": maximum,
+        "stddev": None
+    }
+    if count:
+        mean = row.get("totalDuration", 0) / count
+        summary["mean"] = _rounded(mean)
+        if "sumSquares" in row:
+            summary["stddev"] = _rounded(math.sqrt(max(row["sumSquares"] / count - mean * mean, 0.0)))
+    return summary
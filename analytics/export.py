@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+
+# Columns written by the CSV export when no field projection is requested
+DEFAULT_CSV_FIELDS = ["_id", "username", "exerciseType", "description", "duration", "date"]
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+# Converts BSON values to plain JSON/CSV friendly values
+def _encode_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+
+
+def _parse_batch_size(value):
+    try:
+        batch_size = int(value)
+    except ValueError:
+        raise ValueError("'batch_size' must be an integer")
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f"'batch_size' must be between 1 and {MAX_BATCH_SIZE}")
+    return batch_size
+
+
+# Translates the username, start/end date and after_id parameters into a Mongo filter
+def _build_filter(args):
+    query = {}
+    if args.get("username"):
+        query["username"] = args["username"]
+    date_range = {}
+    if args.get("start"):
+        date_range["$gte"] = _parse_date(args["start"], "start")
+    if args.get("end"):
+        # Include the entire end date
+        date_range["$lt"] = _parse_date(args["end"], "end") + timedelta(days=1)
+    if date_range:
+        query["date"] = date_range
+    if args.get("after_id"):
+        try:
+            query["_id"] = {"$gt": ObjectId(args["after_id"])}
+        except (InvalidId, TypeError):
+            raise ValueError("'after_id' must be an exercise id")
+    return query
+
+
+# Builds the find() arguments for an export request from its query string parameters
+# Raises ValueError for invalid parameters so the route can answer with a 400
+def build_export_query(args):
+    export_format = args.get("format", "ndjson")
+    if export_format not in FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(FORMATS)}")
+
+    fields = [field for field in args.get("fields", "").split(",") if field]
+    # Mongo always returns _id; it is dropped from the output unless listed in fields
+    projection = {field: 1 for field in fields} if fields else None
+
+    return {
+        "format": export_format,
+        "query": _build_filter(args),
+        "projection": projection,
+        "fields": fields,
+        "batch_size": _parse_batch_size(args.get("batch_size", DEFAULT_BATCH_SIZE))
+    }
+
+
+# Yields one JSON document per line; the _id of the last line is the after_id to resume from
+def iter_ndjson(cursor, fields=None):
+    for document in cursor:
+        if fields:
+            document = {field: document.get(field) for field in fields}
+        yield json.dumps(document, default=_encode_value) + "\n"
+
+
+# Yields the CSV header followed by one row per document, written through a reusable buffer
+def iter_csv(cursor, fields=None):
+    columns = fields or DEFAULT_CSV_FIELDS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for document in cursor:
+        writer.writerow([
+            _encode_value(value) if isinstance(value, (ObjectId, datetime)) else value
+            for value in (document.get(column) for column in columns)
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# Streams the matching exercises in _id order from a cursor that fetches batch_size documents at a time
+def stream_exercises(collection, export):
+    cursor = collection.find(export["query"], export["projection"]).sort("_id", 1).batch_size(export["batch_size"])
+    if export["format"] == "csv":
+        return iter_csv(cursor, export["fields"])
+    return iter_ndjson(cursor, export["fields"])
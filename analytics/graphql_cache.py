@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from graphql import parse, validate
+from prometheus_client import Counter
+
+# Persisted queries (Apollo APQ protocol) and a cache of parsed and validated documents
+# Both plug into Ariadne: the registry rewrites the request data before execution, the
+# document cache is passed as query_parser/query_validator so repeated queries skip
+# parse and validate entirely
+
+PERSISTED_QUERY_NOT_FOUND = "PERSISTED_QUERY_NOT_FOUND"
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+# Raised when a persisted query request cannot be resolved
+# response is the GraphQL error payload Apollo clients expect
+class PersistedQueryError(Exception):
+    def __init__(self, message, code, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = {"errors": [{"message": message, "extensions": {"code": code}}]}
+
+
+# Small thread-safe LRU map shared by the registry and the document cache
+class _LRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Maps sha256 hashes to query strings
+# Queries listed in a JSON file ({hash: query}) are always available; queries registered
+# by clients through APQ are kept in a bounded LRU
+class PersistedQueryRegistry:
+    def __init__(self, max_entries=1000, registry=None, path=None):
+        self._static = {}
+        self._registered = _LRU(max_entries)
+        self.hits = self.misses = None
+        if registry is not None:
+            self.hits = Counter('graphql_persisted_query_hits_total', 'Persisted query hashes found in the registry', registry=registry)
+            self.misses = Counter('graphql_persisted_query_misses_total', 'Persisted query hashes not found in the registry', registry=registry)
+        if path:
+            with open(path, 'r', encoding='utf-8') as file:
+                self._static.update(json.load(file))
+
+    def get(self, sha256_hash):
+        return self._static.get(sha256_hash) or self._registered.get(sha256_hash)
+
+    def register(self, query):
+        sha256_hash = query_hash(query)
+        if sha256_hash not in self._static:
+            self._registered.set(sha256_hash, query)
+        return sha256_hash
+
+    # Returns the request data with 'query' filled in from the registry when the client only
+    # sent a hash, and registers the query when the client sent both
+    def resolve(self, data):
+        persisted = (data.get("extensions") or {}).get("persistedQuery") if isinstance(data, dict) else None
+        if not persisted:
+            return data
+        if persisted.get("version") != 1:
+            raise PersistedQueryError("Unsupported persisted query version", "PERSISTED_QUERY_VERSION_NOT_SUPPORTED", 400)
+        sha256_hash = persisted.get("sha256Hash")
+        if data.get("query"):
+            if query_hash(data["query"]) != sha256_hash:
+                raise PersistedQueryError("provided sha does not match query", "INVALID_PERSISTED_QUERY", 400)
+            self.register(data["query"])
+            return data
+        query = self.get(sha256_hash)
+        counter = self.hits if query is not None else self.misses
+        if counter is not None:
+            counter.inc()
+        if query is None:
+            raise PersistedQueryError("PersistedQueryNotFound", PERSISTED_QUERY_NOT_FOUND, 200)
+        return dict(data, query=query)
+
+
+# LRU of parsed documents keyed by query hash, remembering which ones passed validation
+class DocumentCache:
+    def __init__(self, max_entries=500, registry=None):
+        # query hash -> (document, set of validation rule sets the document passed)
+        self._entries = _LRU(max_entries)
+        self.hits = self.misses = None
+        if registry is not None:
+            self.hits = Counter('graphql_document_cache_hits_total', 'GraphQL documents served from the parse/validate cache', registry=registry)
+            self.misses = Counter('graphql_document_cache_misses_total', 'GraphQL documents parsed and validated', registry=registry)
+
+    # Ariadne query_parser hook
+    def parse(self, context_value, data):
+        key = query_hash(data["query"])
+        entry = self._entries.get(key)
+        counter = self.hits if entry is not None else self.misses
+        if counter is not None:
+            counter.inc()
+        if entry is None:
+            entry = (parse(data["query"]), set())
+            self._entries.set(key, entry)
+        return entry[0]
+
+    # Ariadne query_validator hook; a cached document that already passed the same rules
+    # is not validated again. Rules that depend on the request (query_cost.py) are only added
+    # for requests they reject, so a document is never cached as passing them; such a rule is
+    # run alone, the request failing whatever the others find
+    def validate(self, schema, document_ast, rules=None, max_errors=None, type_info=None):
+        rejections = [rule for rule in rules or () if getattr(rule, "rejects_operation", False)]
+        if rejections:
+            return validate(schema, document_ast, rules=rejections, max_errors=max_errors, type_info=type_info)
+        rules_key = (id(schema), tuple(rules or ()))
+        entry = self._entries.get(_source_hash(document_ast))
+        if entry is not None and entry[0] is document_ast and rules_key in entry[1]:
+            return []
+        errors = validate(schema, document_ast, rules=rules, max_errors=max_errors, type_info=type_info)
+        if not errors and entry is not None and entry[0] is document_ast:
+            entry[1].add(rules_key)
+        return errors
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Hash of the query string a parsed document was built from
+def _source_hash(document_ast):
+    if document_ast.loc is None:
+        return None
+    return query_hash(document_ast.loc.source.body)
@@ -0,0 +1,145 @@
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+import export
+import live
+import rollups
+import trends
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the hot-path queries of the analytics service, per collection
+# create_indexes is a no-op for indexes that already exist with the same spec, so
+# ensure_indexes can run on every startup
+INDEXES = {
+    "exercises": [
+        IndexModel([("username", ASCENDING), ("date", ASCENDING)], name="username_date"),
+        IndexModel([("username", ASCENDING), ("exerciseType", ASCENDING)], name="username_exerciseType"),
+        # edits read by the rollup sync in (updatedAt, _id) order, and polled by the live
+        # updates watcher when change streams are not available
+        IndexModel([("updatedAt", ASCENDING), ("_id", ASCENDING)], name="updatedAt__id")
+    ],
+    rollups.ROLLUPS_COLLECTION: [
+        IndexModel([("username", ASCENDING), ("exerciseType", ASCENDING)], name="username_exerciseType", unique=True),
+        # all-time leaderboards of one exercise type are read in order from this index
+        IndexModel(
+            [("exerciseType", ASCENDING), ("totalDuration", DESCENDING), ("username", ASCENDING)],
+            name="exerciseType_totalDuration_username"
+        )
+    ],
+    rollups.DAILY_COLLECTION: [
+        IndexModel(
+            [("username", ASCENDING), ("day", ASCENDING), ("exerciseType", ASCENDING)],
+            name="username_day_exerciseType",
+            unique=True
+        ),
+        # trends over all users read a date range of the daily rollups
+        IndexModel([("day", ASCENDING)], name="day"),
+        # leaderboards of one exercise type over a date range; covers the fields they sum
+        IndexModel(
+            [
+                ("exerciseType", ASCENDING), ("day", ASCENDING), ("username", ASCENDING),
+                ("totalDuration", ASCENDING), ("count", ASCENDING)
+            ],
+            name="exerciseType_day_username"
+        )
+    ],
+    rollups.BATCHES_COLLECTION: [
+        # the unfinished batch a sync has to apply again
+        IndexModel([("status", ASCENDING)], name="status"),
+        # finished batches are only kept for a day
+        IndexModel([("done_at", ASCENDING)], name="done_at", expireAfterSeconds=86400)
+    ]
+}
+
+
+# Creates the declared indexes and returns the names created per collection
+def ensure_indexes(db):
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = db[collection].create_indexes(indexes)
+    return created
+
+
+# Explain command bodies of the queries issued by the resolvers and syncs
+def find_command(collection, query, sort=None):
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    return command
+
+
+def aggregate_command(collection, pipeline):
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+
+# Hot-path queries as (name, explain command), built with representative values by the same
+# builders the resolvers, the rollup sync, the export and the live updates use, so a change
+# to a query is checked as it is issued. Left out are the reads of a whole collection by
+# design: the leaderboard of every type of all time and the raw trends of all users.
+def hot_path_queries():
+    day = datetime(2024, 1, 1)
+    key = {"username": "user", "exerciseType": "Running"}
+    export_query = export.build_export_query({"username": "user", "start": "2024-01-01", "end": "2024-01-31"})
+    return [
+        ("rollup sync", find_command("exercises", rollups.new_exercises_query(ObjectId()), [("_id", 1)])),
+        ("rollup sync of edits", find_command("exercises", rollups.edited_exercises_query(day, ObjectId()), rollups.EDITED_SORT)),
+        ("rollup journal", find_command(rollups.BATCHES_COLLECTION, rollups.PENDING_QUERY, [("_id", 1)])),
+        ("rollup min and max", aggregate_command("exercises", rollups.bounds_pipeline([key]))),
+        ("stats", find_command(rollups.ROLLUPS_COLLECTION, rollups.stats_query(), rollups.STATS_SORT)),
+        ("filtered stats", find_command(rollups.ROLLUPS_COLLECTION, rollups.stats_query(["user"]), rollups.STATS_SORT)),
+        ("weekly", find_command(rollups.DAILY_COLLECTION, rollups.period_query("user", day, day))),
+        (
+            "distribution",
+            find_command(rollups.ROLLUPS_COLLECTION, rollups.distribution_query("user", "Running"), rollups.STATS_SORT)
+        ),
+        (
+            "leaderboard",
+            find_command(rollups.ROLLUPS_COLLECTION, rollups.leaderboard_query("Running"), rollups.LEADERBOARD_SORT)
+        ),
+        (
+            "leaderboard for a period",
+            aggregate_command(rollups.DAILY_COLLECTION, rollups.leaderboard_pipeline("Running", day, day, 10))
+        ),
+        (
+            "leaderboard of every type for a period",
+            aggregate_command(rollups.DAILY_COLLECTION, rollups.leaderboard_pipeline(None, day, day, 10))
+        ),
+        ("trends", find_command(rollups.DAILY_COLLECTION, trends.rollup_query("user", day, day))),
+        ("trends for all users", find_command(rollups.DAILY_COLLECTION, trends.rollup_query(None, day, day))),
+        ("trends from the exercises", aggregate_command("exercises", trends.exercise_pipeline("user", day, day))),
+        ("export by user and date", find_command("exercises", export_query["query"], [("_id", 1)])),
+        ("live updates snapshot", aggregate_command("exercises", live.totals_pipeline("user"))),
+        ("live updates poll", find_command("exercises", live.updated_exercises_query(day, ObjectId())))
+    ]
+
+
+# Returns the stages of a query plan that scan a whole collection
+# Handles find and aggregate explain output, including sharded and multi-input plans
+def find_collscans(plan):
+    collscans = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            collscans.append(plan)
+        for key, value in plan.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            collscans.extend(find_collscans(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            collscans.extend(find_collscans(item))
+    return collscans
+
+
+# Explains every hot-path query and returns the names of the ones doing a COLLSCAN
+# Only the query planner runs; the queries are not executed
+def check_query_plans(db):
+    violations = []
+    for name, command in hot_path_queries():
+        if find_collscans(db.command("explain", command, verbosity="queryPlanner")):
+            logger.warning(f"Query plan for '{name}' is a COLLSCAN")
+            violations.append(name)
+    return violations
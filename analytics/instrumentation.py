@@ -0,0 +1,217 @@
+import threading
+import time
+from inspect import isawaitable
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+# Per-resolver and per-Mongo-command timings for /metrics
+# ResolverMetrics is an Ariadne/graphql-core middleware timing the fields that have their own
+# resolver; MongoCommandMetrics is a pymongo command listener timing every command sent to
+# MongoDB. Labels only take values from bounded sets: fields come from the schema, command
+# names and collections from the code, and operation names chosen by clients are kept for the
+# first max_operations names seen, later ones are reported as "other".
+
+OTHER = "other"
+ANONYMOUS = "anonymous"
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Connections a pool opens when the client does not set maxPoolSize
+DEFAULT_MAX_POOL_SIZE = 100
+
+
+# Maps label values onto at most max_values distinct values, the rest become "other"
+class BoundedLabels:
+    def __init__(self, max_values=100):
+        self.max_values = max_values
+        self._values = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        if value in self._values:
+            return value
+        with self._lock:
+            if len(self._values) < self.max_values:
+                self._values.add(value)
+                return value
+        return OTHER
+
+
+def operation_name(info):
+    operation = info.operation
+    return operation.name.value if operation is not None and operation.name is not None else ANONYMOUS
+
+
+class ResolverMetrics:
+    def __init__(self, registry, max_operations=100):
+        self.operations = BoundedLabels(max_operations)
+        self.durations = Histogram(
+            'graphql_resolver_duration_seconds', 'Time spent in GraphQL field resolvers', ['field', 'operation'], registry=registry
+        )
+
+    # graphql-core middleware; fields resolved by the default resolver are not timed
+    def resolve(self, next_, obj, info, **kwargs):
+        field = info.parent_type.fields.get(info.field_name)
+        if field is None or field.resolve is None:
+            return next_(obj, info, **kwargs)
+        histogram = self.durations.labels(
+            field=f"{info.parent_type.name}.{info.field_name}", operation=self.operations(operation_name(info))
+        )
+        started = time.perf_counter()
+        result = next_(obj, info, **kwargs)
+        if isawaitable(result):
+            return self._observe_async(result, histogram, started)
+        histogram.observe(time.perf_counter() - started)
+        return result
+
+    async def _observe_async(self, result, histogram, started):
+        try:
+            return await result
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+
+# Number of documents in the reply of a cursor command (find, aggregate, getMore)
+def returned_documents(reply):
+    cursor = reply.get("cursor") if isinstance(reply, dict) else None
+    if not isinstance(cursor, dict):
+        return 0
+    return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+
+
+# Collection a command runs against: its first value for most commands, 'collection' for getMore
+def command_collection(command_name, command):
+    value = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return value if isinstance(value, str) else "none"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, registry, max_collections=50, max_commands=50):
+        self.collections = BoundedLabels(max_collections)
+        self.commands = BoundedLabels(max_commands)
+        # (connection, request id) -> collection of the commands in flight; replies do not name it
+        self._in_flight = {}
+        self.durations = Histogram(
+            'mongodb_command_duration_seconds', 'Time spent in MongoDB commands', ['collection', 'command'],
+            buckets=MONGO_BUCKETS, registry=registry
+        )
+        self.documents = Counter(
+            'mongodb_documents_returned_total', 'Documents returned by MongoDB cursor commands', ['collection', 'command'],
+            registry=registry
+        )
+        self.failures = Counter(
+            'mongodb_command_failures_total', 'MongoDB commands that failed', ['collection', 'command'], registry=registry
+        )
+
+    def _labels(self, event):
+        collection = self._in_flight.pop((event.connection_id, event.request_id), "none")
+        return {"collection": self.collections(collection), "command": self.commands(event.command_name)}
+
+    def started(self, event):
+        self._in_flight[(event.connection_id, event.request_id)] = command_collection(event.command_name, event.command)
+
+    def succeeded(self, event):
+        labels = self._labels(event)
+        self.durations.labels(**labels).observe(event.duration_micros / 1e6)
+        documents = returned_documents(event.reply)
+        if documents:
+            self.documents.labels(**labels).inc(documents)
+
+    def failed(self, event):
+        labels = self._labels(event)
+        self.durations.labels(**labels).observe(event.duration_micros / 1e6)
+        self.failures.labels(**labels).inc()
+
+
+def server_address(address):
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address)
+
+
+# Connection pool state of every server, from a pymongo connection pool listener
+# Utilization is the share of the pool's maxPoolSize checked out; checkout waits include
+# the time spent opening a new connection when none was idle
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self, registry, max_servers=20):
+        self.servers = BoundedLabels(max_servers)
+        self._lock = threading.Lock()
+        # address -> {"max": pool size, "open": connections, "checked_out": ..., "waiting": ...}
+        self._pools = {}
+        self.connections = Gauge('mongodb_pool_connections', 'Open connections in the MongoDB pool', ['server'], registry=registry)
+        self.checked_out = Gauge('mongodb_pool_checked_out', 'MongoDB connections checked out', ['server'], registry=registry)
+        self.waiting = Gauge('mongodb_pool_waiting', 'Operations waiting for a MongoDB connection', ['server'], registry=registry)
+        self.max_size = Gauge('mongodb_pool_max_size', 'maxPoolSize of the MongoDB pool', ['server'], registry=registry)
+        self.utilization = Gauge(
+            'mongodb_pool_utilization', 'Share of the MongoDB pool checked out (0 to 1)', ['server'], registry=registry
+        )
+        self.checkout_wait = Histogram(
+            'mongodb_pool_checkout_wait_seconds', 'Time waited to check a MongoDB connection out', ['server'],
+            buckets=CHECKOUT_BUCKETS, registry=registry
+        )
+
+    # Applies changes to the counts of a pool and publishes them
+    def _update(self, address, **changes):
+        server = self.servers(server_address(address))
+        with self._lock:
+            pool = self._pools.setdefault(server, {"max": 0, "open": 0, "checked_out": 0, "waiting": 0})
+            for key, change in changes.items():
+                pool[key] = max(pool[key] + change, 0)
+            self.max_size.labels(server=server).set(pool["max"])
+            self.connections.labels(server=server).set(pool["open"])
+            self.checked_out.labels(server=server).set(pool["checked_out"])
+            self.waiting.labels(server=server).set(pool["waiting"])
+            self.utilization.labels(server=server).set(pool["checked_out"] / pool["max"] if pool["max"] else 0)
+
+    def _forget(self, server):
+        self._pools.pop(server, None)
+        for gauge in (self.max_size, self.connections, self.checked_out, self.waiting, self.utilization):
+            gauge.labels(server=server).set(0)
+
+    # Forgets the pools of the parent process after a fork
+    def reset(self):
+        self._lock = threading.Lock()
+        for server in list(self._pools):
+            self._forget(server)
+
+    def pool_created(self, event):
+        self._update(event.address, max=event.options.get("maxPoolSize", DEFAULT_MAX_POOL_SIZE))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._forget(self.servers(server_address(event.address)))
+
+    def connection_created(self, event):
+        self._update(event.address, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    # Check out events carry their duration from pymongo 4.7, older versions only update the counts
+    def _observe_checkout(self, event):
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            self.checkout_wait.labels(server=self.servers(server_address(event.address))).observe(duration)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1)
+        self._observe_checkout(event)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, checked_out=1)
+        self._observe_checkout(event)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, checked_out=-1)
@@ -0,0 +1,419 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from prometheus_client import Gauge
+from pymongo.errors import PyMongoError
+
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Live per-user exercise totals pushed to subscribers as exercises are logged
+# A watcher thread follows the exercises collection with a change stream, or by polling when
+# change streams are not available (standalone servers, mongomock). Totals are only kept for
+# the users somebody is subscribed to: they start from one aggregation over the user's
+# exercises and are then updated from each new exercise, so subscribers receive deltas
+# without any query per update. Updated and deleted exercises trigger a re-aggregation of
+# the affected users.
+
+MODES = ("auto", "changestream", "poll")
+
+# Change stream events the watcher reacts to
+WATCHED_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+EXERCISE_PROJECTION = {"username": 1, "exerciseType": 1, "duration": 1}
+
+
+def totals_pipeline(username):
+    return [
+        {"$match": {"username": username}},
+        {"$group": {
+            "_id": "$exerciseType",
+            "totalDuration": {"$sum": "$duration"},
+            "count": {"$sum": 1},
+            "lastId": {"$max": "$_id"}
+        }}
+    ]
+
+
+# Exercises seen by an earlier poll that were updated since
+def updated_exercises_query(since, last_id):
+    return {"updatedAt": {"$gte": since}, "_id": {"$lte": last_id}}
+
+
+# Payload of one update: the changed exercise types with their new totals and the change
+# since the previous update; snapshot updates carry every type with zero deltas
+def build_update(username, changes, snapshot=False):
+    return {
+        "username": username,
+        "snapshot": snapshot,
+        "exercises": [
+            {
+                "exerciseType": exercise_type,
+                "totalDuration": total[0],
+                "count": total[1],
+                "durationDelta": delta[0],
+                "countDelta": delta[1]
+            }
+            for exercise_type, (total, delta) in sorted(changes.items())
+        ]
+    }
+
+
+# Differences between two {exerciseType: (totalDuration, count)} maps, as build_update changes
+def diff_totals(old, new):
+    changes = {}
+    for exercise_type in set(old) | set(new):
+        before, after = old.get(exercise_type, (0, 0)), new.get(exercise_type, (0, 0))
+        if before != after:
+            changes[exercise_type] = (after, (after[0] - before[0], after[1] - before[1]))
+    return changes
+
+
+# Subscription consumed by a thread, e.g. a Flask streaming response
+# Updates carry absolute totals, so when a slow consumer falls behind the oldest updates are
+# dropped rather than buffered without bound
+class Subscription:
+    def __init__(self, username, max_queued=100):
+        self.username = username
+        self._queue = queue.Queue(maxsize=max_queued)
+
+    def put(self, update):
+        while True:
+            try:
+                self._queue.put_nowait(update)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # Returns the next update, or None when none arrived within timeout seconds
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# Subscription consumed by a coroutine; updates are handed over to its event loop
+class AsyncSubscription:
+    def __init__(self, username, loop, max_queued=100):
+        self.username = username
+        self.loop = loop
+        self._queue = asyncio.Queue(maxsize=max_queued)
+
+    def _put(self, update):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(update)
+
+    def put(self, update):
+        self.loop.call_soon_threadsafe(self._put, update)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveUpdates:
+    def __init__(self, db, mode="auto", poll_seconds=2.0, resync_seconds=300.0, registry=None):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported live updates mode: {mode}")
+        self.db = db
+        self.mode = mode
+        self.poll_seconds = poll_seconds
+        self.resync_seconds = resync_seconds
+        # username -> {exerciseType: (totalDuration, count)} for the subscribed users
+        self._totals = {}
+        # username -> largest exercise _id counted in its totals
+        self._last_ids = {}
+        # username -> buffers of the exercises applied while its totals are being aggregated
+        self._loading = {}
+        self._subscribers = {}
+        # Position of the polling watcher: last exercise _id and update time seen
+        self._polling = False
+        self._poll_id = None
+        self._poll_since = None
+        self._resynced_at = None
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.subscribers = None
+        if registry is not None:
+            self.subscribers = Gauge('analytics_live_subscribers', 'Open live update subscriptions', registry=registry)
+
+    # Registers a subscription and hands it the current totals of its user as a snapshot
+    # The totals of a user nobody is subscribed to yet are aggregated outside the lock, so the
+    # watcher and the other subscriptions are not held up; exercises applied meanwhile are
+    # buffered and replayed onto the aggregated totals, none of them counted twice
+    def subscribe(self, subscription):
+        username = subscription.username
+        with self._lock:
+            buffer = None if username in self._totals else self._start_loading(username)
+            if buffer is None:
+                self._register(subscription)
+        if buffer is not None:
+            try:
+                loaded = self._read_totals(username)
+            finally:
+                with self._lock:
+                    self._stop_loading(username, buffer)
+            with self._lock:
+                # Another subscription of the user may have installed its totals first
+                if username not in self._totals:
+                    self._install_totals(username, loaded, buffer)
+                self._register(subscription)
+        if self.subscribers is not None:
+            self.subscribers.inc()
+        self.start()
+        return subscription
+
+    # Under the lock, once the user's totals are known
+    def _register(self, subscription):
+        username = subscription.username
+        self._subscribers.setdefault(username, []).append(subscription)
+        subscription.put(build_update(
+            username, {exercise_type: (total, (0, 0)) for exercise_type, total in self._totals[username].items()}, snapshot=True
+        ))
+
+    def unsubscribe(self, subscription):
+        username = subscription.username
+        with self._lock:
+            subscribers = self._subscribers.get(username, [])
+            if subscription not in subscribers:
+                return
+            subscribers.remove(subscription)
+            if not subscribers:
+                del self._subscribers[username]
+                self._totals.pop(username, None)
+                self._last_ids.pop(username, None)
+        if self.subscribers is not None:
+            self.subscribers.dec()
+
+    # Aggregates the totals of a user and the largest _id they count; reads the database, so
+    # it is called without the lock
+    def _read_totals(self, username):
+        totals = {}
+        last_id = None
+        for row in self.db.exercises.aggregate(totals_pipeline(username)):
+            if row["_id"] is not None:
+                totals[row["_id"]] = (row["totalDuration"], row["count"])
+            if last_id is None or (row.get("lastId") is not None and row["lastId"] > last_id):
+                last_id = row.get("lastId")
+        return totals, last_id
+
+    # Under the lock: from here on, exercises applied to the user are also kept in the buffer
+    def _start_loading(self, username):
+        buffer = []
+        self._loading.setdefault(username, []).append(buffer)
+        return buffer
+
+    def _stop_loading(self, username, buffer):
+        buffers = [other for other in self._loading.get(username, []) if other is not buffer]
+        if buffers:
+            self._loading[username] = buffers
+        else:
+            self._loading.pop(username, None)
+
+    # Under the lock: replaces the totals of a user with aggregated ones, then adds the buffered
+    # exercises the aggregation did not count yet
+    def _install_totals(self, username, loaded, buffer):
+        self._totals[username], self._last_ids[username] = dict(loaded[0]), loaded[1]
+        self._add_exercises(buffer)
+
+    def _publish(self, username, changes, snapshot=False):
+        if not changes:
+            return
+        update = build_update(username, changes, snapshot)
+        for subscription in self._subscribers.get(username, []):
+            subscription.put(update)
+
+    # Adds newly inserted exercises to the totals of the subscribed users and pushes the deltas
+    # Exercises already counted in a user's totals (_id at or below its last id) are skipped
+    def apply_exercises(self, exercises):
+        with self._lock:
+            for exercise in exercises:
+                for buffer in self._loading.get(exercise.get("username"), []):
+                    buffer.append(exercise)
+            for username, user_changes in self._add_exercises(exercises).items():
+                self._publish(username, user_changes)
+
+    # Under the lock: adds exercises to the totals and returns the changes per user
+    def _add_exercises(self, exercises):
+        changes = {}
+        for exercise in exercises:
+            username = exercise.get("username")
+            if username not in self._totals or exercise.get("exerciseType") is None:
+                continue
+            last_id = self._last_ids.get(username)
+            if last_id is not None and exercise["_id"] <= last_id:
+                continue
+            exercise_type = exercise["exerciseType"]
+            duration, count = self._totals[username].get(exercise_type, (0, 0))
+            total = (duration + (exercise.get("duration") or 0), count + 1)
+            self._totals[username][exercise_type] = total
+            self._last_ids[username] = exercise["_id"]
+            user_changes = changes.setdefault(username, {})
+            previous = user_changes.get(exercise_type, (None, (0, 0)))[1]
+            user_changes[exercise_type] = (total, (previous[0] + (exercise.get("duration") or 0), previous[1] + 1))
+        return changes
+
+    # Recomputes the totals of users whose exercises were updated or deleted and pushes the
+    # differences; None resyncs every subscribed user
+    # Like subscribe, aggregates outside the lock and replays what was applied meanwhile
+    def resync(self, usernames=None):
+        with self._lock:
+            usernames = list(self._totals) if usernames is None else [name for name in usernames if name in self._totals]
+            buffers = {username: self._start_loading(username) for username in usernames}
+        try:
+            loaded = {username: self._read_totals(username) for username in usernames}
+        finally:
+            with self._lock:
+                for username, buffer in buffers.items():
+                    self._stop_loading(username, buffer)
+        with self._lock:
+            for username, totals in loaded.items():
+                if username not in self._totals:
+                    continue
+                old = self._totals[username]
+                self._install_totals(username, totals, buffers[username])
+                self._publish(username, diff_totals(old, self._totals[username]))
+            self._resynced_at = time.monotonic()
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+    # Handles one change stream event
+    def handle_change(self, event):
+        operation = event.get("operationType")
+        if operation == "insert":
+            self.apply_exercises([event["fullDocument"]])
+        elif operation in ("update", "replace") and event.get("fullDocument"):
+            self.resync([event["fullDocument"].get("username")])
+        elif operation in ("update", "replace", "delete"):
+            # Deleted documents no longer say whose they were
+            self.resync()
+
+    def _resync_due(self):
+        return self._resynced_at is None or time.monotonic() - self._resynced_at >= self.resync_seconds
+
+    # One pass of the polling watcher: new exercises by _id, updated ones by updatedAt
+    def poll_once(self, batch_size=rollups.DEFAULT_BATCH_SIZE):
+        if not self._polling:
+            self._start_polling()
+        previous_id = self._poll_id
+        while True:
+            inserted = list(
+                self.db.exercises.find(rollups.new_exercises_query(self._poll_id), EXERCISE_PROJECTION)
+                .sort("_id", 1)
+                .limit(batch_size)
+            )
+            if inserted:
+                self._poll_id = inserted[-1]["_id"]
+                self.apply_exercises(inserted)
+            if len(inserted) < batch_size:
+                break
+
+        since, self._poll_since = self._poll_since, datetime.utcnow()
+        if previous_id is not None:
+            updated = self.db.exercises.find(updated_exercises_query(since, previous_id), {"username": 1})
+            self.resync({exercise.get("username") for exercise in updated})
+
+        # Deletions are not visible to polling; they are picked up by the periodic resync
+        if self._resync_due():
+            self.resync()
+
+    # Polling starts from the newest exercise; the resync covers anything inserted between
+    # the first subscription and this point
+    def _start_polling(self):
+        last = list(self.db.exercises.find({}, {"_id": 1}).sort("_id", -1).limit(1))
+        self._poll_id = last[0]["_id"] if last else None
+        self._poll_since = datetime.utcnow()
+        self._polling = True
+        self.resync()
+
+    # Starts the watcher thread on the first subscription
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="live-updates", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        if self.mode != "poll" and self._watch():
+            return
+        while not self._stop.wait(self.poll_seconds):
+            if not self.has_subscribers():
+                continue
+            try:
+                self.poll_once()
+            except PyMongoError as error:
+                logger.warning(f"Live updates poll failed: {error}")
+
+    # Follows the change stream until stopped; returns False when change streams are not
+    # supported so the watcher falls back to polling
+    def _watch(self):
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with self.db.exercises.watch(
+                    [{"$match": {"operationType": {"$in": WATCHED_OPERATIONS}}}],
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=int(self.poll_seconds * 1000)
+                ) as stream:
+                    if resume_token is None:
+                        # Covers the exercises inserted before the stream was opened
+                        self.resync()
+                    while not self._stop.is_set():
+                        event = stream.try_next()
+                        if event is not None:
+                            self.handle_change(event)
+                        resume_token = stream.resume_token
+                        if self._resync_due():
+                            self.resync()
+            except (NotImplementedError, TypeError) as error:
+                # Stand-ins such as mongomock have no change streams
+                return self._fall_back(error)
+            except PyMongoError as error:
+                if resume_token is None:
+                    # Standalone servers reject $changeStream
+                    return self._fall_back(error)
+                logger.warning(f"Live updates change stream interrupted, resuming: {error}")
+                self._stop.wait(self.poll_seconds)
+        return True
+
+    def _fall_back(self, error):
+        if self.mode == "changestream":
+            logger.error(f"Change streams are not available: {error}")
+            return True
+        logger.info(f"Change streams are not available, polling every {self.poll_seconds}s: {error}")
+        return False
+
+
+# Server-sent events: one 'totals' event per update, and a comment line sent when no update
+# arrived for a while so closed connections are noticed
+SSE_KEEPALIVE = ": keepalive\n\n"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_message(update):
+    return f"event: totals\ndata: {json.dumps(update)}\n\n"
@@ -0,0 +1,110 @@
+import asyncio
+
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, get_argument_values
+
+# Per-request loaders batching the per-user stats lookups of one GraphQL document
+# Loaders live in the request's GraphQL context, so results are never shared between requests
+
+LOADER_KEY = "user_stats_loader"
+
+
+# Sync loader used by the Flask app
+# graphql_sync resolves fields one after the other, so instead of waiting for a tick the
+# loader is primed with every username the operation asks for and loads them in one batch
+class UserStatsLoader:
+    def __init__(self, batch_load):
+        # batch_load(usernames) returns {username: [stats]} for all the given usernames
+        self.batch_load = batch_load
+        self._results = {}
+
+    def load_many(self, usernames):
+        missing = [username for username in dict.fromkeys(usernames) if username not in self._results]
+        if missing:
+            loaded = self.batch_load(missing)
+            self._results.update({username: loaded.get(username, []) for username in missing})
+        return [self._results[username] for username in usernames]
+
+    def load(self, username):
+        return self.load_many([username])[0]
+
+
+# Async loader used by the ASGI app
+# Every load() issued while the event loop runs the current batch of resolvers is queued,
+# and one batch_load call is dispatched on the next loop iteration
+class AsyncUserStatsLoader:
+    def __init__(self, batch_load):
+        # batch_load(usernames) is a coroutine returning {username: [stats]}
+        self.batch_load = batch_load
+        self._futures = {}
+        self._queue = []
+
+    def load(self, username):
+        future = self._futures.get(username)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[username] = loop.create_future()
+            self._queue.append(username)
+            if len(self._queue) == 1:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return future
+
+    async def load_many(self, usernames):
+        return list(await asyncio.gather(*(self.load(username) for username in usernames)))
+
+    async def _dispatch(self):
+        batch, self._queue = self._queue, []
+        try:
+            loaded = await self.batch_load(batch)
+        except Exception as error:
+            for username in batch:
+                self._futures.pop(username).set_exception(error)
+            return
+        for username in batch:
+            self._futures[username].set_result(loaded.get(username, []))
+
+
+# Yields every field of the operation, descending into sub-selections and fragments
+def _walk_fields(selection_set, fragments):
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+            yield from _walk_fields(selection.selection_set, fragments)
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _walk_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode) and selection.name.value in fragments:
+            yield from _walk_fields(fragments[selection.name.value].selection_set, fragments)
+
+
+# Collects the usernames requested by all filteredStats and multiUserStats fields
+# (including aliases) of the operation, with variables resolved
+def requested_usernames(info):
+    query_fields = info.schema.query_type.fields
+    usernames = []
+    for field in _walk_fields(info.operation.selection_set, info.fragments):
+        name = field.name.value
+        if name not in ("filteredStats", "multiUserStats"):
+            continue
+        arguments = get_argument_values(query_fields[name], field, info.variable_values)
+        if name == "filteredStats":
+            usernames.append(arguments.get("name"))
+        else:
+            usernames.extend(arguments.get("names") or [])
+    return usernames
+
+
+# Returns the sync loader of the current request, primed with the operation's usernames
+def get_user_stats_loader(info, batch_load):
+    loader = info.context.get(LOADER_KEY)
+    if loader is None:
+        loader = info.context[LOADER_KEY] = UserStatsLoader(batch_load)
+        loader.load_many(requested_usernames(info))
+    return loader
+
+
+def get_async_user_stats_loader(info, batch_load):
+    loader = info.context.get(LOADER_KEY)
+    if loader is None:
+        loader = info.context[LOADER_KEY] = AsyncUserStatsLoader(batch_load)
+    return loader
@@ -0,0 +1,125 @@
+import os
+import threading
+
+import pymongo
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+# MongoClient created on first use in each process, with pool settings read from the env
+# A MongoClient is not fork-safe: its pool and monitor threads belong to the process that
+# created it. Gunicorn imports the app in the master when preloading and then forks the
+# workers, so the client is only created when first used, and a forked process drops the
+# client it inherited and creates its own. The module-level db objects of the services are
+# DatabaseProxy instances resolving to the client of the current process.
+
+# Pool and timeout settings: env variable -> MongoClient option; unset ones keep the driver
+# defaults (100 connections per server, no wait queue timeout)
+POOL_SETTINGS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_CONNECTING": "maxConnecting",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_TIMEOUT_MS": "timeoutMS"
+}
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+
+
+# Returns the MongoClient options set in environ, as {option: int}
+def settings_from_env(environ=os.environ):
+    return {option: int(environ[name]) for name, option in POOL_SETTINGS.items() if environ.get(name)}
+
+
+# Returns the read preference for a mode name such as 'secondaryPreferred', or None for the
+# primary; max_staleness_seconds bounds how far behind the primary a secondary may be
+def read_preference(mode, max_staleness_seconds=None):
+    if not mode or mode == "primary":
+        return None
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unsupported read preference: {mode}")
+    return READ_PREFERENCES[mode](max_staleness=int(max_staleness_seconds) if max_staleness_seconds else -1)
+
+
+class ManagedClient:
+    def __init__(self, uri, factory=None, **options):
+        self.uri = uri
+        self.factory = factory or pymongo.MongoClient
+        self.options = options
+        self._client = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    # The client of the current process, created on first use
+    @property
+    def client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.factory(self.uri, **self.options)
+                client = self._client
+        return client
+
+    def __getitem__(self, name):
+        return self.client[name]
+
+    def database(self, name, read_preference=None):
+        return DatabaseProxy(self, name, read_preference)
+
+    # Runs in forked children: the parent's client is dropped without being closed, since its
+    # sockets and threads belong to the parent, and the listeners' per-process state is reset
+    def reset(self):
+        self._lock = threading.Lock()
+        self._client = None
+        for listener in self.options.get("event_listeners", ()):
+            if hasattr(listener, "reset"):
+                listener.reset()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+# Stands in for a pymongo Database: attribute and item access go to the database of the
+# current process's client, with the given read preference
+class DatabaseProxy:
+    def __init__(self, managed, name, read_preference=None):
+        self._managed = managed
+        self._name = name
+        self._read_preference = read_preference
+        # (client, database) of the last access, replaced as a whole when the client changes
+        self._cached = (None, None)
+
+    @property
+    def database(self):
+        client = self._managed.client
+        cached_client, database = self._cached
+        if client is not cached_client:
+            if self._read_preference is None:
+                database = client[self._name]
+            else:
+                database = client.get_database(self._name, read_preference=self._read_preference)
+            self._cached = (client, database)
+        return database
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def __getitem__(self, name):
+        return self.database[name]
@@ -0,0 +1,695 @@
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument, UpdateOne
+
+import distribution
+
+logger = logging.getLogger(__name__)
+
+# Collections holding the materialised rollups and the sync state: its positions and lease,
+# the contribution of every counted exercise (ledger) and the journal of applied batches
+ROLLUPS_COLLECTION = "exercise_rollups"
+DAILY_COLLECTION = "exercise_daily_rollups"
+STATE_COLLECTION = "rollup_state"
+STATE_ID = "exercises"
+LEDGER_COLLECTION = "rollup_ledger"
+BATCHES_COLLECTION = "rollup_batches"
+
+DEFAULT_BATCH_SIZE = 1000
+# Writes can commit this long after the _id or updatedAt they were given; the rechecks look
+# this far back
+DEFAULT_LAG_SECONDS = 300
+DEFAULT_RECHECK_SECONDS = 60
+# A sync that stops renewing its lease for this long is taken over by the next one
+LEASE_SECONDS = 30
+# Seconds between the background syncs of a process, see RollupRefresher
+DEFAULT_SYNC_SECONDS = 2
+
+# Fields of a raw exercise needed to update the rollups
+EXERCISE_PROJECTION = {"username": 1, "exerciseType": 1, "duration": 1, "date": 1, "updatedAt": 1}
+CONTRIBUTION_FIELDS = ("username", "exerciseType", "duration", "day")
+EDITED_SORT = [("updatedAt", 1), ("_id", 1)]
+# Journal entry left unfinished by a sync that died
+PENDING_QUERY = {"status": "applying"}
+
+STATS_SORT = [("username", 1), ("exerciseType", 1)]
+STATS_PROJECTION = {"_id": 0, "username": 1, "exerciseType": 1, "totalDuration": 1}
+DISTRIBUTION_PROJECTION = {
+    "_id": 0, "username": 1, "exerciseType": 1, "totalDuration": 1, "count": 1,
+    "sumSquares": 1, "minDuration": 1, "maxDuration": 1, distribution.SKETCH_FIELD: 1
+}
+PERIOD_PROJECTION = {"_id": 0, "exerciseType": 1, "day": 1, "totalDuration": 1}
+
+# Top-N queries: highest total duration first, ties listed by username
+LEADERBOARD_SORT = [("totalDuration", -1), ("username", 1)]
+LEADERBOARD_PROJECTION = {"_id": 0, "username": 1, "totalDuration": 1, "count": 1}
+MAX_LEADERBOARD_LIMIT = 100
+
+# Period sizes the daily buckets can be summed into
+GRANULARITIES = ("day", "week", "month")
+
+
+# Truncates an exercise date to the start of its day so it can be used as a bucket key
+def day_bucket(date):
+    if not isinstance(date, datetime):
+        return None
+    return datetime(date.year, date.month, date.day)
+
+
+# Part of the rollups an exercise accounts for, as recorded in the ledger
+# None for exercises without a username or type, which are not counted anywhere
+def contribution(exercise):
+    username, exercise_type = exercise.get("username"), exercise.get("exerciseType")
+    if username is None or exercise_type is None:
+        return None
+    return {
+        "username": username,
+        "exerciseType": exercise_type,
+        "duration": exercise.get("duration") or 0,
+        "day": day_bucket(exercise.get("date"))
+    }
+
+
+def ledger_contribution(entry):
+    return {field: entry.get(field) for field in CONTRIBUTION_FIELDS}
+
+
+# Folds the changes of a batch, as (exercise _id, old contribution, new contribution), into
+# the rows to update: old contributions are subtracted and new ones added, per username +
+# exerciseType for the totals (with their duration distribution, see distribution.py) and
+# additionally per day for the daily buckets. $inc fields are kept as [field, value] pairs so
+# the batch can be stored in the journal.
+def build_batch(changes):
+    totals, daily, ledger = {}, {}, []
+    for exercise_id, old, new in changes:
+        for entry, sign in ((old, -1), (new, 1)):
+            if entry is not None:
+                _count(totals, daily, entry, sign)
+        ledger.append({"_id": exercise_id, "contribution": new})
+    for row in list(totals.values()) + list(daily.values()):
+        row["inc"] = [[field, value] for field, value in sorted(row["inc"].items()) if value]
+    return {"totals": list(totals.values()), "daily": list(daily.values()), "ledger": ledger}
+
+
+def _count(totals, daily, entry, sign):
+    duration = entry["duration"]
+    key = {"username": entry["username"], "exerciseType": entry["exerciseType"]}
+    total = totals.setdefault((entry["username"], entry["exerciseType"]), {
+        "key": key, "inc": defaultdict(int), "min": None, "max": None, "removed": False
+    })
+    _add(total["inc"], {"totalDuration": sign * duration, "count": sign, **distribution.distribution_inc(duration, sign)})
+    if sign > 0:
+        total["min"] = duration if total["min"] is None else min(total["min"], duration)
+        total["max"] = duration if total["max"] is None else max(total["max"], duration)
+    else:
+        total["removed"] = True
+
+    if entry["day"] is not None:
+        day = daily.setdefault((entry["username"], entry["exerciseType"], entry["day"]), {
+            "key": {**key, "day": entry["day"]}, "inc": defaultdict(int), "removed": False
+        })
+        _add(day["inc"], {"totalDuration": sign * duration, "count": sign})
+        day["removed"] = day["removed"] or sign < 0
+
+
+def _add(inc, values):
+    for field, value in values.items():
+        inc[field] += value
+
+
+# Database operation of a sync, run by run_steps (pymongo) or the async driver in asgi.py
+Step = namedtuple("Step", ["collection", "method", "args", "kwargs"])
+
+
+def _step(collection, method, *args, **kwargs):
+    return Step(collection, method, args, kwargs)
+
+
+# find steps return a list: (query, projection, sort, limit)
+def _find(collection, query, projection=None, sort=None, limit=0):
+    return _step(collection, "find", query, projection, sort, limit)
+
+
+# Applies the exercises inserted, edited and deleted since the last sync to the rollups
+#
+# One sync runs at a time: it holds a lease on the state document, renewed with every batch,
+# and a sync finding the lease taken returns at once. Every batch is first written to the
+# journal (rollup_batches) under the next version number, then applied, then committed by
+# moving the state document to that version, together with the scan positions. Applying is
+# idempotent: each rollup row records the last version applied to it and is skipped when it
+# already has it, and the ledger writes are absolute. A sync that dies half way therefore
+# leaves a journal entry that the next lease holder applies again and commits, without
+# counting anything twice or losing the batch.
+#
+# The ledger (rollup_ledger) holds the contribution of every counted exercise, so an edit
+# subtracts the old contribution before adding the new one, and a delete subtracts it.
+# Changes are found by:
+# - new exercises after the last _id seen, and edited ones after the last updatedAt seen
+#   (set by mongoose on every save), on every sync;
+# - every recheck_seconds, the same scans again from lag_seconds before the previous
+#   recheck, for writes that committed after later ones (_id and updatedAt are set by the
+#   client before the write reaches the database); exercises the ledger already has as they
+#   are cost a ledger read and nothing else;
+# - with each recheck, a sweep over the next batch_size ledger entries for exercises that
+#   no longer exist, which finds the deletes within (ledger size / batch_size) rechecks.
+class RollupSync:
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, lag_seconds=DEFAULT_LAG_SECONDS,
+                 recheck_seconds=DEFAULT_RECHECK_SECONDS):
+        self.batch_size = batch_size
+        self.lag = timedelta(seconds=lag_seconds)
+        self.recheck = timedelta(seconds=recheck_seconds)
+        self.owner = ObjectId()
+        self.version = 0
+        self.touched = set()
+
+    # Generator of the sync's database steps; each one is sent back its result, and the
+    # usernames whose rollups changed are returned at the end
+    def steps(self):
+        now = datetime.utcnow()
+        yield _step(STATE_COLLECTION, "update_one", {"_id": STATE_ID}, {"$setOnInsert": self._initial_state(now)}, upsert=True)
+        state = yield _step(
+            STATE_COLLECTION, "find_one_and_update",
+            {"_id": STATE_ID, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+            {"$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS)}},
+            return_document=ReturnDocument.AFTER
+        )
+        if state is None:
+            return self.touched
+        if "version" not in state:
+            # Watermark of the sync before the ledger existed: the rollups are rebuilt
+            yield from self._reset_steps(now)
+            state = self._initial_state(now)
+        self.version = state["version"]
+
+        pending = yield _step(BATCHES_COLLECTION, "find_one", PENDING_QUERY, sort=[("_id", 1)])
+        if pending is not None and not (yield from self._recover_steps(pending)):
+            return self.touched
+
+        completed = yield from self._scan_steps(
+            new_exercises_query, [("_id", 1)], state.get("last_id"), lambda position: {"last_id": position}
+        )
+        completed = completed and (yield from self._scan_steps(
+            _edited_query, EDITED_SORT, (state["last_update"], state.get("last_update_id")),
+            lambda position: {"last_update": position[0], "last_update_id": position[1]}
+        ))
+        if completed and state["checked_at"] <= now - self.recheck:
+            completed = yield from self._recheck_steps(state, now)
+        if completed:
+            yield _step(STATE_COLLECTION, "update_one", {"_id": STATE_ID, "lease_owner": self.owner}, {"$set": {"lease_until": None}})
+        return self.touched
+
+    # The epoch tells the versions of a rebuilt state apart from the ones before it
+    def _initial_state(self, now):
+        return {"epoch": ObjectId(), "version": 0, "last_id": None, "last_update": now - self.lag, "last_update_id": None, "checked_at": now, "sweep_id": None}
+
+    def _reset_steps(self, now):
+        for collection in (ROLLUPS_COLLECTION, DAILY_COLLECTION, LEDGER_COLLECTION, BATCHES_COLLECTION):
+            yield _step(collection, "delete_many", {})
+        yield _step(
+            STATE_COLLECTION, "update_one", {"_id": STATE_ID, "lease_owner": self.owner},
+            {"$set": self._initial_state(now), "$unset": {"updated_at": ""}}
+        )
+
+    # Pages through the exercises matching query(position) in sort order, committing each page
+    # and the position after it; returns False once the lease is lost
+    def _scan_steps(self, query, sort, position, position_fields):
+        while True:
+            exercises = yield _find("exercises", query(position), EXERCISE_PROJECTION, sort, self.batch_size)
+            if not exercises:
+                return True
+            last = exercises[-1]
+            position = last["_id"] if sort[0][0] == "_id" else (last.get("updatedAt"), last["_id"])
+            changes = yield from self._changes_steps(exercises)
+            if not (yield from self._commit_steps(changes, position_fields(position))):
+                return False
+            if len(exercises) < self.batch_size:
+                return True
+
+    def _recheck_steps(self, state, now):
+        since = state["checked_at"] - self.lag
+        no_position = lambda position: {}  # noqa: E731
+        if not (yield from self._scan_steps(new_exercises_query, [("_id", 1)], ObjectId.from_datetime(since), no_position)):
+            return False
+        if not (yield from self._scan_steps(_edited_query, EDITED_SORT, (since, None), no_position)):
+            return False
+
+        entries = yield _find(LEDGER_COLLECTION, new_exercises_query(state.get("sweep_id")), None, [("_id", 1)], self.batch_size)
+        existing = yield _find("exercises", {"_id": {"$in": [entry["_id"] for entry in entries]}}, {"_id": 1})
+        existing = {exercise["_id"] for exercise in existing}
+        deleted = [(entry["_id"], ledger_contribution(entry), None) for entry in entries if entry["_id"] not in existing]
+        # The sweep starts over once it reaches the end of the ledger
+        sweep_id = entries[-1]["_id"] if len(entries) == self.batch_size else None
+        if not (yield from self._commit_steps(deleted, {"sweep_id": sweep_id})):
+            return False
+        result = yield _step(STATE_COLLECTION, "update_one", {"_id": STATE_ID, "lease_owner": self.owner}, {"$set": {"checked_at": now}})
+        return result.matched_count == 1
+
+    # Compares a page of exercises with their ledger entries
+    def _changes_steps(self, exercises):
+        entries = yield _find(LEDGER_COLLECTION, {"_id": {"$in": [exercise["_id"] for exercise in exercises]}})
+        counted = {entry["_id"]: ledger_contribution(entry) for entry in entries}
+        changes = []
+        for exercise in exercises:
+            old, new = counted.get(exercise["_id"]), contribution(exercise)
+            if old != new:
+                changes.append((exercise["_id"], old, new))
+        return changes
+
+    # Journals, applies and commits the changes with the new state fields; a page without
+    # changes only moves the state
+    def _commit_steps(self, changes, fields):
+        if not changes:
+            result = yield _step(STATE_COLLECTION, "update_one", {"_id": STATE_ID, "lease_owner": self.owner}, {"$set": {**fields, "lease_until": self._lease_until()}})
+            return result.matched_count == 1
+        batch = build_batch(changes)
+        batch.update({
+            "_id": self.version + 1,
+            "status": "applying",
+            "usernames": sorted({row["key"]["username"] for row in batch["totals"]}),
+            "state": fields,
+            "created_at": datetime.utcnow()
+        })
+        journal = {field: value for field, value in batch.items() if field != "_id"}
+        result = yield _step(BATCHES_COLLECTION, "update_one", {"_id": batch["_id"]}, {"$setOnInsert": journal}, upsert=True)
+        if result.upserted_id is None:
+            # Another worker took over the lease and journaled this version first
+            return False
+        return (yield from self._apply_steps(batch))
+
+    def _recover_steps(self, batch):
+        if batch["_id"] > self.version:
+            return (yield from self._apply_steps(batch))
+        yield from self._finish_steps(batch)
+        return True
+
+    def _apply_steps(self, batch):
+        version = batch["_id"]
+        for collection, rows in ((ROLLUPS_COLLECTION, batch["totals"]), (DAILY_COLLECTION, batch["daily"])):
+            if not rows:
+                continue
+            # Creates the missing rows first, so the marked updates below need no upsert
+            yield _step(collection, "bulk_write", [UpdateOne(row["key"], {"$setOnInsert": {"count": 0}}, upsert=True) for row in rows], ordered=False)
+            yield _step(collection, "bulk_write", [_marked_update(row, version) for row in rows], ordered=False)
+
+        removed = [row["key"] for row in batch["totals"] if row["removed"]]
+        if removed:
+            # The min and max cannot be decremented; they are read again from the exercises
+            bounds = yield _step("exercises", "aggregate", bounds_pipeline(removed))
+            updates = [
+                UpdateOne(
+                    {"username": row["_id"]["username"], "exerciseType": row["_id"]["exerciseType"]},
+                    {"$set": {"minDuration": row["minDuration"], "maxDuration": row["maxDuration"]}}
+                )
+                for row in bounds
+            ]
+            if updates:
+                yield _step(ROLLUPS_COLLECTION, "bulk_write", updates, ordered=False)
+
+        ledger = [
+            ReplaceOne({"_id": entry["_id"]}, entry["contribution"], upsert=True) if entry["contribution"] is not None
+            else DeleteOne({"_id": entry["_id"]})
+            for entry in batch["ledger"]
+        ]
+        yield _step(LEDGER_COLLECTION, "bulk_write", ledger, ordered=False)
+
+        result = yield _step(
+            STATE_COLLECTION, "update_one", {"_id": STATE_ID, "lease_owner": self.owner},
+            {"$set": {**batch["state"], "version": version, "lease_until": self._lease_until()}}
+        )
+        if result.matched_count == 0:
+            return False
+        self.version = version
+        yield from self._finish_steps(batch)
+        return True
+
+    # After the commit: drops the rows left without exercises and closes the journal entry,
+    # keeping its version and usernames
+    def _finish_steps(self, batch):
+        for collection, rows in ((ROLLUPS_COLLECTION, batch["totals"]), (DAILY_COLLECTION, batch["daily"])):
+            emptied = [row["key"] for row in rows if row["removed"]]
+            if emptied:
+                yield _step(collection, "delete_many", {"$or": emptied, "count": {"$lte": 0}})
+        yield _step(
+            BATCHES_COLLECTION, "update_one", {"_id": batch["_id"]},
+            {"$set": {"status": "done", "done_at": datetime.utcnow()}, "$unset": {"totals": "", "daily": "", "ledger": ""}}
+        )
+        self.touched.update(batch["usernames"])
+
+    def _lease_until(self):
+        return datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+
+
+def _marked_update(row, version):
+    update = {"$set": {"batch": version}}
+    if row["inc"]:
+        update["$inc"] = dict(row["inc"])
+    if row.get("min") is not None:
+        update["$min"] = {"minDuration": row["min"]}
+        update["$max"] = {"maxDuration": row["max"]}
+    return UpdateOne({**row["key"], "batch": {"$ne": version}}, update)
+
+
+# Exact min and max duration of the exercises of some username + exerciseType keys
+def bounds_pipeline(keys):
+    return [
+        {"$match": {"$or": keys}},
+        {
+            "$group": {
+                "_id": {"username": "$username", "exerciseType": "$exerciseType"},
+                "minDuration": {"$min": "$duration"},
+                "maxDuration": {"$max": "$duration"}
+            }
+        }
+    ]
+
+
+# Exercises inserted after the given _id, read in _id order
+def new_exercises_query(last_id):
+    return {"_id": {"$gt": last_id}} if last_id is not None else {}
+
+
+# Exercises saved after the given (updatedAt, _id) position, read in EDITED_SORT order
+def edited_exercises_query(since, since_id=None):
+    if since_id is None:
+        return {"updatedAt": {"$gte": since}}
+    return {"$or": [{"updatedAt": {"$gt": since}}, {"updatedAt": since, "_id": {"$gt": since_id}}]}
+
+
+def _edited_query(position):
+    return edited_exercises_query(*position)
+
+
+# Runs the steps of a RollupSync against a pymongo database and returns their result
+def run_steps(db, steps):
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = execute_step(db[step.collection], step)
+
+
+def execute_step(collection, step):
+    if step.method == "find":
+        query, projection, sort, limit = step.args
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor.limit(limit))
+    if step.method == "aggregate":
+        return list(collection.aggregate(*step.args))
+    return getattr(collection, step.method)(*step.args, **step.kwargs)
+
+
+# Brings the rollups up to date with the exercises, see RollupSync
+# Returns the usernames whose rollups changed
+def sync_rollups(db, batch_size=DEFAULT_BATCH_SIZE, lag_seconds=DEFAULT_LAG_SECONDS,
+                 recheck_seconds=DEFAULT_RECHECK_SECONDS):
+    return run_steps(db, RollupSync(batch_size, lag_seconds, recheck_seconds).steps())
+
+
+# Follows the version the syncs of every worker commit, for caches local to one process
+# steps() returns the usernames whose rollups changed since the previous call, read from the
+# journal, or None when they cannot be told (journal entries expired, rollups rebuilt) and
+# everything cached has to be dropped. Concurrent calls may report the same usernames twice.
+class RollupChanges:
+    def __init__(self):
+        self.epoch = None
+        self.version = None
+
+    def steps(self):
+        state = yield _step(STATE_COLLECTION, "find_one", {"_id": STATE_ID}, {"epoch": 1, "version": 1})
+        epoch, version = (state.get("epoch"), state.get("version", 0)) if state else (None, 0)
+        seen_epoch, seen = self.epoch, self.version
+        self.epoch, self.version = epoch, version
+        if seen is None or (epoch == seen_epoch and version == seen):
+            return set()
+        # Without a state document there was nothing to follow yet
+        if (seen_epoch is not None and epoch != seen_epoch) or version < seen:
+            return None
+        batches = yield _find(BATCHES_COLLECTION, {"_id": {"$gt": seen, "$lte": version}}, {"usernames": 1})
+        if len(batches) < version - seen:
+            return None
+        return {username for batch in batches for username in batch.get("usernames", [])}
+
+
+# Keeps the rollups of a process up to date, calling sync every interval seconds from a
+# background thread, so reads neither wait for a sync nor write to the primary themselves.
+# refresh() is called by every read: it starts the thread on the first one (in each forked
+# worker too, the thread of a parent does not survive a fork) and costs nothing afterwards.
+# With an interval of 0 there is no thread and refresh() syncs in place on every read.
+class RollupRefresher:
+    def __init__(self, sync, interval=DEFAULT_SYNC_SECONDS):
+        self.sync = sync
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def refresh(self):
+        if self.interval <= 0:
+            self.sync()
+        elif self._thread is None or not self._thread.is_alive():
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rollup-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as error:
+                logger.warning(f"Rollup sync failed: {error}")
+            if self._stop.wait(self.interval):
+                return
+
+
+# Drops the rollups and replays the whole exercises collection into them
+# Used to backfill an existing deployment and to repair drift reported by check_consistency
+def rebuild_rollups(db, batch_size=DEFAULT_BATCH_SIZE):
+    for collection in (ROLLUPS_COLLECTION, DAILY_COLLECTION, LEDGER_COLLECTION, BATCHES_COLLECTION):
+        db[collection].delete_many({})
+    db[STATE_COLLECTION].delete_one({"_id": STATE_ID})
+    return sync_rollups(db, batch_size=batch_size)
+
+
+# Compares the rollup totals with a full aggregation over the raw exercises
+# Returns a list of mismatches; an empty list means the rollups are consistent
+def check_consistency(db):
+    pipeline = [
+        {
+            "$group": {
+                "_id": {
+                    "username": "$username",
+                    "exerciseType": "$exerciseType"
+                },
+                "totalDuration": {"$sum": "$duration"},
+                "count": {"$sum": 1}
+            }
+        }
+    ]
+    expected = {
+        (row["_id"].get("username"), row["_id"].get("exerciseType")): (row["totalDuration"], row["count"])
+        for row in db.exercises.aggregate(pipeline)
+        if row["_id"].get("username") is not None and row["_id"].get("exerciseType") is not None
+    }
+    actual = {
+        (row["username"], row["exerciseType"]): (row.get("totalDuration", 0), row.get("count", 0))
+        for row in db[ROLLUPS_COLLECTION].find({}, {"_id": 0})
+    }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual)):
+        if expected.get(key) != actual.get(key):
+            exp_duration, exp_count = expected.get(key, (0, 0))
+            act_duration, act_count = actual.get(key, (0, 0))
+            mismatches.append({
+                "username": key[0],
+                "exerciseType": key[1],
+                "expectedDuration": exp_duration,
+                "actualDuration": act_duration,
+                "expectedCount": exp_count,
+                "actualCount": act_count
+            })
+    return mismatches
+
+
+# Reads per-user totals from the rollups, optionally restricted to some usernames
+# Returns the same shape as the old $group pipeline: [{username, exercises: [...]}]
+def read_stats(db, usernames=None):
+    rows = db[ROLLUPS_COLLECTION].find(stats_query(usernames), STATS_PROJECTION).sort(STATS_SORT)
+    return shape_stats(rows)
+
+
+def stats_query(usernames=None):
+    if usernames is None:
+        return {}
+    return {"username": {"$in": list(usernames)}}
+
+
+# Groups rollup rows sorted by username into one entry per user
+def shape_stats(rows):
+    results = []
+    for row in rows:
+        if not results or results[-1]["username"] != row["username"]:
+            results.append({"username": row["username"], "exercises": []})
+        results[-1]["exercises"].append({
+            "exerciseType": row["exerciseType"],
+            "totalDuration": row.get("totalDuration", 0)
+        })
+    return results
+
+
+# Reads the duration distributions of a user (or all users), optionally of one exercise type
+# Returns [{username, exercises: [{exerciseType, count, mean, median, p90, ...}]}]
+def read_distributions(db, username=None, exercise_type=None):
+    rows = db[ROLLUPS_COLLECTION].find(distribution_query(username, exercise_type), DISTRIBUTION_PROJECTION)
+    return shape_distributions(rows.sort(STATS_SORT))
+
+
+def distribution_query(username=None, exercise_type=None):
+    query = {}
+    if username is not None:
+        query["username"] = username
+    if exercise_type is not None:
+        query["exerciseType"] = exercise_type
+    return query
+
+
+# Groups rollup rows sorted by username into one entry per user, summarizing each row
+def shape_distributions(rows):
+    results = []
+    for row in rows:
+        if not results or results[-1]["username"] != row["username"]:
+            results.append({"username": row["username"], "exercises": []})
+        results[-1]["exercises"].append(distribution.summarize(row))
+    return results
+
+
+# Top users by total duration, of one exercise type (or all) over a date range (or all time)
+# The all-time board of one type is read in order from the exercise_rollups index on
+# (exerciseType, totalDuration, username), so it costs O(limit). The other boards sum the
+# matching rows per user in the database and only the top limit users are returned, with a
+# top-k sort rather than a sort of every user. Users with the same total share a rank
+# (1, 2, 2, 4) and are listed by username; ties across the limit are cut by username too.
+def read_leaderboard(db, exercise_type=None, start_date=None, end_date=None, limit=10):
+    check_leaderboard(start_date, end_date, limit)
+    if leaderboard_from_totals_index(exercise_type, start_date):
+        rows = db[ROLLUPS_COLLECTION].find(leaderboard_query(exercise_type), LEADERBOARD_PROJECTION)
+        return rank_leaderboard(rows.sort(LEADERBOARD_SORT).limit(limit))
+    collection = DAILY_COLLECTION if start_date is not None else ROLLUPS_COLLECTION
+    return rank_leaderboard(db[collection].aggregate(leaderboard_pipeline(exercise_type, start_date, end_date, limit)))
+
+
+def check_leaderboard(start_date, end_date, limit):
+    if (start_date is None) != (end_date is None):
+        raise ValueError("'start' and 'end' must be given together")
+    if start_date is not None and end_date < start_date:
+        raise ValueError("'end' must be on or after 'start'")
+    if not 1 <= limit <= MAX_LEADERBOARD_LIMIT:
+        raise ValueError(f"'limit' must be between 1 and {MAX_LEADERBOARD_LIMIT}")
+
+
+def leaderboard_from_totals_index(exercise_type, start_date):
+    return exercise_type is not None and start_date is None
+
+
+# All-time board of one type, read in LEADERBOARD_SORT order
+def leaderboard_query(exercise_type):
+    return {"exerciseType": exercise_type}
+
+
+# Sums the daily buckets in range (or the totals when there is no range) per user and keeps
+# the top limit users
+def leaderboard_pipeline(exercise_type, start_date, end_date, limit):
+    match = {}
+    if exercise_type is not None:
+        match["exerciseType"] = exercise_type
+    if start_date is not None:
+        match["day"] = {"$gte": day_bucket(start_date), "$lte": day_bucket(end_date)}
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$username", "totalDuration": {"$sum": "$totalDuration"}, "count": {"$sum": "$count"}}},
+        {"$sort": {"totalDuration": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "username": "$_id", "totalDuration": 1, "count": 1}}
+    ]
+
+
+# Numbers leaderboard rows sorted by LEADERBOARD_SORT; equal totals get the same rank
+def rank_leaderboard(rows):
+    entries = []
+    for position, row in enumerate(rows, 1):
+        total = row.get("totalDuration", 0)
+        tied = entries and entries[-1]["totalDuration"] == total
+        entries.append({
+            "rank": entries[-1]["rank"] if tied else position,
+            "username": row["username"],
+            "totalDuration": total,
+            "count": row.get("count", 0)
+        })
+    return entries
+
+
+# Maps a daily bucket onto the start of its day, ISO week (Monday) or month
+def period_start(day, granularity):
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+# Sums the daily buckets of a user between two dates (both inclusive)
+# Without a granularity the whole range is collapsed into one entry, otherwise one entry is
+# returned per day, week or month. Costs O(buckets in range) rather than O(exercises).
+def read_period_stats(db, username, start_date, end_date, granularity=None):
+    check_granularity(granularity)
+    buckets = db[DAILY_COLLECTION].find(period_query(username, start_date, end_date), PERIOD_PROJECTION)
+    return shape_period_stats(buckets, username, granularity)
+
+
+def check_granularity(granularity):
+    if granularity is not None and granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def period_query(username, start_date, end_date):
+    return {"username": username, "day": {"$gte": day_bucket(start_date), "$lte": day_bucket(end_date)}}
+
+
+# Sums daily buckets into one entry per period (or a single entry without granularity)
+def shape_period_stats(buckets, username, granularity=None):
+    periods = defaultdict(lambda: defaultdict(int))
+    for bucket in buckets:
+        period = period_start(bucket["day"], granularity) if granularity else None
+        periods[period][bucket["exerciseType"]] += bucket.get("totalDuration", 0)
+
+    results = []
+    for period in sorted(periods, key=lambda p: p or datetime.min):
+        entry = {"username": username}
+        if period is not None:
+            entry["period"] = period.strftime("%Y-%m-%d")
+        entry["exercises"] = [
+            {"exerciseType": exercise_type, "totalDuration": total}
+            for exercise_type, total in sorted(periods[period].items())
+        ]
+        results.append(entry)
+    return results
@@ -0,0 +1,137 @@
+import datetime
+import decimal
+import gzip
+import json
+import uuid
+
+from bson import Decimal128, ObjectId
+
+try:
+    import orjson
+except ImportError:  # optional dependency, see the 'serialization' poetry group
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency, see the 'serialization' poetry group
+    brotli = None
+
+# JSON encoding and compression of the GraphQL responses
+# Responses are encoded with orjson when it is installed and with the standard library
+# otherwise; both produce the same JSON. Dates and times are written as ISO 8601 strings,
+# ObjectIds as their hex string and decimals as numbers, so rows read from MongoDB can be
+# returned as they are. Responses of at least min_size bytes are compressed with the best
+# encoding the client accepts (brotli, then gzip); smaller ones are sent as they are since
+# compressing them costs more time than it saves on the wire.
+
+BACKENDS = ("auto", "orjson", "json")
+
+# Encodings in order of preference, as negotiated from Accept-Encoding
+ENCODINGS = ("br", "gzip")
+
+JSON_CONTENT_TYPE = "application/json"
+
+# Fast settings suited to dynamic responses: most of the size reduction at a fraction of the
+# cost of the highest levels
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+# Encodes the values the JSON encoders do not handle natively
+def default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (ObjectId, uuid.UUID)):
+        return str(value)
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_dumps(data):
+    return json.dumps(data, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(data):
+    try:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # Integers beyond 64 bits and other values orjson refuses
+        return _json_dumps(data)
+
+
+def _supported(encoding):
+    return encoding == "gzip" or (encoding == "br" and brotli is not None)
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+# Returns {encoding: q value} of an Accept-Encoding header
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in (header or "").split(","):
+        encoding, _, parameters = item.strip().partition(";")
+        if not encoding:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding.strip().lower()] = quality
+    return accepted
+
+
+class ResponseSerializer:
+    def __init__(self, backend="auto", encodings=ENCODINGS, min_size=1024):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unsupported JSON backend: {backend}")
+        if backend == "orjson" and orjson is None:
+            raise ValueError("The orjson backend needs orjson, see the 'serialization' poetry group")
+        if backend == "auto":
+            backend = "json" if orjson is None else "orjson"
+        self.backend = backend
+        self.encodings = [encoding for encoding in encodings if _supported(encoding)]
+        self.min_size = min_size
+
+    def dumps(self, data):
+        return _orjson_dumps(data) if self.backend == "orjson" else _json_dumps(data)
+
+    # Returns the preferred encoding accepted by the client, or None to send the body as is
+    # Ties in q value are broken by the service's order of preference
+    def negotiate(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    # Returns the response body and headers for data, compressed when the client accepts it
+    def encode(self, data, accept_encoding=None):
+        body = self.dumps(data)
+        headers = {"Content-Type": JSON_CONTENT_TYPE}
+        if self.encodings:
+            headers["Vary"] = "Accept-Encoding"
+            encoding = self.negotiate(accept_encoding) if len(body) >= self.min_size else None
+            if encoding is not None:
+                body = _compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+        return body, headers
+
+
+# Encodings listed in a RESPONSE_COMPRESSION setting, e.g. "br,gzip"; empty disables compression
+def parse_encodings(value):
+    return [encoding.strip().lower() for encoding in (value or "").split(",") if encoding.strip()]
@@ -0,0 +1,259 @@
+import collections
+import contextlib
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bson import json_util
+from pymongo import monitoring
+
+# Opt-in recorder of slow GraphQL operations
+# While an operation runs, the MongoDB commands it sends are captured by a pymongo command
+# listener (on the request thread) and its thread is sampled by a profiler thread. Operations
+# slower than threshold_seconds are kept in a bounded ring buffer with the operation name,
+# the query, the redacted variables, the commands with a summary of their explain output and
+# the sampled stacks; faster operations are dropped.
+
+REDACTED = "[REDACTED]"
+
+# Variables and command fields whose values are never recorded
+SENSITIVE_KEYS = re.compile(r"pass|secret|token|key|auth|email|phone", re.IGNORECASE)
+
+MAX_STRING_LENGTH = 200
+MAX_QUERY_LENGTH = 4000
+MAX_COMMANDS = 20
+MAX_EXPLAINED_COMMANDS = 5
+MAX_STACK_DEPTH = 30
+MAX_STACKS = 20
+
+# Name of the first operation in a query, for requests sent without an operationName
+OPERATION_NAME = re.compile(r"^\s*(?:query|mutation|subscription)\s+(\w+)")
+
+# Commands whose plan can be explained
+EXPLAINABLE_COMMANDS = ("find", "aggregate", "count", "distinct")
+
+
+# Copy of a variables or command document with sensitive values redacted and long strings cut
+def redact(value, key=None):
+    if key is not None and SENSITIVE_KEYS.search(str(key)):
+        return REDACTED
+    if isinstance(value, dict):
+        return {item_key: redact(item, item_key) for item_key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+        return value[:MAX_STRING_LENGTH] + "..."
+    return value
+
+
+def query_operation_name(query):
+    match = OPERATION_NAME.match(query) if isinstance(query, str) else None
+    return match.group(1) if match else "anonymous"
+
+
+# Stage names, index names and whether a whole collection is scanned, from explain output
+# Handles find and aggregate explain output; rejected plans are ignored
+def summarize_plan(explain):
+    summary = {"stages": [], "indexes": [], "collscan": False}
+
+    def visit(node):
+        if isinstance(node, dict):
+            if "stage" in node:
+                summary["stages"].append(node["stage"])
+                summary["collscan"] = summary["collscan"] or node["stage"] == "COLLSCAN"
+            if node.get("indexName") and node["indexName"] not in summary["indexes"]:
+                summary["indexes"].append(node["indexName"])
+            for key, value in node.items():
+                if key not in ("rejectedPlans", "allPlansExecution"):
+                    visit(value)
+        elif isinstance(node, list):
+            for item in node:
+                visit(item)
+
+    visit(explain.get("queryPlanner", explain.get("stages", explain)))
+    return summary
+
+
+# Command as sent, without the driver fields ($db, lsid, $clusterTime...)
+def strip_driver_fields(command):
+    return {key: value for key, value in command.items() if not key.startswith("$") and key != "lsid"}
+
+
+class OperationRecord:
+    def __init__(self, operation, query, variables):
+        self.operation = operation
+        self.query = query
+        self.variables = variables
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.commands = []
+        # index in commands -> command as sent, for the commands that can be explained
+        self.sent = {}
+        # request id -> index in commands of the commands in flight
+        self.in_flight = {}
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def to_dict(self, duration, interval):
+        return {
+            "operation": self.operation,
+            "startedAt": self.started_at.isoformat(),
+            "durationMs": round(duration * 1000, 2),
+            "query": self.query,
+            "variables": self.variables,
+            "commands": self.commands,
+            "profile": {
+                "intervalMs": round(interval * 1000, 2),
+                "samples": self.samples,
+                "stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(MAX_STACKS)]
+            }
+        }
+
+
+# Collapsed stack of a frame, outermost call first: "file.py:function:line;..."
+def collapse_stack(frame):
+    calls = []
+    while frame is not None and len(calls) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        calls.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+class SlowOperationRecorder(monitoring.CommandListener):
+    def __init__(self, threshold_seconds=None, max_entries=100, sample_interval=0.01, explain=True):
+        self.threshold_seconds = threshold_seconds
+        self.sample_interval = sample_interval
+        self.explain = explain
+        # MongoClient used to explain the commands of slow operations, set once it is created
+        self.client = None
+        self._entries = collections.deque(maxlen=max_entries)
+        self._current = threading.local()
+        # thread id -> record of the operations being tracked, read by the profiler thread
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-operations")
+
+    @property
+    def enabled(self):
+        return self.threshold_seconds is not None
+
+    # Tracks one GraphQL operation: request data with 'query', 'variables' and 'operationName'
+    @contextlib.contextmanager
+    def track(self, data):
+        if not self.enabled or not isinstance(data, dict):
+            yield
+            return
+        record = OperationRecord(
+            data.get("operationName") or query_operation_name(data.get("query")),
+            str(data.get("query") or "")[:MAX_QUERY_LENGTH],
+            redact(data.get("variables") or {})
+        )
+        self._current.record = record
+        with self._lock:
+            self._active[record.thread_id] = record
+        self._start_sampler()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(record.thread_id, None)
+            self._current.record = None
+            self._finish(record, time.perf_counter() - record.started)
+
+    def _finish(self, record, duration):
+        if duration < self.threshold_seconds:
+            return
+        entry = record.to_dict(duration, self.sample_interval)
+        self._entries.append(entry)
+        if self.explain and self.client is not None and record.sent:
+            # Explained off the request thread; the entry is readable meanwhile
+            self._explainer.submit(self._explain_commands, entry, record.sent)
+
+    # Explains the slowest commands and swaps in a commands list with the plan summaries
+    def _explain_commands(self, entry, sent):
+        commands = [dict(command) for command in entry["commands"]]
+        slowest = sorted(sent, key=lambda index: -commands[index].get("durationMs", 0))
+        for index in slowest[:MAX_EXPLAINED_COMMANDS]:
+            command = commands[index]
+            try:
+                explain = self.client[command["database"]].command("explain", sent[index], verbosity="queryPlanner")
+                command["explain"] = summarize_plan(explain)
+            except Exception as error:
+                command["explain"] = {"error": str(error)}
+        entry["commands"] = commands
+
+    # Returns the recorded operations, most recent first
+    def entries(self, limit=None):
+        entries = list(reversed(self._entries))
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        self._entries.clear()
+
+    # Command listener: commands are attributed to the operation tracked on the calling thread
+    def started(self, event):
+        record = getattr(self._current, "record", None)
+        if record is None or len(record.commands) >= MAX_COMMANDS:
+            return
+        sent = strip_driver_fields(event.command)
+        command = {
+            "command": event.command_name,
+            "database": event.database_name,
+            "collection": sent.get(event.command_name) if isinstance(sent.get(event.command_name), str) else None,
+            "body": redact({key: value for key, value in sent.items() if key != event.command_name})
+        }
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            record.sent[len(record.commands)] = sent
+        record.in_flight[event.request_id] = len(record.commands)
+        record.commands.append(command)
+
+    def succeeded(self, event):
+        self._record_duration(event)
+
+    def failed(self, event):
+        self._record_duration(event, failure=str(event.failure))
+
+    def _record_duration(self, event, failure=None):
+        record = getattr(self._current, "record", None)
+        index = record.in_flight.pop(event.request_id, None) if record is not None else None
+        if index is None:
+            return
+        record.commands[index]["durationMs"] = round(event.duration_micros / 1000, 2)
+        if failure is not None:
+            record.commands[index]["failure"] = failure
+
+    # Profiler thread, started on the first tracked operation and sampling the stacks of the
+    # threads running a tracked operation every sample_interval seconds
+    def _start_sampler(self):
+        if self._sampler is not None:
+            return
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_forever, name="slow-operations-profiler", daemon=True)
+                self._sampler.start()
+
+    # Samples under the lock, so a record is never sampled once its operation has finished
+    def _sample_forever(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for record in self._active.values():
+                    frame = frames.get(record.thread_id)
+                    if frame is not None:
+                        record.stacks[collapse_stack(frame)] += 1
+                        record.samples += 1
+
+
+# JSON encoding of the recorded entries; commands can hold ObjectIds and dates
+def dumps(entries):
+    return json.dumps(entries, default=json_util.default)
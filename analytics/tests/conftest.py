@@ -1,8 +1,13 @@
 # conftest.py
+import os
+
 import pytest
 import mongomock
 from unittest.mock import patch
 
+# Reads sync the rollups in place, so a test sees the exercises it just inserted
+os.environ.setdefault('ROLLUP_SYNC_SECONDS', '0')
+
 
 @pytest.fixture(scope='session')
 def mock_mongo():
@@ -1,5 +1,6 @@
 import os
 import json
+import pytest
 from ariadne import load_schema_from_path
 import sys
 from datetime import datetime
@@ -236,3 +237,274 @@ def test_schema_loading():
     # Check schema loaded as expected
     assert type_defs is not None, "Type definitions are not loaded."
     assert "schema {" in type_defs, "Schema definition is missing."
+
+
+def test_rollup_cli_commands(client, mock_mongo):
+    """
+    Tests the rebuild-rollups and check-rollups CLI commands.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    from app import app
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["rebuild-rollups"])
+    assert result.exit_code == 0
+    assert "Rebuilt rollups" in result.output
+
+    result = runner.invoke(args=["check-rollups"])
+    assert result.exit_code == 0
+    assert "Rollups are consistent" in result.output
+
+
+def test_graphql_weekly_query_with_granularity(client, mock_mongo):
+    """
+    Tests the GraphQL 'weekly' query split into weekly periods.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    query = """
+    query WeeklyStats($user: String!, $start: String!, $end: String!) {
+        weekly(user: $user, start: $start, end: $end, granularity: WEEK) {
+            success
+            results {
+                username
+                period
+                exercises {
+                    exerciseType
+                    totalDuration
+                }
+            }
+        }
+    }
+    """
+    variables = {"user": "weekuser", "start": "2023-10-02", "end": "2023-10-15"}
+
+    mock_mongo['test'].exercises.insert_many([
+        {"username": "weekuser", "exerciseType": "Running", "duration": 30, "date": datetime(2023, 10, 2)},
+        {"username": "weekuser", "exerciseType": "Running", "duration": 40, "date": datetime(2023, 10, 4)},
+        {"username": "weekuser", "exerciseType": "Gym", "duration": 50, "date": datetime(2023, 10, 12)}
+    ])
+
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': variables})
+    assert response.status_code == 200
+
+    data = json.loads(response.data)
+    results = data['data']['weekly']['results']
+    assert [result['period'] for result in results] == ["2023-10-02", "2023-10-09"]
+    assert results[0]['exercises'] == [{"exerciseType": "Running", "totalDuration": 70}]
+    assert results[1]['exercises'] == [{"exerciseType": "Gym", "totalDuration": 50}]
+
+
+def test_graphql_trends_query(client, mock_mongo):
+    """
+    Tests the GraphQL 'trends' query over a user's exercises.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    query = """
+    query Trends($user: String, $start: String!, $end: String!) {
+        trends(user: $user, start: $start, end: $end, window: 2) {
+            success
+            errors
+            trends {
+                totalDuration
+                count
+                exercises { exerciseType totalDuration }
+                weekly { period totalDuration count }
+                rollingAverage { day value }
+                longestStreak
+                currentStreak
+            }
+        }
+    }
+    """
+    variables = {"user": "trenduser", "start": "2023-11-01", "end": "2023-11-04"}
+
+    mock_mongo['test'].exercises.insert_many([
+        {"username": "trenduser", "exerciseType": "Running", "duration": 30, "date": datetime(2023, 11, 1, 7)},
+        {"username": "trenduser", "exerciseType": "Gym", "duration": 60, "date": datetime(2023, 11, 2, 18)},
+        {"username": "trenduser", "exerciseType": "Running", "duration": 20, "date": datetime(2023, 11, 4, 9)}
+    ])
+
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': variables})
+    result = json.loads(response.data)['data']['trends']
+    assert result['success'] is True
+    trends = result['trends']
+    assert (trends['totalDuration'], trends['count']) == (110, 3)
+    assert trends['exercises'] == [{"exerciseType": "Gym", "totalDuration": 60}, {"exerciseType": "Running", "totalDuration": 50}]
+    assert trends['weekly'] == [{"period": "2023-10-30", "totalDuration": 110, "count": 3}]
+    assert [point['value'] for point in trends['rollingAverage']] == [30.0, 45.0, 30.0, 10.0]
+    assert (trends['longestStreak'], trends['currentStreak']) == (2, 1)
+
+    variables["end"] = "2023-10-01"
+    result = json.loads(client.post('/analytics/graphql', json={'query': query, 'variables': variables}).data)['data']['trends']
+    assert result['success'] is False
+
+
+def test_graphql_distribution_query(client, mock_mongo):
+    """
+    Tests the GraphQL 'distribution' query over a user's exercise durations.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    query = """
+    query Distribution($user: String, $exerciseType: String) {
+        distribution(user: $user, exerciseType: $exerciseType) {
+            success
+            results { username exercises { exerciseType count mean median p90 min max stddev } }
+        }
+    }
+    """
+    mock_mongo['test'].exercises.insert_many([
+        {"username": "distuser", "exerciseType": "Running", "duration": duration, "date": datetime(2023, 12, 1)}
+        for duration in (10, 20, 30, 40, 100)
+    ] + [{"username": "distuser", "exerciseType": "Gym", "duration": 60, "date": datetime(2023, 12, 2)}])
+
+    variables = {"user": "distuser", "exerciseType": "Running"}
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': variables})
+    result = json.loads(response.data)['data']['distribution']
+    assert result['success'] is True
+    running = result['results'][0]['exercises']
+    assert len(running) == 1
+    assert (running[0]['count'], running[0]['mean'], running[0]['min'], running[0]['max']) == (5, 40.0, 10, 100)
+    assert running[0]['median'] == pytest.approx(30, rel=0.01)
+    assert running[0]['p90'] == pytest.approx(100, rel=0.01)
+    assert running[0]['stddev'] == 31.62
+
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': {"user": "distuser"}})
+    exercises = json.loads(response.data)['data']['distribution']['results'][0]['exercises']
+    assert [exercise['exerciseType'] for exercise in exercises] == ["Gym", "Running"]
+
+
+def test_graphql_leaderboard_query(client, mock_mongo):
+    """
+    Tests the GraphQL 'leaderboard' query over a month of exercises.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    query = """
+    query Leaderboard($exerciseType: String, $start: String, $end: String, $limit: Int) {
+        leaderboard(exerciseType: $exerciseType, start: $start, end: $end, limit: $limit) {
+            success
+            errors
+            entries { rank username totalDuration count }
+        }
+    }
+    """
+    mock_mongo['test'].exercises.insert_many([
+        {"username": "leader1", "exerciseType": "Swimming", "duration": 40, "date": datetime(2022, 2, 5)},
+        {"username": "leader2", "exerciseType": "Swimming", "duration": 40, "date": datetime(2022, 2, 6)},
+        {"username": "leader3", "exerciseType": "Swimming", "duration": 90, "date": datetime(2022, 2, 7)},
+        {"username": "leader2", "exerciseType": "Swimming", "duration": 5000, "date": datetime(2022, 1, 31)}
+    ])
+
+    variables = {"exerciseType": "Swimming", "start": "2022-02-01", "end": "2022-02-28", "limit": 2}
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': variables})
+    result = json.loads(response.data)['data']['leaderboard']
+    assert result['success'] is True
+    assert result['entries'] == [
+        {"rank": 1, "username": "leader3", "totalDuration": 90, "count": 1},
+        {"rank": 2, "username": "leader1", "totalDuration": 40, "count": 1}
+    ]
+
+    variables = {"exerciseType": "Swimming", "limit": 1}
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': variables})
+    assert json.loads(response.data)['data']['leaderboard']['entries'][0]['username'] == "leader2"
+
+    variables = {"exerciseType": "Swimming", "start": "2022-02-01"}
+    result = json.loads(client.post('/analytics/graphql', json={'query': query, 'variables': variables}).data)['data']['leaderboard']
+    assert result['success'] is False
+
+
+def test_graphql_query_cost_limits(client, mock_mongo):
+    """
+    Tests that operations over the cost or alias limits are rejected before they are executed.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    aliases = " ".join(f'u{index}: filteredStats(name: "user{index}") {{ success }}' for index in range(500))
+    response = client.post('/analytics/graphql', json={'query': '{ %s }' % aliases})
+    assert response.status_code == 400
+    errors = json.loads(response.data)['errors']
+    assert {error['extensions']['code'] for error in errors} == {"QUERY_TOO_COMPLEX"}
+    assert any("aliases" in error['message'] for error in errors)
+
+    query = "query($names: [String!]!) { multiUserStats(names: $names) { success results { username } } }"
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': {'names': ["a"] * 5000}})
+    assert response.status_code == 400
+    assert "cost" in json.loads(response.data)['errors'][0]['message']
+
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': {'names': ["a"]}})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['multiUserStats']['success'] is True
+
+    # Fragment cycles are reported by validation, and fragments spread at every level of a
+    # nesting are counted once per spread without walking them again
+    cycle = '{ __type(name: "Query") { ...F } } fragment F on __Type { fields { type { ...F } } }'
+    response = client.post('/analytics/graphql', json={'query': cycle})
+    assert response.status_code == 400
+    assert "within itself" in json.loads(response.data)['errors'][0]['message']
+
+    nested = ["fragment L0 on __Type { name }"] + [
+        f"fragment L{level} on __Type {{ name ...L{level - 1} ...L{level - 1} }}" for level in range(1, 31)
+    ]
+    response = client.post('/analytics/graphql', json={'query': '{ __type(name: "Query") { ...L30 } } ' + " ".join(nested)})
+    assert response.status_code == 400
+    assert "fields" in json.loads(response.data)['errors'][0]['message']
+
+
+def test_resolver_metrics(client, mock_mongo):
+    """
+    Tests that the GraphQL resolvers are timed per field and operation on /metrics.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    response = client.post('/analytics/graphql', json={'query': 'query Dashboard { stats { success } }'})
+    assert response.status_code == 200
+    metrics = client.get('/metrics').data.decode()
+    assert 'graphql_resolver_duration_seconds_count{field="Query.stats",operation="Dashboard"} 1.0' in metrics
+    assert 'mongodb_command_duration_seconds' in metrics
+
+
+def test_cached_stats_skip_mongodb(client, mock_mongo, monkeypatch):
+    """
+    Tests that a cached result is served without syncing or reading the rollups once the
+    sync runs in the background.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+        monkeypatch: Pytest fixture to replace the refresher and the rollup reads.
+    """
+    import app
+    import rollups
+
+    syncs, reads = [], []
+    refresher = rollups.RollupRefresher(lambda: syncs.append(1), interval=3600)
+    read_stats = rollups.read_stats
+    monkeypatch.setattr(app, 'rollup_refresher', refresher)
+    monkeypatch.setattr(rollups, 'read_stats', lambda *args: reads.append(1) or read_stats(*args))
+    app.result_cache.clear()
+    try:
+        for _ in range(3):
+            response = client.post('/analytics/graphql', json={'query': '{ stats { success } }'})
+            assert json.loads(response.data)['data']['stats']['success'] is True
+    finally:
+        refresher.stop()
+    assert len(reads) == 1
+    assert len(syncs) <= 1
@@ -0,0 +1,141 @@
+import threading
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+pytest.importorskip("motor")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+from starlette.testclient import TestClient  # noqa: E402
+
+from cache import InMemorySharedStore, SharedCacheBackend  # noqa: E402
+
+
+@pytest.fixture
+def asgi_client(mock_mongo):
+    # Import the Flask app with the mocked client first, asgi.py reuses its schema and cache
+    with patch('pymongo.MongoClient', return_value=mock_mongo):
+        import asgi
+    asgi.result_cache.clear()
+    with patch('asgi.AsyncIOMotorClient', mongomock_motor.AsyncMongoMockClient):
+        with TestClient(asgi.app) as client:
+            yield client, asgi.get_db()
+
+
+def test_asgi_graphql_resolvers(asgi_client):
+    """
+    Tests the async resolvers, including several aliased fields resolved concurrently.
+
+    Args:
+        asgi_client: Starlette test client and the async database it is connected to.
+    """
+    client, db = asgi_client
+    client.portal.call(db.exercises.insert_many, [
+        {"username": "asyncuser", "exerciseType": "Running", "duration": 25, "date": datetime(2024, 5, 6)},
+        {"username": "asyncuser", "exerciseType": "Running", "duration": 35, "date": datetime(2024, 5, 14)}
+    ])
+
+    query = """
+    query {
+        all: stats { success results { username } }
+        user: filteredStats(name: "asyncuser") { success results { exercises { exerciseType totalDuration } } }
+        weeks: weekly(user: "asyncuser", start: "2024-05-01", end: "2024-05-31", granularity: WEEK) {
+            success
+            results { period exercises { totalDuration } }
+        }
+        trends(user: "asyncuser", start: "2024-05-06", end: "2024-05-14", window: 2) {
+            success
+            trends { totalDuration count longestStreak }
+        }
+        distribution(user: "asyncuser") { success results { exercises { exerciseType count mean median } } }
+        leaderboard(exerciseType: "Running", start: "2024-05-01", end: "2024-05-31") { success entries { rank username } }
+    }
+    """
+    response = client.post('/analytics/graphql', json={'query': query})
+    assert response.status_code == 200
+    data = response.json()['data']
+
+    assert [result['username'] for result in data['all']['results']] == ["asyncuser"]
+    assert data['user']['results'][0]['exercises'] == [{"exerciseType": "Running", "totalDuration": 60}]
+    assert [week['period'] for week in data['weeks']['results']] == ["2024-05-06", "2024-05-13"]
+    assert data['trends']['trends'] == {"totalDuration": 60, "count": 2, "longestStreak": 1}
+    assert data['distribution']['results'][0]['exercises'] == [
+        {"exerciseType": "Running", "count": 2, "mean": 30.0, "median": 25.0}
+    ]
+    assert data['leaderboard'] == {"success": True, "entries": [{"rank": 1, "username": "asyncuser"}]}
+
+
+class ThreadRecordingStore(InMemorySharedStore):
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value, ex=None):
+        self.threads.add(threading.get_ident())
+        return super().set(key, value, ex=ex)
+
+
+def test_asgi_shared_cache_calls_leave_the_event_loop(asgi_client, monkeypatch):
+    """
+    Tests that the blocking calls to a shared (Redis) result cache run off the event loop.
+
+    Args:
+        asgi_client: Starlette test client and the async database it is connected to.
+        monkeypatch: Swaps in the shared cache backend.
+    """
+    import asgi
+    client, _ = asgi_client
+    store = ThreadRecordingStore()
+    monkeypatch.setattr(asgi.result_cache, "backend", SharedCacheBackend(store))
+    loop_thread = client.portal.call(current_thread_ident)
+
+    query = '{ all: stats { success } user: filteredStats(name: "asyncuser") { success } }'
+    for _ in range(2):
+        response = client.post('/analytics/graphql', json={'query': query})
+        assert response.json()['data']['all']['success'] is True
+    assert store.threads and loop_thread not in store.threads
+
+
+async def current_thread_ident():
+    return threading.get_ident()
+
+
+def test_asgi_health_check(asgi_client):
+    client, _ = asgi_client
+    response = client.get('/')
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_asgi_exercise_totals_subscription(asgi_client, monkeypatch):
+    """
+    Tests the exerciseTotals subscription over the graphql-transport-ws protocol.
+
+    Args:
+        asgi_client: Starlette test client and the async database it is connected to.
+    """
+    import asgi
+
+    client, _ = asgi_client
+    monkeypatch.setattr(asgi.live_updates, "poll_seconds", 0.05)
+    query = """
+    subscription {
+        exerciseTotals(user: "wsuser") { username snapshot exercises { exerciseType totalDuration durationDelta } }
+    }
+    """
+    with client.websocket_connect('/analytics/graphql', subprotocols=['graphql-transport-ws']) as websocket:
+        websocket.send_json({"type": "connection_init"})
+        assert websocket.receive_json()["type"] == "connection_ack"
+        websocket.send_json({"id": "1", "type": "subscribe", "payload": {"query": query}})
+        snapshot = websocket.receive_json()["payload"]["data"]["exerciseTotals"]
+        assert snapshot == {"username": "wsuser", "snapshot": True, "exercises": []}
+
+        # The watcher reads the exercises written through the synchronous client
+        asgi.live_updates.db.exercises.insert_one({"username": "wsuser", "exerciseType": "Gym", "duration": 40})
+        update = websocket.receive_json()["payload"]["data"]["exerciseTotals"]
+        assert update["exercises"] == [{"exerciseType": "Gym", "totalDuration": 40, "durationDelta": 40}]
+        websocket.send_json({"id": "1", "type": "complete"})
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+# Add the parent directory to sys.path, to get the correct app path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import InMemorySharedStore, LocalCacheBackend, ResultCache, SharedCacheBackend  # noqa: E402
+
+
+@pytest.fixture(params=["local", "shared"])
+def backend(request):
+    if request.param == "local":
+        return LocalCacheBackend(max_entries=2)
+    return SharedCacheBackend(InMemorySharedStore())
+
+
+def test_result_cache_hits_and_invalidation(backend):
+    """
+    Tests that results are served from the cache until one of their users is invalidated.
+    """
+    registry = CollectorRegistry()
+    cache = ResultCache(backend, ttl=60, registry=registry)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [{"username": "alice"}]
+
+    assert cache.get_or_compute("filteredStats", {"name": "alice"}, "alice", compute) == [{"username": "alice"}]
+    cache.get_or_compute("filteredStats", {"name": "alice"}, "alice", compute)
+    assert len(calls) == 1
+
+    # Invalidating another user keeps alice's entry
+    cache.invalidate_users(["bob"])
+    cache.get_or_compute("filteredStats", {"name": "alice"}, "alice", compute)
+    assert len(calls) == 1
+
+    cache.invalidate_users(["alice"])
+    cache.get_or_compute("filteredStats", {"name": "alice"}, "alice", compute)
+    assert len(calls) == 2
+
+    assert registry.get_sample_value('analytics_cache_hits_total', {'resolver': 'filteredStats'}) == 2
+    assert registry.get_sample_value('analytics_cache_misses_total', {'resolver': 'filteredStats'}) == 2
+
+
+def test_all_users_results_invalidated_by_any_user(backend):
+    """
+    Tests that results spanning all users are invalidated whenever any user changes.
+    """
+    cache = ResultCache(backend, ttl=60)
+    calls = []
+    cache.get_or_compute("stats", {}, None, lambda: calls.append(1) or ["first"])
+    cache.invalidate_users(["carol"])
+    assert cache.get_or_compute("stats", {}, None, lambda: calls.append(1) or ["second"]) == ["second"]
+    assert len(calls) == 2
+
+
+def test_local_backend_ttl_and_lru_eviction():
+    """
+    Tests that the local backend expires entries and evicts the least recently used one.
+    """
+    registry = CollectorRegistry()
+    backend = LocalCacheBackend(max_entries=2)
+    ResultCache(backend, registry=registry)
+
+    backend.set("a", 1, ttl=60)
+    backend.set("b", 2, ttl=60)
+    backend.get("a")
+    backend.set("c", 3, ttl=60)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+    assert registry.get_sample_value('analytics_cache_evictions_total') == 1
+
+    backend.set("d", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("d") is None
+
+
+def test_shared_backend_clear_keeps_other_keys():
+    """
+    Tests that clearing the shared backend only deletes the keys under its prefix.
+    """
+    store = InMemorySharedStore()
+    store.set("sessions:abc", "kept")
+    backend = SharedCacheBackend(store)
+    backend.CLEAR_BATCH_SIZE = 2
+    cache = ResultCache(backend, ttl=60)
+    for name in ("alice", "bob", "carol"):
+        cache.get_or_compute("filteredStats", {"name": name}, name, lambda: ["cached"])
+    cache.invalidate_users(["alice"])
+
+    cache.clear()
+    assert store.get("sessions:abc") == "kept"
+    assert list(store.scan_iter(match="analytics:*")) == []
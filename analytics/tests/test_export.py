@@ -0,0 +1,67 @@
+import json
+from datetime import datetime
+
+
+def _insert_export_data(mock_mongo, username):
+    mock_mongo['test'].exercises.insert_many([
+        {"username": username, "exerciseType": "Running", "duration": 30, "date": datetime(2024, 3, 1)},
+        {"username": username, "exerciseType": "Gym", "duration": 45, "date": datetime(2024, 3, 2)},
+        {"username": username, "exerciseType": "Cycling", "duration": 60, "date": datetime(2024, 3, 9)}
+    ])
+
+
+def test_index_is_a_cheap_health_check(client):
+    """
+    Tests that the welcome page only reports the service status.
+    """
+    response = client.get('/')
+    assert response.status_code == 200
+    assert json.loads(response.data)['status'] == "ok"
+
+
+def test_export_ndjson_with_resume(client, mock_mongo):
+    """
+    Tests the NDJSON export with username/date filters and resuming after the last _id.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    _insert_export_data(mock_mongo, "ndjsonuser")
+
+    response = client.get('/analytics/export?username=ndjsonuser&start=2024-03-01&end=2024-03-02&batch_size=1')
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['exerciseType'] for row in rows] == ["Running", "Gym"]
+    assert rows[0]['date'] == "2024-03-01T00:00:00"
+
+    response = client.get(f"/analytics/export?username=ndjsonuser&after_id={rows[0]['_id']}")
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['exerciseType'] for row in rows] == ["Gym", "Cycling"]
+
+
+def test_export_csv_with_projection(client, mock_mongo):
+    """
+    Tests the CSV export restricted to a subset of fields.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    _insert_export_data(mock_mongo, "csvuser")
+
+    response = client.get('/analytics/export?format=csv&username=csvuser&start=2024-03-09&fields=exerciseType,duration')
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.data.decode().splitlines() == ["exerciseType,duration", "Cycling,60"]
+
+
+def test_export_rejects_invalid_parameters(client):
+    """
+    Tests that invalid export parameters are rejected before querying the database.
+    """
+    for query_string in ["format=xml", "batch_size=0", "start=03-2024", "after_id=nope"]:
+        response = client.get(f'/analytics/export?{query_string}')
+        assert response.status_code == 400
+        assert "error" in json.loads(response.data)
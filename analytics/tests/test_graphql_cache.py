@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+from graphql import build_schema
+from graphql.validation import specified_rules
+
+# Add the parent directory to sys.path, to get the correct app path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import graphql_cache  # noqa: E402
+
+
+def test_automatic_persisted_query_flow(client):
+    """
+    Tests the APQ protocol: unknown hash, registration with the query, then hash only.
+
+    Args:
+        client: Pytest fixture for the test client.
+    """
+    query = "query { stats { success } }"
+    extensions = {"persistedQuery": {"version": 1, "sha256Hash": graphql_cache.query_hash(query)}}
+
+    response = client.post('/analytics/graphql', json={'extensions': extensions})
+    assert response.status_code == 200
+    error = json.loads(response.data)['errors'][0]
+    assert error['extensions']['code'] == graphql_cache.PERSISTED_QUERY_NOT_FOUND
+
+    response = client.post('/analytics/graphql', json={'query': query, 'extensions': extensions})
+    assert json.loads(response.data)['data']['stats']['success'] is True
+
+    response = client.post('/analytics/graphql', json={'extensions': extensions})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['stats']['success'] is True
+
+    wrong_hash = {"persistedQuery": {"version": 1, "sha256Hash": "0" * 64}}
+    response = client.post('/analytics/graphql', json={'query': query, 'extensions': wrong_hash})
+    assert response.status_code == 400
+
+
+def test_document_cache_skips_parse_and_validate(monkeypatch):
+    """
+    Tests that a repeated query is parsed and validated only once.
+    """
+    schema = build_schema("type Query { hello: String }")
+    cache = graphql_cache.DocumentCache(max_entries=1)
+    validations = []
+    validate = graphql_cache.validate
+    monkeypatch.setattr(graphql_cache, "validate", lambda *args, **kwargs: validations.append(1) or validate(*args, **kwargs))
+
+    for _ in range(3):
+        document = cache.parse(None, {"query": "{ hello }"})
+        assert cache.validate(schema, document, rules=specified_rules) == []
+    assert len(validations) == 1
+    assert cache.parse(None, {"query": "{ hello }"}) is document
+
+    # Evicting the entry forces a new parse and validation
+    cache.parse(None, {"query": "{ __typename }"})
+    document = cache.parse(None, {"query": "{ hello }"})
+    cache.validate(schema, document, rules=specified_rules)
+    assert len(validations) == 2
+
+    # Invalid documents are never marked as validated
+    document = cache.parse(None, {"query": "{ missing }"})
+    assert cache.validate(schema, document, rules=specified_rules)
+    assert cache.validate(schema, document, rules=specified_rules)
+
+
+def test_registry_preloads_queries_from_file(tmp_path):
+    query = "query { stats { success } }"
+    path = tmp_path / "persisted_queries.json"
+    path.write_text(json.dumps({graphql_cache.query_hash(query): query}))
+
+    registry = graphql_cache.PersistedQueryRegistry(path=str(path))
+    data = {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": graphql_cache.query_hash(query)}}}
+    assert registry.resolve(data)["query"] == query
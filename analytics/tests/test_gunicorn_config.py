@@ -0,0 +1,89 @@
+import gc
+import importlib
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import gunicorn_config
+from gunicorn_config import available_cpus, default_workers
+
+
+class FakeClient:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLogging:
+    restarts = 0
+
+    def restart(self):
+        self.restarts += 1
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = SimpleNamespace(client=FakeClient(), async_logging=FakeLogging())
+    monkeypatch.setattr(gunicorn_config, "APP_MODULE", "preloaded_app")
+    monkeypatch.setitem(sys.modules, "preloaded_app", service)
+    return service
+
+
+def test_workers_follow_the_cpus_and_worker_class():
+    assert default_workers("sync", 4) == 9
+    assert default_workers("gthread", 4) == 4
+    assert default_workers("gevent", 8) == 8
+    # Never a single worker, so recycling one does not stop the service
+    assert default_workers("gthread", 1) == 2
+    with pytest.raises(ValueError):
+        default_workers("eventlet", 4)
+
+
+def test_cpus_are_capped_by_the_cgroup_quota(tmp_path):
+    cpu_max = tmp_path / "cpu.max"
+    unlimited = available_cpus(str(tmp_path / "missing"))
+
+    cpu_max.write_text("max 100000\n")
+    assert available_cpus(str(cpu_max)) == unlimited
+    cpu_max.write_text("50000 100000\n")
+    assert available_cpus(str(cpu_max)) == 1
+    cpu_max.write_text(f"{(unlimited + 4) * 100000} 100000\n")
+    assert available_cpus(str(cpu_max)) == unlimited
+
+
+def test_settings_come_from_the_env(monkeypatch):
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "sync")
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.setenv("GUNICORN_MAX_REQUESTS", "500")
+    monkeypatch.setenv("GUNICORN_PRELOAD", "false")
+    try:
+        config = importlib.reload(gunicorn_config)
+        assert (config.worker_class, config.workers, config.threads) == ("sync", 3, 1)
+        assert (config.max_requests, config.max_requests_jitter) == (500, 50)
+        assert config.preload_app is False
+    finally:
+        monkeypatch.undo()
+        importlib.reload(gunicorn_config)
+    assert gunicorn_config.worker_class == "gthread"
+    assert gunicorn_config.preload_app is True
+
+
+def test_master_closes_its_client_before_forking(service):
+    try:
+        gunicorn_config.when_ready(server=None)
+    finally:
+        gc.unfreeze()
+    assert service.client.closed
+
+
+def test_workers_restart_the_log_listener(service):
+    gunicorn_config.post_fork(server=None, worker=None)
+    assert service.async_logging.restarts == 1
+
+
+def test_hooks_do_nothing_without_a_preloaded_app(monkeypatch):
+    monkeypatch.setattr(gunicorn_config, "APP_MODULE", "not_loaded_app")
+    gunicorn_config.when_ready(server=None)
+    gunicorn_config.post_fork(server=None, worker=None)
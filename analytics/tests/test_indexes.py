@@ -0,0 +1,80 @@
+import os
+import sys
+from datetime import datetime
+
+import mongomock
+import pytest
+
+# Add the parent directory to sys.path, to get the correct app path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import indexes  # noqa: E402
+import rollups  # noqa: E402
+
+
+def test_ensure_indexes_is_idempotent():
+    """
+    Tests that the declared indexes are created and that running again changes nothing.
+    """
+    db = mongomock.MongoClient()['indexes_test']
+    indexes.ensure_indexes(db)
+    indexes.ensure_indexes(db)
+
+    assert {"username_date", "username_exerciseType"} <= set(db.exercises.index_information())
+    assert db[rollups.ROLLUPS_COLLECTION].index_information()["username_exerciseType"]["unique"] is True
+
+
+def test_find_collscans_in_find_and_aggregate_plans():
+    """
+    Tests that COLLSCAN stages are found in winning plans but not in rejected plans.
+    """
+    find_plan = {"queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "username_date"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}]
+    }}
+    assert indexes.find_collscans(find_plan) == []
+
+    aggregate_plan = {"stages": [
+        {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}},
+        {"$group": {}}
+    ]}
+    assert len(indexes.find_collscans(aggregate_plan)) == 1
+
+    sharded_plan = {"queryPlanner": {"winningPlan": {"shards": [
+        {"winningPlan": {"stage": "IXSCAN"}}, {"winningPlan": {"stage": "COLLSCAN"}}
+    ]}}}
+    assert len(indexes.find_collscans(sharded_plan)) == 1
+
+
+def test_hot_path_queries_are_the_issued_ones():
+    """
+    Tests that every hot-path query is a find or aggregate the database runs, built by the
+    same builders as the resolvers.
+    """
+    db = mongomock.MongoClient()['indexes_test']
+    commands = dict(indexes.hot_path_queries())
+    for command in commands.values():
+        if "find" in command:
+            cursor = db[command["find"]].find(command["filter"])
+            if "sort" in command:
+                cursor = cursor.sort(list(command["sort"].items()))
+            list(cursor)
+        else:
+            list(db[command["aggregate"]].aggregate(command["pipeline"]))
+    assert commands["leaderboard for a period"]["pipeline"] == rollups.leaderboard_pipeline("Running", datetime(2024, 1, 1), datetime(2024, 1, 1), 10)
+
+
+# Query plans can only be checked against a real MongoDB; CI runs this against a MongoDB
+# service container (see .github/workflows/deploy_develop.yml), locally e.g.
+# MONGO_TEST_URI=mongodb://localhost:27017 poetry run pytest tests/test_indexes.py
+@pytest.mark.skipif(not os.getenv('MONGO_TEST_URI'), reason="MONGO_TEST_URI is not set")
+def test_hot_path_queries_do_not_collscan():
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv('MONGO_TEST_URI'))
+    db = client['analytics_index_test']
+    try:
+        indexes.ensure_indexes(db)
+        assert indexes.check_query_plans(db) == []
+    finally:
+        client.drop_database('analytics_index_test')
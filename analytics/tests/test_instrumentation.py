@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from ariadne import QueryType, graphql, graphql_sync, make_executable_schema
+from prometheus_client import CollectorRegistry
+
+from instrumentation import BoundedLabels, MongoCommandMetrics, ResolverMetrics
+
+TYPE_DEFS = """
+type Item { name: String }
+type Query { item: Item, asyncItem: Item }
+"""
+
+
+def build_schema():
+    query = QueryType()
+
+    @query.field("item")
+    def resolve_item(*_):
+        return {"name": "one"}
+
+    @query.field("asyncItem")
+    async def resolve_async_item(*_):
+        return {"name": "two"}
+    return make_executable_schema(TYPE_DEFS, query)
+
+
+def resolver_count(registry, field, operation):
+    return registry.get_sample_value(
+        "graphql_resolver_duration_seconds_count", {"field": field, "operation": operation}
+    )
+
+
+def test_bounded_labels_fold_extra_values_into_other():
+    labels = BoundedLabels(max_values=2)
+    assert [labels(value) for value in ("a", "b", "c", "a")] == ["a", "b", "other", "a"]
+
+
+def test_resolver_durations_are_labelled_by_field_and_operation():
+    registry = CollectorRegistry()
+    metrics = ResolverMetrics(registry, max_operations=1)
+    schema = build_schema()
+
+    graphql_sync(schema, {"query": "query Items { item { name } }"}, middleware=[metrics])
+    graphql_sync(schema, {"query": "query Other { item { name } }"}, middleware=[metrics])
+    graphql_sync(schema, {"query": "{ item { name } }"}, middleware=[metrics])
+    asyncio.run(graphql(schema, {"query": "query Items { asyncItem { name } }"}, middleware=[metrics]))
+
+    assert resolver_count(registry, "Query.item", "Items") == 1
+    assert resolver_count(registry, "Query.item", "other") == 2
+    assert resolver_count(registry, "Query.asyncItem", "Items") == 1
+    # Fields without their own resolver are not timed
+    assert resolver_count(registry, "Item.name", "Items") is None
+
+
+def command_event(request_id, command_name, command=None, reply=None, duration_micros=1500):
+    return SimpleNamespace(
+        connection_id=("localhost", 27017), request_id=request_id, command_name=command_name,
+        command=command or {}, reply=reply or {}, duration_micros=duration_micros
+    )
+
+
+def test_mongo_command_metrics():
+    registry = CollectorRegistry()
+    listener = MongoCommandMetrics(registry)
+
+    listener.started(command_event(1, "find", {"find": "recipes", "filter": {}}))
+    listener.succeeded(command_event(1, "find", reply={"cursor": {"firstBatch": [{}, {}, {}], "id": 7}}))
+    listener.started(command_event(2, "getMore", {"getMore": 7, "collection": "recipes"}))
+    listener.succeeded(command_event(2, "getMore", reply={"cursor": {"nextBatch": [{}], "id": 0}}))
+    listener.started(command_event(3, "ping", {"ping": 1}))
+    listener.failed(command_event(3, "ping"))
+
+    labels = {"collection": "recipes", "command": "find"}
+    assert registry.get_sample_value("mongodb_command_duration_seconds_count", labels) == 1
+    assert registry.get_sample_value("mongodb_command_duration_seconds_sum", labels) == 0.0015
+    assert registry.get_sample_value("mongodb_documents_returned_total", labels) == 3
+    assert registry.get_sample_value("mongodb_documents_returned_total", {"collection": "recipes", "command": "getMore"}) == 1
+    assert registry.get_sample_value("mongodb_command_failures_total", {"collection": "none", "command": "ping"}) == 1
@@ -0,0 +1,180 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+import live
+from live import LiveUpdates, Subscription
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def live_updates(db):
+    # The watcher thread only waits; the tests drive the polling themselves
+    updates = LiveUpdates(db, mode="poll", poll_seconds=3600)
+    yield updates
+    updates.stop()
+
+
+def exercise(username, exercise_type, duration, **fields):
+    return dict({"username": username, "exerciseType": exercise_type, "duration": duration}, **fields)
+
+
+def totals(update):
+    return {item["exerciseType"]: (item["totalDuration"], item["count"]) for item in update["exercises"]}
+
+
+def deltas(update):
+    return {item["exerciseType"]: (item["durationDelta"], item["countDelta"]) for item in update["exercises"]}
+
+
+def test_subscription_starts_with_a_snapshot(db, live_updates):
+    db.exercises.insert_many([exercise("alice", "Running", 30), exercise("alice", "Gym", 45), exercise("bob", "Gym", 60)])
+    subscription = live_updates.subscribe(Subscription("alice"))
+    update = subscription.get(timeout=1)
+    assert update["snapshot"] is True
+    assert totals(update) == {"Gym": (45, 1), "Running": (30, 1)}
+    assert deltas(update) == {"Gym": (0, 0), "Running": (0, 0)}
+
+
+def test_exercises_applied_while_the_totals_load_are_counted_once(db, live_updates, monkeypatch):
+    db.exercises.insert_one(exercise("alice", "Running", 30))
+    read_totals = live_updates._read_totals
+
+    def read_while_the_watcher_applies(username):
+        loaded = read_totals(username)
+        counted = db.exercises.find_one({"username": "alice"})
+        new_id = db.exercises.insert_one(exercise("alice", "Running", 20)).inserted_id
+        # The watcher thread is not held up by the aggregation
+        watcher = threading.Thread(
+            target=live_updates.apply_exercises, args=([counted, db.exercises.find_one({"_id": new_id})],)
+        )
+        watcher.start()
+        watcher.join(timeout=1)
+        assert not watcher.is_alive()
+        return loaded
+
+    monkeypatch.setattr(live_updates, "_read_totals", read_while_the_watcher_applies)
+    subscription = live_updates.subscribe(Subscription("alice"))
+    assert totals(subscription.get(timeout=1)) == {"Running": (50, 2)}
+    assert subscription.get(timeout=0) is None
+
+
+def test_polling_pushes_deltas_of_new_exercises(db, live_updates):
+    db.exercises.insert_one(exercise("alice", "Running", 30))
+    subscription = live_updates.subscribe(Subscription("alice"))
+    subscription.get(timeout=1)
+    live_updates.poll_once()
+    assert subscription.get(timeout=0) is None
+
+    db.exercises.insert_many([exercise("alice", "Running", 20), exercise("alice", "Swimming", 40), exercise("bob", "Gym", 60)])
+    live_updates.poll_once()
+    update = subscription.get(timeout=1)
+    assert update["snapshot"] is False
+    assert totals(update) == {"Running": (50, 2), "Swimming": (40, 1)}
+    assert deltas(update) == {"Running": (20, 1), "Swimming": (40, 1)}
+    assert subscription.get(timeout=0) is None
+
+
+def test_exercises_in_the_snapshot_are_not_counted_twice(db, live_updates):
+    live_updates.poll_once()
+    db.exercises.insert_one(exercise("alice", "Running", 30))
+    subscription = live_updates.subscribe(Subscription("alice"))
+    assert totals(subscription.get(timeout=1)) == {"Running": (30, 1)}
+    live_updates.poll_once()
+    assert subscription.get(timeout=0) is None
+
+
+def test_updates_and_deletes_resync_the_totals(db, live_updates):
+    first = db.exercises.insert_one(exercise("alice", "Running", 30, updatedAt=datetime(2024, 1, 1))).inserted_id
+    second = db.exercises.insert_one(exercise("alice", "Gym", 45)).inserted_id
+    subscription = live_updates.subscribe(Subscription("alice"))
+    subscription.get(timeout=1)
+    live_updates.poll_once()
+
+    db.exercises.update_one({"_id": first}, {"$set": {"duration": 35, "updatedAt": datetime.utcnow() + timedelta(seconds=1)}})
+    live_updates.poll_once()
+    update = subscription.get(timeout=1)
+    assert totals(update) == {"Running": (35, 1)} and deltas(update) == {"Running": (5, 0)}
+
+    db.exercises.delete_one({"_id": second})
+    live_updates.handle_change({"operationType": "delete", "documentKey": {"_id": second}})
+    update = subscription.get(timeout=1)
+    assert totals(update) == {"Gym": (0, 0)} and deltas(update) == {"Gym": (-45, -1)}
+
+
+def test_change_stream_inserts_are_applied(db, live_updates):
+    subscription = live_updates.subscribe(Subscription("alice"))
+    subscription.get(timeout=1)
+    inserted = exercise("alice", "Cycling", 90)
+    db.exercises.insert_one(inserted)
+    live_updates.handle_change({"operationType": "insert", "fullDocument": inserted})
+    assert deltas(subscription.get(timeout=1)) == {"Cycling": (90, 1)}
+
+
+def test_unsubscribing_drops_the_totals(db, live_updates):
+    subscription = live_updates.subscribe(Subscription("alice"))
+    assert live_updates.has_subscribers()
+    live_updates.unsubscribe(subscription)
+    assert not live_updates.has_subscribers()
+    db.exercises.insert_one(exercise("alice", "Running", 30))
+    live_updates.poll_once()
+    subscription.get(timeout=0)
+    assert subscription.get(timeout=0) is None
+
+
+def test_slow_subscribers_keep_the_latest_updates():
+    subscription = Subscription("alice", max_queued=2)
+    for number in range(5):
+        subscription.put({"number": number})
+    assert [subscription.get(timeout=0)["number"] for _ in range(2)] == [3, 4]
+
+
+def test_sse_endpoint_streams_totals(client, mock_mongo, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.live_updates, "poll_seconds", 0.05)
+    response = client.get('/analytics/live', query_string={'user': 'liveuser'}, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = iter(response.response)
+    snapshot = next(events).decode()
+    assert snapshot.startswith("event: totals\n")
+    assert json.loads(snapshot.split("data: ", 1)[1]) == {"username": "liveuser", "snapshot": True, "exercises": []}
+
+    app.db.exercises.insert_one(exercise("liveuser", "Running", 25))
+    update = json.loads(next(events).decode().split("data: ", 1)[1])
+    assert totals(update) == {"Running": (25, 1)}
+    response.close()
+    assert not app.live_updates.has_subscribers()
+
+    assert client.get('/analytics/live').status_code == 400
+
+
+def test_sse_streams_are_capped_per_worker(client, mock_mongo, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "live_stream_slots", threading.BoundedSemaphore(1))
+    first = client.get('/analytics/live', query_string={'user': 'capped'}, buffered=False)
+    assert first.status_code == 200
+    rejected = client.get('/analytics/live', query_string={'user': 'capped'}, buffered=False)
+    assert rejected.status_code == 503
+    assert "Retry-After" in rejected.headers
+
+    # Closing a stream before reading from it frees its slot and its subscription
+    first.close()
+    assert not app.live_updates.has_subscribers()
+    second = client.get('/analytics/live', query_string={'user': 'capped'}, buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+
+def test_unknown_mode_is_rejected(db):
+    with pytest.raises(ValueError):
+        live.LiveUpdates(db, mode="push")
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import sys
+
+# Add the parent directory to sys.path, to get the correct app path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import loaders  # noqa: E402
+import rollups  # noqa: E402
+
+
+def test_aliased_filtered_stats_share_one_rollup_query(client, mock_mongo, monkeypatch):
+    """
+    Tests that several filteredStats aliases and multiUserStats are loaded with one query.
+
+    Args:
+        client: Pytest fixture for the test client.
+        mock_mongo: Pytest fixture for the mocked MongoDB client.
+    """
+    mock_mongo['test'].exercises.insert_many([
+        {"username": "loaderA", "exerciseType": "Running", "duration": 10},
+        {"username": "loaderB", "exerciseType": "Gym", "duration": 20},
+        {"username": "loaderC", "exerciseType": "Other", "duration": 30}
+    ])
+    calls = []
+    read_stats = rollups.read_stats
+    monkeypatch.setattr(rollups, "read_stats", lambda db, usernames=None: calls.append(usernames) or read_stats(db, usernames))
+
+    query = """
+    query Users($b: String) {
+        a: filteredStats(name: "loaderA") { results { username } }
+        b: filteredStats(name: $b) { results { username } }
+        many: multiUserStats(names: ["loaderA", "loaderC", "nobody"]) {
+            success
+            results { username exercises { totalDuration } }
+        }
+    }
+    """
+    response = client.post('/analytics/graphql', json={'query': query, 'variables': {'b': 'loaderB'}})
+    data = json.loads(response.data)['data']
+
+    assert data['a']['results'] == [{"username": "loaderA"}]
+    assert data['b']['results'] == [{"username": "loaderB"}]
+    assert [result['username'] for result in data['many']['results']] == ["loaderA", "loaderC"]
+    assert len(calls) == 1
+    assert sorted(calls[0]) == ["loaderA", "loaderB", "loaderC", "nobody"]
+
+
+def test_async_loader_batches_loads_issued_in_the_same_tick():
+    """
+    Tests that concurrent loads are dispatched as a single batch.
+    """
+    batches = []
+
+    async def batch_load(usernames):
+        batches.append(list(usernames))
+        return {username: [username.upper()] for username in usernames}
+
+    async def run():
+        loader = loaders.AsyncUserStatsLoader(batch_load)
+        results = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"))
+        later = await loader.load("c")
+        return results, later
+
+    results, later = asyncio.run(run())
+    assert results == [["A"], ["B"], ["A"]]
+    assert later == ["C"]
+    assert batches == [["a", "b"], ["c"]]
@@ -0,0 +1,136 @@
+import os
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+from prometheus_client import CollectorRegistry
+from pymongo.read_preferences import SecondaryPreferred
+
+import mongo_client
+from instrumentation import MongoPoolMetrics
+from mongo_client import ManagedClient, read_preference, settings_from_env
+
+
+class ClientFactory:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, uri, **options):
+        self.calls.append((uri, options))
+        return mongomock.MongoClient()
+
+
+class ResettableListener:
+    resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+
+def test_settings_come_from_the_env():
+    environ = {"MONGO_MAX_POOL_SIZE": "20", "MONGO_WAIT_QUEUE_TIMEOUT_MS": "500", "MONGO_MIN_POOL_SIZE": "", "OTHER": "1"}
+    assert settings_from_env(environ) == {"maxPoolSize": 20, "waitQueueTimeoutMS": 500}
+
+
+def test_read_preferences():
+    assert read_preference("primary") is None and read_preference(None) is None
+    preference = read_preference("secondaryPreferred", "120")
+    assert preference == SecondaryPreferred(max_staleness=120)
+    with pytest.raises(ValueError):
+        read_preference("secondaries")
+
+
+def test_client_is_created_on_first_use():
+    factory = ClientFactory()
+    managed = ManagedClient("mongodb://example:27017", factory=factory, maxPoolSize=5)
+    db = managed.database("fitness")
+    secondary_db = managed.database("fitness", read_preference=SecondaryPreferred())
+    assert factory.calls == []
+
+    db.exercises.insert_one({"username": "alice"})
+    assert factory.calls == [("mongodb://example:27017", {"maxPoolSize": 5})]
+    assert secondary_db["exercises"].count_documents({}) == 1
+    # mongomock hands out one Database per name, so the read preference is checked on another
+    assert managed.database("reports", read_preference=SecondaryPreferred()).read_preference == SecondaryPreferred()
+    assert db.name == "fitness" and managed["fitness"].exercises.count_documents({}) == 1
+    assert len(factory.calls) == 1
+
+
+def test_reset_creates_a_new_client_and_resets_listeners():
+    factory = ClientFactory()
+    listener = ResettableListener()
+    managed = ManagedClient("mongodb://example:27017", factory=factory, event_listeners=[listener])
+    db = managed.database("fitness")
+    first = managed.client
+    db.exercises.insert_one({"username": "alice"})
+    managed.reset()
+    assert managed.client is not first and listener.resets == 1
+    assert db.exercises.count_documents({}) == 0
+    managed.close()
+    assert managed._client is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_processes_create_their_own_client():
+    managed = ManagedClient("mongodb://example:27017", factory=ClientFactory())
+    parent = managed.client
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, b"1" if managed.client is not parent else b"0")
+        os._exit(0)
+    os.close(write)
+    assert os.read(read, 1) == b"1"
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert managed.client is parent
+
+
+def pool_event(**fields):
+    return SimpleNamespace(address=("db", 27017), **fields)
+
+
+def test_pool_metrics():
+    registry = CollectorRegistry()
+    metrics = MongoPoolMetrics(registry)
+
+    def sample(name):
+        return registry.get_sample_value(name, {"server": "db:27017"})
+
+    metrics.pool_created(pool_event(options={"maxPoolSize": 4}))
+    metrics.connection_created(pool_event(connection_id=1))
+    metrics.connection_check_out_started(pool_event())
+    metrics.connection_check_out_started(pool_event())
+    assert sample("mongodb_pool_waiting") == 2
+    metrics.connection_checked_out(pool_event(connection_id=1, duration=0.002))
+    metrics.connection_check_out_failed(pool_event(reason="timeout", duration=0.5))
+    assert sample("mongodb_pool_utilization") == 0.25
+    assert sample("mongodb_pool_waiting") == 0 and sample("mongodb_pool_connections") == 1
+    assert sample("mongodb_pool_checkout_wait_seconds_count") == 2
+    assert sample("mongodb_pool_checkout_wait_seconds_sum") == pytest.approx(0.502)
+
+    # Before pymongo 4.7 the events have no duration, only the counts are updated
+    metrics.connection_check_out_started(pool_event())
+    metrics.connection_checked_out(pool_event(connection_id=1))
+    assert sample("mongodb_pool_checked_out") == 2
+    assert sample("mongodb_pool_checkout_wait_seconds_count") == 2
+    metrics.connection_checked_in(pool_event(connection_id=1))
+
+    metrics.connection_checked_in(pool_event(connection_id=1))
+    assert sample("mongodb_pool_checked_out") == 0 and sample("mongodb_pool_utilization") == 0
+    metrics.pool_closed(pool_event())
+    assert sample("mongodb_pool_max_size") == 0
+
+    metrics.pool_created(pool_event(options={}))
+    assert sample("mongodb_pool_max_size") == 100
+    metrics.reset()
+    assert sample("mongodb_pool_max_size") == 0
+
+
+def test_app_routes_analytics_reads_to_the_configured_database(client, monkeypatch):
+    import app
+
+    assert isinstance(app.db, mongo_client.DatabaseProxy)
+    assert app.analytics_db.name == app.db.name
+    assert client.get('/').status_code == 200
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+from graphql import build_schema, get_introspection_query, parse
+from prometheus_client import CollectorRegistry
+
+import query_cost
+from query_cost import FieldCost, QueryCostLimiter
+
+SCHEMA = build_schema("""
+type Item { name: String tags: [String] owner: User }
+type User { name: String items(first: Int): [Item] }
+type Query {
+    users(names: [String!]): [User]
+    item(name: String!): Item
+    search(first: Int): [Item]
+}
+""")
+
+FIELD_COSTS = {
+    "Query.users": FieldCost(10, multiplier="names"),
+    "Query.search": FieldCost(5, multiplier="first", default=20),
+    "User.items": FieldCost(2, multiplier="first", default=10)
+}
+
+
+def analyze(query, variables=None, operation_name=None):
+    return query_cost.analyze(SCHEMA, parse(query), FIELD_COSTS, variables, operation_name)
+
+
+def test_leaf_fields_are_free_and_objects_cost_one():
+    assert analyze("{ item(name: \"a\") { name tags } }").cost == 1
+    assert analyze("{ item(name: \"a\") { owner { name } } }").cost == 2
+
+
+def test_multipliers_come_from_arguments_and_variables():
+    assert analyze("{ search(first: 3) { owner { name } } }").cost == 5 + 3 * 1
+    assert analyze("{ search { owner { name } } }").cost == 5 + 20 * 1
+    query = "query($n: Int) { search(first: $n) { owner { name } } }"
+    assert analyze(query, {"n": 100}).cost == 5 + 100
+    assert analyze(query, {"n": 2}).cost == 5 + 2
+    assert analyze("{ users(names: [\"a\", \"b\"]) { items(first: 4) { owner { name } } } }").cost == 10 + 2 * (2 + 4 * 1)
+
+
+def test_fragments_depth_and_aliases_are_counted():
+    query = """
+    query Two { ...ItemFields b: item(name: "b") { ... on Item { owner { name } } } }
+    query Other { search { name } }
+    fragment ItemFields on Query { a: item(name: "a") { owner { items { name } } } }
+    """
+    report = analyze(query, operation_name="Two")
+    assert (report.cost, report.depth, report.aliases) == (1 + 1 + 2 + 1 + 1, 4, 2)
+    assert analyze(query).cost == 0
+
+
+def test_standard_introspection_query_is_within_the_default_limits():
+    limiter = QueryCostLimiter(SCHEMA, FIELD_COSTS)
+    assert limiter.check(parse(get_introspection_query())) == []
+
+
+def test_limits_reject_before_execution():
+    registry = CollectorRegistry()
+    limiter = QueryCostLimiter(SCHEMA, FIELD_COSTS, max_cost=50, max_depth=3, max_aliases=2, registry=registry)
+    assert limiter.validation_rules(None, parse("{ search(first: 10) { name } }"), {}) == []
+
+    errors = limiter.check(parse("query($n: Int) { search(first: $n) { owner { name } } }"), {"n": 1000})
+    assert [error.extensions["code"] for error in errors] == ["QUERY_TOO_COMPLEX"]
+    assert "cost 1005" in errors[0].message
+
+    aliases = "{ " + " ".join(f"a{index}: item(name: \"x\") {{ name }}" for index in range(3)) + " }"
+    assert "aliases" in limiter.check(parse(aliases))[0].message
+    assert "depth 5" in limiter.check(parse("{ item(name: \"a\") { owner { items { owner { name } } } } }"))[0].message
+
+    assert registry.get_sample_value("graphql_query_cost_count") == 4
+    assert registry.get_sample_value("graphql_query_rejections_total", {"reason": "cost"}) == 1
+
+
+@pytest.mark.parametrize("variables", [{"n": 1000}, {"n": 1}])
+def test_rejections_depend_on_the_variables(variables):
+    limiter = QueryCostLimiter(SCHEMA, FIELD_COSTS, max_cost=50)
+    rules = limiter.validation_rules(None, parse("query($n: Int) { search(first: $n) { owner { name } } }"), {"variables": variables})
+    assert len(rules) == (1 if variables["n"] == 1000 else 0)
+
+
+def test_fragment_cycles_are_left_to_validation():
+    query = "{ item(name: \"a\") { ...F } } fragment F on Item { owner { items { ...F } } }"
+    assert query_cost.has_fragment_cycles(query_cost._CostWalker(SCHEMA, parse(query), FIELD_COSTS, None).fragments)
+    assert analyze(query).cost == 0
+    assert not query_cost.has_fragment_cycles({})
+
+
+def test_repeated_fragments_are_walked_once():
+    levels = 40
+    fragments = ["fragment L0 on Item { name }"] + [
+        f"fragment L{level} on Item {{ tags ...L{level - 1} owner {{ items {{ ...L{level - 1} }} }} }}"
+        for level in range(1, levels + 1)
+    ]
+    query = f"{{ item(name: \"a\") {{ ...L{levels} }} }} " + " ".join(fragments)
+    started = time.perf_counter()
+    report = analyze(query)
+    assert time.perf_counter() - started < 1
+    cost, fields = 0, 1
+    for _ in range(levels):
+        cost, fields = cost + 1 + 2 + 10 * cost, 3 + 2 * fields
+    assert (report.cost, report.depth, report.fields) == (1 + cost, 2 + 2 * levels, 1 + fields)
+
+
+def test_fields_are_counted_once_fragments_are_expanded():
+    limiter = QueryCostLimiter(SCHEMA, FIELD_COSTS, max_fields=8)
+    fragments = "fragment A on Item { name tags } fragment B on Item { ...A ...A } fragment C on Item { ...B ...B }"
+    assert limiter.check(parse("{ item(name: \"a\") { ...B } } " + fragments)) == []
+    errors = limiter.check(parse("{ item(name: \"a\") { ...C } } " + fragments))
+    assert [error.extensions["fields"] for error in errors] == [9]
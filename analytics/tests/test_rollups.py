@@ -0,0 +1,299 @@
+import os
+import statistics
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+# Add the parent directory to sys.path, to get the correct app path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import rollups  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    # Each test gets its own empty database so rollup state does not leak
+    return mongomock.MongoClient()['rollups_test']
+
+
+def test_sync_rollups_is_incremental(db):
+    """
+    Tests that a sync only applies exercises inserted since the previous sync.
+    """
+    db.exercises.insert_many([
+        {"username": "alice", "exerciseType": "Running", "duration": 30, "date": datetime(2024, 1, 1, 7)},
+        {"username": "alice", "exerciseType": "Running", "duration": 20, "date": datetime(2024, 1, 1, 19)},
+        {"username": "bob", "exerciseType": "Gym", "duration": 45, "date": datetime(2024, 1, 2)}
+    ])
+    assert rollups.sync_rollups(db) == {"alice", "bob"}
+
+    db.exercises.insert_one({"username": "bob", "exerciseType": "Gym", "duration": 15, "date": datetime(2024, 1, 3)})
+    assert rollups.sync_rollups(db) == {"bob"}
+    assert rollups.sync_rollups(db) == set()
+
+    assert rollups.read_stats(db) == [
+        {"username": "alice", "exercises": [{"exerciseType": "Running", "totalDuration": 50}]},
+        {"username": "bob", "exercises": [{"exerciseType": "Gym", "totalDuration": 60}]}
+    ]
+    running_day = db[rollups.DAILY_COLLECTION].find_one({"username": "alice", "day": datetime(2024, 1, 1)})
+    assert running_day["totalDuration"] == 50
+    assert running_day["count"] == 2
+
+
+def test_sync_rollups_in_small_batches(db):
+    """
+    Tests that batching does not change the resulting totals.
+    """
+    db.exercises.insert_many([
+        {"username": "carol", "exerciseType": "Cycling", "duration": n} for n in range(1, 11)
+    ])
+    rollups.sync_rollups(db, batch_size=3)
+
+    assert rollups.read_stats(db, ["carol"]) == [
+        {"username": "carol", "exercises": [{"exerciseType": "Cycling", "totalDuration": 55}]}
+    ]
+
+
+def test_edits_and_deletes_are_synced(db):
+    """
+    Tests that saved edits are applied on the next sync and deletes on the next recheck, with
+    the old contribution subtracted, the min and max read again and emptied rows dropped.
+    """
+    saved = datetime.utcnow()
+    db.exercises.insert_many([
+        {"_id": 1, "username": "olga", "exerciseType": "Running", "duration": 10, "date": datetime(2024, 4, 1), "updatedAt": saved},
+        {"_id": 2, "username": "olga", "exerciseType": "Running", "duration": 40, "date": datetime(2024, 4, 2), "updatedAt": saved}
+    ])
+    assert rollups.sync_rollups(db) == {"olga"}
+
+    db.exercises.update_one({"_id": 2}, {"$set": {"duration": 25, "updatedAt": saved + timedelta(seconds=1)}})
+    db.exercises.update_one({"_id": 1}, {"$set": {"username": "pete", "updatedAt": saved + timedelta(seconds=1)}})
+    assert rollups.sync_rollups(db) == {"olga", "pete"}
+    assert rollups.check_consistency(db) == []
+    running = rollups.read_distributions(db, "olga")[0]["exercises"][0]
+    assert (running["count"], running["min"], running["max"]) == (1, 25, 25)
+    assert db[rollups.DAILY_COLLECTION].count_documents({"username": "olga"}) == 1
+
+    db.exercises.delete_one({"_id": 1})
+    assert rollups.sync_rollups(db) == set()
+    assert rollups.sync_rollups(db, recheck_seconds=0) == {"pete"}
+    assert rollups.check_consistency(db) == []
+    assert db[rollups.ROLLUPS_COLLECTION].count_documents({"username": "pete"}) == 0
+    assert db[rollups.DAILY_COLLECTION].count_documents({"username": "pete"}) == 0
+
+
+def test_late_commits_are_picked_up_by_the_recheck(db):
+    """
+    Tests that an exercise committed after one with a higher _id is counted once, by the
+    recheck looking back over the lag.
+    """
+    db.exercises.insert_one({"username": "quinn", "exerciseType": "Gym", "duration": 30})
+    rollups.sync_rollups(db)
+    db.exercises.insert_one({
+        "_id": ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=10)),
+        "username": "quinn", "exerciseType": "Gym", "duration": 15
+    })
+    assert rollups.sync_rollups(db) == set()
+    assert rollups.sync_rollups(db, recheck_seconds=0) == {"quinn"}
+    assert rollups.sync_rollups(db, recheck_seconds=0) == set()
+    assert rollups.read_stats(db) == [{"username": "quinn", "exercises": [{"exerciseType": "Gym", "totalDuration": 45}]}]
+
+
+def test_interrupted_sync_is_finished_without_double_counting(db):
+    """
+    Tests that a batch journaled and partly applied by a sync that died is applied once by
+    the next sync, and that no sync runs while another one holds the lease.
+    """
+    db.exercises.insert_many([
+        {"username": "rita", "exerciseType": "Yoga", "duration": duration, "date": datetime(2024, 5, day)}
+        for duration, day in [(20, 1), (30, 1), (40, 2)]
+    ])
+    steps = rollups.RollupSync().steps()
+    step = next(steps)
+    while (step.collection, step.method) != (rollups.ROLLUPS_COLLECTION, "bulk_write"):
+        step = steps.send(rollups.execute_step(db[step.collection], step))
+    # Creates the rows and applies the totals, then dies before the daily rollups and commit
+    step = steps.send(rollups.execute_step(db[step.collection], step))
+    rollups.execute_step(db[step.collection], step)
+    steps.close()
+
+    assert rollups.sync_rollups(db) == set()
+    db[rollups.STATE_COLLECTION].update_one({"_id": rollups.STATE_ID}, {"$set": {"lease_until": datetime.utcnow()}})
+    assert rollups.sync_rollups(db) == {"rita"}
+    assert rollups.check_consistency(db) == []
+    assert rollups.read_stats(db) == [{"username": "rita", "exercises": [{"exerciseType": "Yoga", "totalDuration": 90}]}]
+    first_day = db[rollups.DAILY_COLLECTION].find_one({"username": "rita", "day": datetime(2024, 5, 1)})
+    assert (first_day["totalDuration"], first_day["count"]) == (50, 2)
+    assert db[rollups.BATCHES_COLLECTION].find_one({"_id": 1})["status"] == "done"
+
+
+def test_check_consistency_and_rebuild(db):
+    """
+    Tests that drift is reported by the consistency checker and repaired by a rebuild.
+    """
+    db.exercises.insert_one({"username": "dave", "exerciseType": "Swimming", "duration": 40})
+    rollups.sync_rollups(db)
+    assert rollups.check_consistency(db) == []
+
+    # Until the next sync, the rollups drift from the exercises
+    db.exercises.delete_many({"username": "dave"})
+    db.exercises.insert_one({"username": "dave", "exerciseType": "Swimming", "duration": 10})
+    mismatches = rollups.check_consistency(db)
+    assert len(mismatches) == 1
+    assert mismatches[0]["expectedDuration"] == 10
+    assert mismatches[0]["actualDuration"] == 40
+
+    rollups.rebuild_rollups(db)
+    assert rollups.check_consistency(db) == []
+    assert rollups.read_stats(db)[0]["exercises"][0]["totalDuration"] == 10
+
+
+def test_read_period_stats_by_granularity(db):
+    """
+    Tests that daily buckets are summed per day, ISO week and month within an inclusive range.
+    """
+    db.exercises.insert_many([
+        {"username": "erin", "exerciseType": "Running", "duration": 10, "date": datetime(2024, 1, 29, 8)},
+        {"username": "erin", "exerciseType": "Running", "duration": 20, "date": datetime(2024, 1, 31, 18)},
+        {"username": "erin", "exerciseType": "Gym", "duration": 30, "date": datetime(2024, 2, 5)},
+        {"username": "erin", "exerciseType": "Gym", "duration": 99, "date": datetime(2024, 2, 6)}
+    ])
+    rollups.sync_rollups(db)
+    start, end = datetime(2024, 1, 29), datetime(2024, 2, 5)
+
+    total = rollups.read_period_stats(db, "erin", start, end)
+    assert total == [{"username": "erin", "exercises": [
+        {"exerciseType": "Gym", "totalDuration": 30},
+        {"exerciseType": "Running", "totalDuration": 30}
+    ]}]
+
+    weeks = rollups.read_period_stats(db, "erin", start, end, "week")
+    assert [week["period"] for week in weeks] == ["2024-01-29", "2024-02-05"]
+
+    months = rollups.read_period_stats(db, "erin", start, end, "month")
+    assert [(month["period"], month["exercises"][0]["totalDuration"]) for month in months] == [
+        ("2024-01-01", 30), ("2024-02-01", 30)
+    ]
+
+    days = rollups.read_period_stats(db, "erin", start, end, "day")
+    assert len(days) == 3
+
+    with pytest.raises(ValueError):
+        rollups.read_period_stats(db, "erin", start, end, "year")
+
+
+def test_read_distributions_from_the_sketches(db):
+    """
+    Tests that the distributions read from the rollups match the exact statistics, the
+    quantiles within the sketch's relative accuracy, whatever the batches they were synced in.
+    """
+    durations = [(n * 37) % 181 for n in range(1, 1001)]
+    db.exercises.insert_many([{"username": "frank", "exerciseType": "Running", "duration": d} for d in durations])
+    db.exercises.insert_one({"username": "grace", "exerciseType": "Gym", "duration": 45})
+    rollups.sync_rollups(db, batch_size=70)
+
+    running = rollups.read_distributions(db, "frank", "Running")[0]["exercises"][0]
+    ordered = sorted(durations)
+    assert running["count"] == 1000
+    assert (running["min"], running["max"]) == (ordered[0], ordered[-1])
+    assert running["mean"] == round(statistics.mean(durations), 2)
+    assert running["stddev"] == round(statistics.pstdev(durations), 2)
+    assert running["median"] == pytest.approx(statistics.median(durations), rel=0.02)
+    assert running["p90"] == pytest.approx(ordered[int(0.9 * 999)], rel=0.02)
+
+    assert rollups.read_distributions(db, exercise_type="Gym") == [{"username": "grace", "exercises": [{
+        "exerciseType": "Gym", "count": 1, "mean": 45.0, "median": 45.0, "p90": 45.0,
+        "min": 45, "max": 45, "stddev": 0.0
+    }]}]
+    assert [user["username"] for user in rollups.read_distributions(db)] == ["frank", "grace"]
+
+    # Rows written before the sketches existed keep their count and mean until a rebuild
+    db[rollups.ROLLUPS_COLLECTION].insert_one({"username": "heidi", "exerciseType": "Yoga", "totalDuration": 90, "count": 3})
+    yoga = rollups.read_distributions(db, "heidi")[0]["exercises"][0]
+    assert (yoga["count"], yoga["mean"], yoga["median"], yoga["stddev"]) == (3, 30.0, None, None)
+
+
+def test_read_leaderboard_ranks_ties_deterministically(db):
+    """
+    Tests the top-N users by duration, all time from the totals and per period from the daily
+    buckets, with equal totals sharing a rank and listed by username.
+    """
+    db.exercises.insert_many([
+        {"username": username, "exerciseType": exercise_type, "duration": duration, "date": datetime(2024, 3, day)}
+        for username, exercise_type, duration, day in [
+            ("ivan", "Running", 30, 1), ("judy", "Running", 30, 2), ("karl", "Running", 50, 3),
+            ("liam", "Running", 10, 4), ("ivan", "Running", 20, 20), ("karl", "Gym", 100, 5)
+        ]
+    ])
+    rollups.sync_rollups(db)
+
+    assert rollups.read_leaderboard(db, "Running", limit=3) == [
+        {"rank": 1, "username": "ivan", "totalDuration": 50, "count": 2},
+        {"rank": 1, "username": "karl", "totalDuration": 50, "count": 1},
+        {"rank": 3, "username": "judy", "totalDuration": 30, "count": 1}
+    ]
+    march = rollups.read_leaderboard(db, "Running", datetime(2024, 3, 1), datetime(2024, 3, 10))
+    assert [(entry["rank"], entry["username"]) for entry in march] == [(1, "karl"), (2, "ivan"), (2, "judy"), (4, "liam")]
+    overall = rollups.read_leaderboard(db, limit=2)
+    assert [(entry["username"], entry["totalDuration"]) for entry in overall] == [("karl", 150), ("ivan", 50)]
+
+    with pytest.raises(ValueError):
+        rollups.read_leaderboard(db, "Running", start_date=datetime(2024, 3, 1))
+    with pytest.raises(ValueError):
+        rollups.read_leaderboard(db, "Running", limit=rollups.MAX_LEADERBOARD_LIMIT + 1)
+
+
+def test_rollup_changes_follow_the_syncs_of_every_worker(db):
+    """
+    Tests that a process learns the usernames synced by any worker from the committed version,
+    and that it is told to drop everything when that cannot be known.
+    """
+    changes = rollups.RollupChanges()
+    assert rollups.run_steps(db, changes.steps()) == set()
+
+    db.exercises.insert_one({"username": "sam", "exerciseType": "Gym", "duration": 10})
+    rollups.sync_rollups(db)
+    db.exercises.insert_one({"username": "tina", "exerciseType": "Gym", "duration": 10})
+    rollups.sync_rollups(db)
+    assert rollups.run_steps(db, changes.steps()) == {"sam", "tina"}
+    assert rollups.run_steps(db, changes.steps()) == set()
+
+    # Finished batches expire from the journal
+    db.exercises.insert_one({"username": "sam", "exerciseType": "Gym", "duration": 5})
+    rollups.sync_rollups(db)
+    db[rollups.BATCHES_COLLECTION].delete_many({})
+    assert rollups.run_steps(db, changes.steps()) is None
+
+    rollups.rebuild_rollups(db)
+    assert rollups.run_steps(db, changes.steps()) is None
+    assert rollups.run_steps(db, changes.steps()) == set()
+
+
+def test_refresher_syncs_in_the_background(db):
+    """
+    Tests that reads only start the background sync, and sync in place with an interval of 0.
+    """
+    syncs = []
+    synced = threading.Event()
+
+    def sync():
+        syncs.append(threading.get_ident())
+        synced.set()
+
+    refresher = rollups.RollupRefresher(sync, interval=60)
+    try:
+        refresher.refresh()
+        assert synced.wait(5)
+        refresher.refresh()
+        refresher.refresh()
+        assert syncs and threading.get_ident() not in syncs and len(syncs) == 1
+    finally:
+        refresher.stop()
+
+    inline = rollups.RollupRefresher(sync, interval=0)
+    inline.refresh()
+    assert syncs[-1] == threading.get_ident()
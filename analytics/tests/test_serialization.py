@@ -0,0 +1,106 @@
+import gzip
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from bson import Decimal128, ObjectId
+
+import serialization
+from serialization import ResponseSerializer, parse_accept_encoding
+
+ROW = {
+    "_id": ObjectId("65a1b2c3d4e5f60718293a4b"),
+    "username": "alice",
+    "date": datetime(2024, 1, 2, 3, 4, 5, 678000),
+    "createdAt": datetime(2024, 1, 2, tzinfo=timezone.utc),
+    "day": date(2024, 1, 2),
+    "duration": Decimal128("12.5"),
+    "calories": Decimal("99.5"),
+    "tags": ("run", "é")
+}
+
+EXPECTED = {
+    "_id": "65a1b2c3d4e5f60718293a4b",
+    "username": "alice",
+    "date": "2024-01-02T03:04:05.678000",
+    "createdAt": "2024-01-02T00:00:00+00:00",
+    "day": "2024-01-02",
+    "duration": 12.5,
+    "calories": 99.5,
+    "tags": ["run", "é"]
+}
+
+BACKENDS = ["json"] + (["orjson"] if serialization.orjson is not None else [])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_mongo_values_are_encoded(backend):
+    serializer = ResponseSerializer(backend=backend)
+    assert json.loads(serializer.dumps({"rows": [ROW], "big": 2 ** 70})) == {"rows": [EXPECTED], "big": 2 ** 70}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unknown_values_are_rejected(backend):
+    with pytest.raises(TypeError):
+        ResponseSerializer(backend=backend).dumps({"value": object()})
+
+
+def test_backends_produce_the_same_json():
+    if serialization.orjson is None:
+        pytest.skip("orjson is not installed")
+    data = {"results": [ROW] * 3, "success": True, "errors": None, "ratio": 0.1}
+    assert ResponseSerializer(backend="orjson").dumps(data) == ResponseSerializer(backend="json").dumps(data)
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, deflate;q=0.5, br;q=0, *;q=bad") == {"gzip": 1.0, "deflate": 0.5, "br": 0.0, "*": 0.0}
+    assert parse_accept_encoding(None) == {}
+
+
+def test_negotiation_follows_q_values_then_preference():
+    serializer = ResponseSerializer(encodings=["br", "gzip"])
+    serializer.encodings = ["br", "gzip"]  # as if brotli were installed
+    assert serializer.negotiate("gzip, br") == "br"
+    assert serializer.negotiate("gzip;q=1, br;q=0.5") == "gzip"
+    assert serializer.negotiate("br;q=0, *") == "gzip"
+    assert serializer.negotiate("identity") is None
+    assert serializer.negotiate(None) is None
+
+
+def test_large_responses_are_compressed():
+    serializer = ResponseSerializer(encodings=["gzip"], min_size=100)
+    data = {"results": [EXPECTED] * 20}
+    body, headers = serializer.encode(data, "gzip, deflate")
+    assert headers == {"Content-Type": "application/json", "Vary": "Accept-Encoding", "Content-Encoding": "gzip"}
+    assert json.loads(gzip.decompress(body)) == data
+
+    body, headers = serializer.encode({"success": True}, "gzip")
+    assert "Content-Encoding" not in headers and json.loads(body) == {"success": True}
+    body, headers = ResponseSerializer(encodings=[]).encode(data, "gzip")
+    assert headers == {"Content-Type": "application/json"} and json.loads(body) == data
+
+
+def test_unavailable_backends_and_encodings(monkeypatch):
+    with pytest.raises(ValueError):
+        ResponseSerializer(backend="ujson")
+    monkeypatch.setattr(serialization, "orjson", None)
+    monkeypatch.setattr(serialization, "brotli", None)
+    with pytest.raises(ValueError):
+        ResponseSerializer(backend="orjson")
+    serializer = ResponseSerializer(encodings=serialization.parse_encodings(" BR, gzip ,"))
+    assert serializer.backend == "json" and serializer.encodings == ["gzip"]
+
+
+def test_graphql_responses_are_compressed(client, mock_mongo):
+    mock_mongo['test'].exercises.insert_many([
+        {"username": f"user{number}", "exerciseType": "Running", "duration": number, "date": datetime(2024, 1, 1)}
+        for number in range(100)
+    ])
+    query = {'query': '{ stats { success results { username exercises { exerciseType totalDuration } } } }'}
+    plain = client.post('/analytics/graphql', json=query)
+    compressed = client.post('/analytics/graphql', json=query, headers={'Accept-Encoding': 'gzip'})
+    assert plain.status_code == compressed.status_code == 200
+    assert compressed.headers['Content-Encoding'] == 'gzip' and 'Content-Encoding' not in plain.headers
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+    assert len(compressed.data) < len(plain.data)
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from slow_operations import SlowOperationRecorder, redact, summarize_plan
+
+FIND_EXPLAIN = {
+    "queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "username_day_exerciseType"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}]
+    }
+}
+
+
+class FakeClient:
+    def __init__(self):
+        self.explained = []
+
+    def __getitem__(self, database):
+        return SimpleNamespace(command=self.command)
+
+    def command(self, name, command, verbosity):
+        self.explained.append(command)
+        return FIND_EXPLAIN
+
+
+def command_event(request_id, command_name, command=None, duration_micros=250000):
+    return SimpleNamespace(
+        request_id=request_id, command_name=command_name, database_name="test", command=command or {},
+        duration_micros=duration_micros, failure={"errmsg": "failed"}
+    )
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_redact_hides_sensitive_values_and_cuts_long_strings():
+    variables = {"user": "alice", "password": "hunter2", "filter": {"apiKey": "abc", "names": ["x" * 300]}}
+    assert redact(variables) == {
+        "user": "alice", "password": "[REDACTED]", "filter": {"apiKey": "[REDACTED]", "names": ["x" * 200 + "..."]}
+    }
+
+
+def test_summarize_plan_ignores_rejected_plans():
+    assert summarize_plan(FIND_EXPLAIN) == {"stages": ["FETCH", "IXSCAN"], "indexes": ["username_day_exerciseType"], "collscan": False}
+    aggregate = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}}, {"$group": {}}]}
+    assert summarize_plan(aggregate)["collscan"] is True
+
+
+def test_slow_operations_are_recorded_with_commands_and_stacks():
+    recorder = SlowOperationRecorder(threshold_seconds=0.05, max_entries=2, sample_interval=0.005)
+    recorder.client = FakeClient()
+    data = {"operationName": "Weekly", "query": "query Weekly { weekly }", "variables": {"token": "t", "user": "u"}}
+
+    with recorder.track(data):
+        command = {"find": "exercise_daily_rollups", "filter": {"username": "u"}, "$db": "test", "lsid": {}}
+        recorder.started(command_event(1, "find", command))
+        recorder.started(command_event(2, "insert", {"insert": "rollup_state"}))
+        time.sleep(0.1)
+        recorder.succeeded(command_event(1, "find"))
+        recorder.failed(command_event(2, "insert"))
+
+    entry = recorder.entries()[0]
+    assert entry["operation"] == "Weekly" and entry["durationMs"] >= 50
+    assert entry["variables"] == {"token": "[REDACTED]", "user": "u"}
+    assert entry["profile"]["samples"] > 0
+    assert any("test_slow_operations.py" in stack["stack"] for stack in entry["profile"]["stacks"])
+    wait_for(lambda: "explain" in recorder.entries()[0]["commands"][0])
+    find, insert = recorder.entries()[0]["commands"]
+    assert find["collection"] == "exercise_daily_rollups" and find["durationMs"] == 250.0
+    assert find["body"] == {"filter": {"username": "u"}}
+    assert find["explain"]["indexes"] == ["username_day_exerciseType"]
+    assert recorder.client.explained == [{"find": "exercise_daily_rollups", "filter": {"username": "u"}}]
+    assert "explain" not in insert and "failure" in insert
+    json.loads(json.dumps(recorder.entries()))
+
+
+def test_fast_operations_and_other_threads_are_not_recorded():
+    recorder = SlowOperationRecorder(threshold_seconds=10)
+    with recorder.track({"query": "{ stats }"}):
+        pass
+    assert recorder.entries() == []
+
+    recorder = SlowOperationRecorder(threshold_seconds=0, max_entries=2)
+    with recorder.track({"query": "{ stats }"}):
+        thread = threading.Thread(target=recorder.started, args=(command_event(1, "find", {"find": "other"}),))
+        thread.start()
+        thread.join()
+    assert recorder.entries()[0]["commands"] == []
+    for _ in range(3):
+        with recorder.track({"query": "{ stats }"}):
+            pass
+    assert len(recorder.entries()) == 2
+
+
+def test_disabled_recorder_does_not_track():
+    recorder = SlowOperationRecorder()
+    with recorder.track({"query": "{ stats }"}):
+        recorder.started(command_event(1, "find", {"find": "exercises"}))
+    assert not recorder.enabled and recorder.entries() == []
+
+
+def test_admin_endpoint(client, monkeypatch):
+    import app
+
+    assert client.get('/analytics/admin/slow-operations').status_code == 404
+    monkeypatch.setattr(app.slow_operation_recorder, "threshold_seconds", 0)
+    monkeypatch.setattr(app, "admin_token", "secret")
+    app.slow_operation_recorder.clear()
+
+    response = client.post('/analytics/graphql', json={'query': 'query Slow { stats { success } }'})
+    assert response.status_code == 200
+    assert client.get('/analytics/admin/slow-operations').status_code == 401
+    response = client.get('/analytics/admin/slow-operations?limit=1', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert [entry['operation'] for entry in response.get_json()] == ["Slow"]
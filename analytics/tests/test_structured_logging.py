@@ -0,0 +1,118 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import structured_logging
+from structured_logging import AsyncQueueHandler, JsonFormatter, SamplingFilter, Summary, parse_sampling, summarize
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def record(name="app", level=logging.INFO, msg="message", args=(), **extra):
+    log_record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    log_record.__dict__.update(extra)
+    return log_record
+
+
+def test_summaries_keep_counts_instead_of_bodies():
+    payload = {
+        "success": True,
+        "errors": None,
+        "results": [{"recipeName": "Soup"}] * 50,
+        "pageInfo": {"endCursor": "x" * 300, "nested": {"deep": 1}},
+        "recipe": object()
+    }
+    assert summarize(payload) == {
+        "success": True,
+        "errors": None,
+        "results": {"count": 50},
+        "pageInfo": {"endCursor": "x" * 100 + "...", "nested": {"keys": 1}},
+        "recipe": "object"
+    }
+    assert summarize({f"key{number}": number for number in range(25)})["..."] == 5
+
+
+def test_messages_and_summaries_are_only_formatted_when_written():
+    class Payload(dict):
+        formatted = 0
+
+        def items(self):
+            Payload.formatted += 1
+            return super().items()
+
+    log_queue = queue.Queue()
+    handler = AsyncQueueHandler(log_queue)
+    logger = logging.getLogger("tests.lazy")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        logger.info("Payload: %s", Summary(Payload(success=True)))
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+    queued = log_queue.get_nowait()
+    assert Payload.formatted == 0 and queued.args
+    assert json.loads(JsonFormatter().format(queued))["message"] == 'Payload: {"success": true}'
+    assert Payload.formatted == 1
+
+
+def test_json_formatter_writes_extra_fields():
+    entry = json.loads(JsonFormatter().format(record(msg="Stats for %s", args=("alice",), results=3, payload=Summary([1, 2]))))
+    assert entry["message"] == "Stats for alice" and entry["logger"] == "app" and entry["level"] == "INFO"
+    assert entry["results"] == 3 and entry["payload"] == {"count": 2}
+    assert "args" not in entry and "time" in entry
+
+
+def test_sampling_applies_per_logger_and_spares_warnings():
+    samples = iter([0.5, 0.05, 0.5])
+    sampling = SamplingFilter({"app": 0.1, "app.quiet": 0.0}, sample=lambda: next(samples))
+    assert sampling.filter(record("app")) is False
+    assert sampling.filter(record("app.child")) is True
+    assert sampling.filter(record("app.quiet")) is False
+    assert sampling.filter(record("app.quiet", logging.WARNING)) is True
+    assert sampling.filter(record("werkzeug")) is True
+    assert parse_sampling("app=0.1, werkzeug = 2,,bad") == {"app": 0.1, "werkzeug": 1.0}
+
+
+def test_full_queue_drops_records():
+    handler = AsyncQueueHandler(queue.Queue(1))
+    handler.handle(record())
+    handler.handle(record())
+    assert handler.dropped_count == 1
+
+
+def test_configure_logging_writes_from_a_listener_thread(root_logger):
+    stream = io.StringIO()
+    async_logging = structured_logging.configure_logging(fmt="json", sampling={"sampled": 0.0}, stream=stream)
+    logging.getLogger("tests.configured").info("Hello %s", "world", extra={"user": "alice"})
+    logging.getLogger("sampled").info("dropped")
+    logging.getLogger("sampled").error("kept")
+    async_logging.stop()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line["logger"], line["message"]) for line in lines] == [("tests.configured", "Hello world"), ("sampled", "kept")]
+    assert lines[0]["user"] == "alice"
+
+    async_logging.restart()
+    logging.getLogger("tests.configured").warning("after fork")
+    async_logging.stop()
+    assert stream.getvalue().splitlines()[-1].endswith('"message": "after fork"}')
+
+    structured_logging.configure_logging(fmt="text", asynchronous=False, stream=stream)
+    logging.getLogger("tests.configured").info("plain")
+    assert stream.getvalue().endswith("INFO tests.configured: plain\n")
+    with pytest.raises(ValueError):
+        structured_logging.configure_logging(fmt="xml")
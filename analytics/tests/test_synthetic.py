@@ -0,0 +1,31 @@
+from collections import Counter
+from datetime import datetime
+
+import mongomock
+
+from benchmarks import synthetic
+
+
+def test_generate_exercises_is_deterministic_and_valid():
+    start = datetime(2024, 1, 1)
+    exercises = list(synthetic.generate_exercises(500, users=20, start=start, days=30, seed=7))
+    assert exercises == list(synthetic.generate_exercises(500, users=20, start=start, days=30, seed=7))
+    for exercise in exercises:
+        assert exercise["exerciseType"] in synthetic.EXERCISE_TYPES
+        assert isinstance(exercise["duration"], int) and exercise["duration"] >= 1
+        assert start <= exercise["date"] < datetime(2024, 1, 31)
+
+
+def test_skew_concentrates_activity_on_first_users():
+    def share_of_top_user(skew):
+        users = Counter(exercise["username"] for exercise in synthetic.generate_exercises(2000, users=50, skew=skew))
+        return users[synthetic.username(0)] / 2000
+
+    assert share_of_top_user(1.5) > 3 * share_of_top_user(0)
+
+
+def test_load_exercises_inserts_in_batches():
+    collection = mongomock.MongoClient()['synthetic_test'].exercises
+    inserted = synthetic.load_exercises(collection, synthetic.generate_exercises(25), batch_size=10)
+    assert inserted == 25
+    assert collection.count_documents({}) == 25
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import rollups
+import trends
+from benchmarks import synthetic
+
+needs_numpy = pytest.mark.skipif(not trends.NUMPY_AVAILABLE, reason="numpy is not installed")
+
+
+@pytest.fixture(scope="module")
+def db():
+    db = mongomock.MongoClient()['trends_test']
+    synthetic.load_exercises(db.exercises, synthetic.generate_exercises(2000, users=4, start=datetime(2024, 1, 1), days=90))
+    rollups.rebuild_rollups(db)
+    return db
+
+
+@needs_numpy
+@pytest.mark.parametrize("username", [synthetic.username(0), None])
+def test_engines_and_sources_agree(db, username):
+    start, end = datetime(2024, 1, 10), datetime(2024, 3, 20)
+    results = [
+        trends.compute_trends(db, username, start, end, 7, source, engine)
+        for source in trends.SOURCES for engine in trends.ENGINES
+    ]
+    assert all(result == results[0] for result in results[1:])
+    assert results[0]["count"] > 0
+
+
+@pytest.mark.parametrize("engine", [pytest.param("numpy", marks=needs_numpy), "python"])
+def test_rolling_average_and_streaks(engine):
+    rows = [
+        {"day": datetime(2024, 5, day), "exerciseType": "Running", "totalDuration": duration, "count": 1}
+        for day, duration in ((1, 10), (2, 20), (3, 30), (5, 40), (6, 50), (7, 60), (8, 70))
+    ]
+    result = trends.trends_from_rows(rows, "user", datetime(2024, 5, 1), datetime(2024, 5, 8), window=3, engine=engine)
+    assert [point["value"] for point in result["rollingAverage"]] == [10.0, 15.0, 20.0, 16.67, 23.33, 30.0, 50.0, 60.0]
+    assert (result["longestStreak"], result["currentStreak"]) == (4, 4)
+    assert [week["period"] for week in result["weekly"]] == ["2024-04-29", "2024-05-06"]
+    assert [week["totalDuration"] for week in result["weekly"]] == [100, 180]
+
+
+def test_invalid_arguments_are_rejected():
+    with pytest.raises(ValueError):
+        trends.trends_from_rows([], None, datetime(2024, 1, 2), datetime(2024, 1, 1), engine="python")
+    with pytest.raises(ValueError):
+        trends.trends_from_rows([], None, datetime(2024, 1, 1), datetime(2024, 1, 2), window=0, engine="python")
+    with pytest.raises(ValueError):
+        trends.trends_from_rows([], None, datetime(2024, 1, 1), datetime(2024, 1, 2), engine="pandas")
+
+
+# numpy is only imported by the first numpy computation, not with the service
+def test_numpy_is_imported_on_first_use():
+    code = "import sys, trends; print('numpy' in sys.modules, trends.default_engine())"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "numpy" if trends.NUMPY_AVAILABLE else "python"]
@@ -0,0 +1,276 @@
+import importlib.util
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import rollups
+
+# numpy is an optional dependency, see the 'engine' poetry group; it is imported by the first
+# numpy computation rather than with the service, since it adds about 100 ms to the start up
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+# Long-range trends of a user (or all users) between two dates: totals, per-type sums,
+# a weekly histogram, a trailing rolling average of daily minutes and activity streaks
+#
+# The numpy engine works on columnar arrays (day, exerciseType, duration, count) and is used
+# when NumPy is installed; the python engine loops over per (day, exerciseType) rows. Both
+# return the same result, from the daily rollups or from the raw exercises.
+
+EPOCH = datetime(1970, 1, 1)
+ENGINES = ("numpy", "python")
+SOURCES = ("rollups", "exercises")
+MAX_WINDOW = 365
+MAX_DAYS = 3660
+
+DAILY_PROJECTION = {"_id": 0, "day": 1, "exerciseType": 1, "totalDuration": 1, "count": 1}
+
+
+def default_engine():
+    return "numpy" if NUMPY_AVAILABLE else "python"
+
+
+def load_numpy():
+    global np
+    if np is None:
+        np = importlib.import_module("numpy")
+    return np
+
+
+def day_number(date):
+    return (rollups.day_bucket(date) - EPOCH).days
+
+
+def day_label(number):
+    return (EPOCH + timedelta(days=int(number))).strftime("%Y-%m-%d")
+
+
+# Day number of the Monday starting the week of a day number (1970-01-01 was a Thursday)
+def week_start(number):
+    return number - (number + 3) % 7
+
+
+def check_window(window):
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"'window' must be between 1 and {MAX_WINDOW}")
+
+
+def _user_filter(username):
+    return {} if username is None else {"username": username}
+
+
+# Per (day, exerciseType) rows from the daily rollups; O(days in range)
+def rollup_rows(db, username, start_date, end_date):
+    return db[rollups.DAILY_COLLECTION].find(rollup_query(username, start_date, end_date), DAILY_PROJECTION)
+
+
+def rollup_query(username, start_date, end_date):
+    return dict(_user_filter(username), day={"$gte": rollups.day_bucket(start_date), "$lte": rollups.day_bucket(end_date)})
+
+
+def exercise_pipeline(username, start_date, end_date):
+    end = rollups.day_bucket(end_date) + timedelta(days=1)
+    return [
+        {"$match": dict(_user_filter(username), date={"$gte": rollups.day_bucket(start_date), "$lt": end})},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+                "exerciseType": "$exerciseType"
+            },
+            "totalDuration": {"$sum": "$duration"},
+            "count": {"$sum": 1}
+        }}
+    ]
+
+
+# The same rows aggregated from the raw exercises; O(exercises in range)
+def exercise_rows(db, username, start_date, end_date):
+    return shape_pipeline_rows(db.exercises.aggregate(exercise_pipeline(username, start_date, end_date)))
+
+
+def shape_pipeline_rows(rows):
+    for row in rows:
+        yield {
+            "day": datetime.strptime(row["_id"]["day"], "%Y-%m-%d"),
+            "exerciseType": row["_id"]["exerciseType"],
+            "totalDuration": row["totalDuration"],
+            "count": row["count"]
+        }
+
+
+def build_trends(username, first_day, last_day, window, totals):
+    daily_durations, daily_counts, type_totals, weekly = totals
+    longest, current = streaks(daily_counts)
+    return {
+        "username": username,
+        "start": day_label(first_day),
+        "end": day_label(last_day),
+        "window": window,
+        "totalDuration": int(sum(daily_durations)),
+        "count": int(sum(daily_counts)),
+        "exercises": [
+            {"exerciseType": exercise_type, "totalDuration": int(total)}
+            for exercise_type, total in sorted(type_totals.items())
+        ],
+        "weekly": weekly,
+        "rollingAverage": rolling_average(daily_durations, first_day, window),
+        "longestStreak": longest,
+        "currentStreak": current
+    }
+
+
+# Python engine -------------------------------------------------------------------------
+
+def _python_totals(rows, first_day, last_day):
+    days = last_day - first_day + 1
+    first_week = week_start(first_day)
+    daily_durations = [0] * days
+    daily_counts = [0] * days
+    type_totals = defaultdict(int)
+    weeks = defaultdict(lambda: [0, 0])
+    for row in rows:
+        offset = day_number(row["day"]) - first_day
+        if not 0 <= offset < days:
+            continue
+        duration, count = row.get("totalDuration", 0), row.get("count", 0)
+        daily_durations[offset] += duration
+        daily_counts[offset] += count
+        type_totals[row["exerciseType"]] += duration
+        week = weeks[(offset + first_day - first_week) // 7]
+        week[0] += duration
+        week[1] += count
+    weekly = [
+        {"period": day_label(first_week + 7 * index), "totalDuration": weeks[index][0], "count": weeks[index][1]}
+        for index in range((last_day - first_week) // 7 + 1)
+    ]
+    return daily_durations, daily_counts, type_totals, weekly
+
+
+# Numpy engine --------------------------------------------------------------------------
+
+# Columns: day numbers, exercise types, durations and exercise counts as parallel arrays
+def rows_to_columns(rows):
+    rows = list(rows)
+    return {
+        "day": np.fromiter((day_number(row["day"]) for row in rows), dtype=np.int64, count=len(rows)),
+        "exerciseType": np.array([str(row["exerciseType"]) for row in rows], dtype=str),
+        "duration": np.fromiter((row.get("totalDuration", 0) for row in rows), dtype=np.int64, count=len(rows)),
+        "count": np.fromiter((row.get("count", 0) for row in rows), dtype=np.int64, count=len(rows))
+    }
+
+
+# Loads the raw exercises in range straight into columns, one row per exercise
+def exercise_columns(db, username, start_date, end_date):
+    end = rollups.day_bucket(end_date) + timedelta(days=1)
+    query = dict(_user_filter(username), date={"$gte": rollups.day_bucket(start_date), "$lt": end})
+    dates, types, durations = [], [], []
+    for exercise in db.exercises.find(query, {"_id": 0, "date": 1, "exerciseType": 1, "duration": 1}).batch_size(10000):
+        dates.append(exercise["date"])
+        types.append(str(exercise["exerciseType"]))
+        durations.append(exercise.get("duration", 0))
+    days = np.array(dates, dtype="datetime64[ms]").astype("datetime64[D]").astype(np.int64)
+    return {
+        "day": days,
+        "exerciseType": np.array(types, dtype=str),
+        "duration": np.array(durations, dtype=np.int64),
+        "count": np.ones(len(days), dtype=np.int64)
+    }
+
+
+def _numpy_totals(columns, first_day, last_day):
+    days = last_day - first_day + 1
+    first_week = week_start(first_day)
+    offsets = columns["day"] - first_day
+    in_range = (offsets >= 0) & (offsets < days)
+    offsets = offsets[in_range]
+    durations, counts = columns["duration"][in_range], columns["count"][in_range]
+    types, type_codes = np.unique(columns["exerciseType"][in_range], return_inverse=True)
+
+    daily_durations = np.bincount(offsets, weights=durations, minlength=days).astype(np.int64)
+    daily_counts = np.bincount(offsets, weights=counts, minlength=days).astype(np.int64)
+    type_sums = np.bincount(type_codes.ravel(), weights=durations, minlength=len(types)).astype(np.int64)
+    type_totals = {str(exercise_type): int(total) for exercise_type, total in zip(types, type_sums)}
+    weeks = (last_day - first_week) // 7 + 1
+    week_index = (offsets + first_day - first_week) // 7
+    week_durations = np.bincount(week_index, weights=durations, minlength=weeks).astype(np.int64)
+    week_counts = np.bincount(week_index, weights=counts, minlength=weeks).astype(np.int64)
+    weekly = [
+        {"period": day_label(first_week + 7 * index), "totalDuration": int(week_durations[index]), "count": int(week_counts[index])}
+        for index in range(weeks)
+    ]
+    return daily_durations, daily_counts, type_totals, weekly
+
+
+# Trailing mean of the daily minutes over window days; the first days average the days
+# available since the start of the range
+def rolling_average(daily_durations, first_day, window):
+    if np is not None and isinstance(daily_durations, np.ndarray):
+        cumulative = np.concatenate(([0], np.cumsum(daily_durations)))
+        ends = np.arange(1, len(daily_durations) + 1)
+        starts = np.maximum(ends - window, 0)
+        averages = [round(float(value), 2) for value in (cumulative[ends] - cumulative[starts]) / (ends - starts)]
+    else:
+        averages = []
+        running = 0
+        for index, duration in enumerate(daily_durations):
+            running += duration
+            if index >= window:
+                running -= daily_durations[index - window]
+            averages.append(round(running / min(index + 1, window), 2))
+    return [{"day": day_label(first_day + index), "value": value} for index, value in enumerate(averages)]
+
+
+# Longest run of consecutive active days, and the run ending on the last day of the range
+def streaks(daily_counts):
+    if np is not None and isinstance(daily_counts, np.ndarray):
+        active = np.concatenate(([0], (daily_counts > 0).astype(np.int8), [0]))
+        edges = np.diff(active)
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        longest = int(runs.max()) if runs.size else 0
+        current = int(runs[-1]) if runs.size and active[-2] else 0
+        return longest, current
+    longest = current = 0
+    for count in daily_counts:
+        current = current + 1 if count > 0 else 0
+        longest = max(longest, current)
+    return longest, current
+
+
+def _check_range(start_date, end_date, window, engine):
+    check_window(window)
+    if engine not in ENGINES or (engine == "numpy" and not NUMPY_AVAILABLE):
+        raise ValueError(f"Unsupported engine: {engine}")
+    if engine == "numpy":
+        load_numpy()
+    first_day, last_day = day_number(start_date), day_number(end_date)
+    if not 0 <= last_day - first_day < MAX_DAYS:
+        raise ValueError(f"'end' must be on or after 'start' and at most {MAX_DAYS} days later")
+    return first_day, last_day
+
+
+# Computes the trends from per (day, exerciseType) rows, e.g. the daily rollups
+def trends_from_rows(rows, username, start_date, end_date, window=7, engine=None):
+    engine = engine or default_engine()
+    first_day, last_day = _check_range(start_date, end_date, window, engine)
+    if engine == "numpy":
+        totals = _numpy_totals(rows_to_columns(rows), first_day, last_day)
+    else:
+        totals = _python_totals(rows, first_day, last_day)
+    return build_trends(username, first_day, last_day, window, totals)
+
+
+# Trends of a user, or of all users when username is None, between two dates (inclusive)
+# source "rollups" reads the daily rollups; "exercises" reads the raw exercises, aggregated
+# by a Mongo pipeline for the python engine or loaded as columns for the numpy engine
+def compute_trends(db, username, start_date, end_date, window=7, source="rollups", engine=None):
+    if source not in SOURCES:
+        raise ValueError(f"Unsupported source: {source}")
+    engine = engine or default_engine()
+    if source == "rollups":
+        rows = rollup_rows(db, username, start_date, end_date)
+        return trends_from_rows(rows, username, start_date, end_date, window, engine)
+    first_day, last_day = _check_range(start_date, end_date, window, engine)
+    if engine == "numpy":
+        totals = _numpy_totals(exercise_columns(db, username, start_date, end_date), first_day, last_day)
+    else:
+        totals = _python_totals(exercise_rows(db, username, start_date, end_date), first_day, last_day)
+    return build_trends(username, first_day, last_day, window, totals)
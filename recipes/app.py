@@ -1,17 +1,30 @@
+import functools
 import os
 import logging
-from ariadne import MutationType, QueryType, graphql_sync, load_schema_from_path, make_executable_schema
+import time
+import click
+from ariadne import MutationType, ObjectType, QueryType, graphql_sync, load_schema_from_path, make_executable_schema
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, render_template, session, redirect, url_for
+from flask import Flask, Response, jsonify, request, render_template, session, redirect, url_for
 # from flask_cors import CORS
 from pymongo import MongoClient
 from prometheus_flask_exporter import PrometheusMetrics
 from flask_babel import Babel, _
-import requests
+import bulk
+import nutrition
+import pagination
+import recipe_versions
+import search
+import serialization
+import structured_logging
+import indexes
+import mongo_client
+from spoonacular import SpoonacularClient, SpoonacularError, normalize_search
+from graphql_cache import DocumentCache, PersistedQueryError, PersistedQueryRegistry
+from instrumentation import MongoCommandMetrics, MongoPoolMetrics, ResolverMetrics
+from query_cost import FieldCost, QueryCostLimiter
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -48,10 +61,34 @@ load_dotenv()
 mongo_uri = os.getenv('MONGO_URI')
 mongo_db = os.getenv('MONGO_DB')
 
+# Structured, sampled logging written off the request threads, see structured_logging.py
+# LOG_FORMAT is json (default) or text; LOG_SAMPLING keeps a fraction of the INFO records of
+# chosen loggers, e.g. "app=0.1,werkzeug=0.01"; LOG_ASYNC=false writes from the request thread
+async_logging = structured_logging.configure_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    sampling=structured_logging.parse_sampling(os.getenv('LOG_SAMPLING')),
+    asynchronous=os.getenv('LOG_ASYNC', 'true').lower() == 'true',
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+    registry=metrics.registry
+)
+
 # get spoonacular api env var values
 spoonacular_api_url = os.getenv('SPOONACULAR_API_URL')
 spoonacular_api_key = os.getenv('SPOONACULAR_API_KEY')
 
+# Spoonacular searches are cached and coalesced, see spoonacular.py
+recipe_search = SpoonacularClient(
+    spoonacular_api_url,
+    spoonacular_api_key,
+    retries=int(os.getenv('SPOONACULAR_RETRIES', '2')),
+    timeout=float(os.getenv('SPOONACULAR_TIMEOUT_SECONDS', '10')),
+    ttl=float(os.getenv('SPOONACULAR_CACHE_TTL_SECONDS', '600')),
+    stale_ttl=float(os.getenv('SPOONACULAR_STALE_SECONDS', '3600')),
+    max_entries=int(os.getenv('SPOONACULAR_CACHE_MAX_ENTRIES', '256')),
+    registry=metrics.registry
+)
+
 # config for flask-babel
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')  # to store session data
 app.config['BABEL_DEFAULT_LOCALE'] = 'en'  # default language
@@ -59,53 +96,205 @@ app.config['BABEL_SUPPORTED_LOCALES'] = ['en', 'es']  # supported languages
 
 babel = Babel(app)
 
-client = MongoClient(mongo_uri)
-db = client[mongo_db]
+# Resolver and MongoDB command timings on /metrics, see instrumentation.py
+resolver_metrics = ResolverMetrics(metrics.registry)
+mongo_command_metrics = MongoCommandMetrics(metrics.registry)
+mongo_pool_metrics = MongoPoolMetrics(metrics.registry)
+
+# Encoding and compression of the GraphQL responses, see serialization.py
+# JSON_SERIALIZER is auto (orjson when installed), orjson or json; RESPONSE_COMPRESSION lists
+# the encodings offered to clients, in order of preference
+response_serializer = serialization.ResponseSerializer(
+    backend=os.getenv('JSON_SERIALIZER', 'auto'),
+    encodings=serialization.parse_encodings(os.getenv('RESPONSE_COMPRESSION', 'br,gzip')),
+    min_size=int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+)
+
+# MongoDB client created on first use in each process, so gunicorn workers never share the
+# master's connections, see mongo_client.py; MONGO_MAX_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS
+# and the other MONGO_* pool and timeout settings are passed to the driver
+mongo_settings = mongo_client.settings_from_env()
+client = mongo_client.ManagedClient(
+    mongo_uri, factory=MongoClient, event_listeners=[mongo_command_metrics, mongo_pool_metrics], **mongo_settings
+)
+db = client.database(mongo_db)
 
 metrics.info('app_info', 'Application info', version='1.0.3')
 
+# Create the indexes the hot-path queries rely on; a failure is logged rather than fatal so the
+# service still starts when the database is briefly unavailable
+if os.getenv('ENSURE_INDEXES', 'true').lower() == 'true':
+    try:
+        indexes.ensure_indexes(db)
+    except Exception as error:
+        logger.warning(f"Could not ensure indexes: {error}")
+
 # Initialize the query type
 query = QueryType()
 mutation = MutationType()
+recipes_result = ObjectType("RecipesResult")
+
+# In-process full-text index behind searchRecipes, rebuilt from the collection when another
+# worker wrote recipes (see recipe_versions.py), and every SEARCH_INDEX_REFRESH_SECONDS for
+# recipes written outside the service
+search_index = search.RecipeSearchIndex(refresh_seconds=float(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '300')))
+
+# In-process calorie and nutrient index behind range filters and topRecipesByNutrient
+nutrition_index = nutrition.NutritionIndex(refresh_seconds=float(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '300')))
+
+
+# Keeps the in-process indexes in line with a recipe written by this process
+def index_recipe(recipe):
+    search_index.add(recipe)
+    nutrition_index.add(recipe)
+
+
+def unindex_recipe(recipe_name):
+    search_index.remove(recipe_name)
+    nutrition_index.remove(recipe_name)
+
+
+# States of the in-process indexes before a write, passed to recipes_written after it
+def index_states():
+    return search_index.state(), nutrition_index.state()
+
+
+# Moves the in-process indexes to the recipes version bumped by a write of this process
+def recipes_written(states, version):
+    search_index.advance(states[0], version)
+    nutrition_index.advance(states[1], version)
+
+
+# Bumps the shared recipes version after a write, so the other workers rebuild their indexes
+def bump_recipes_version(states):
+    recipes_written(states, recipe_versions.bump_version(db))
+
+
+# Calorie and nutrient ranges are answered by the nutrition index, except next to a
+# recipeName filter which the unique recipeName index already narrows down to one recipe
+def uses_nutrition_index(recipe_filter):
+    return nutrition.has_range_filter(recipe_filter) and not recipe_filter.get("recipeName")
+
+
+# Builds the RecipesResult payload for one page of recipes read with a limit of limit + 1, or
+# for every recipe when limit is None
+def build_recipes_page(recipes, limit, recipe_query):
+    recipes_list = []
+    edges = []
+    for recipe in recipes:
+        node = {
+            "recipeName": recipe.get("recipeName"),
+            "ingredients": recipe.get("ingredients"),
+            "calories": recipe.get("calories"),
+            "nutrients": recipe.get("nutrients")
+        }
+        recipes_list.append(node)
+        edges.append({"cursor": pagination.encode_cursor(recipe["_id"]), "node": node})
+    has_next_page = limit is not None and len(edges) > limit
+    recipes_list = recipes_list[:limit]
+    edges = edges[:limit]
+    logger.info("Recipes page built", extra={"results": len(recipes_list), "hasNextPage": has_next_page})
+    return {
+        "success": True,
+        "results": recipes_list,
+        "edges": edges,
+        "pageInfo": {
+            "hasNextPage": has_next_page,
+            "endCursor": edges[-1]["cursor"] if edges else None
+        },
+        # totalCount is only counted when the field is requested, see resolve_total_count
+        "query": recipe_query
+    }
 
 
 # Define GraphQL resolver before making the schema
-# query to retrieve recipes created by the user
+# query to retrieve recipes created by the user, one page at a time
+# Pages are ordered by _id; 'after' is the endCursor of the previous page
+# Only the Recipe fields present in the selection set are fetched from Mongo
 @query.field("recipes")
-def resolve_recipes(_, info):
+def resolve_recipes(_, info, first=None, after=None, filter=None):
     try:
         logger.info("Resolver called")
-        # Fetch recipes from the database
-        recipes_cursor = db.recipes.find()
-        recipes_list = []
-        for recipe in recipes_cursor:
-            logger.info(f"Found recipe: {recipe}")
-            recipes_list.append({
-                "recipeName": recipe.get("recipeName"),
-                "ingredients": recipe.get("ingredients"),
-                "calories": recipe.get("calories"),
-                "nutrients": recipe.get("nutrients")
-            })
-        logger.info("Number of recipes found:", len(recipes_list))
-        payload = {
-            "success": True,
-            "results": recipes_list
-        }
-        logger.info("Resolver Payload:", payload)
+        limit = pagination.page_size(first)
+        recipe_query = pagination.build_recipe_query(filter)
+
+        if uses_nutrition_index(filter):
+            nutrition_index.ensure_built(db.recipes, recipe_versions.current_version(db))
+            matches = nutrition_index.match(filter)
+            after_id = pagination.decode_cursor(after) if after else None
+            # Fetch one extra recipe to know whether there is a next page
+            recipes_cursor = db.recipes.find(
+                pagination.ids_query(nutrition.page_ids(matches, after_id, pagination.fetch_size(limit))), pagination.recipe_projection(info)
+            ).sort("_id", 1)
+            payload = build_recipes_page(recipes_cursor, limit, recipe_query)
+            payload["matchCount"] = len(matches)
+        else:
+            # Fetch one extra recipe to know whether there is a next page
+            recipes_cursor = db.recipes.find(
+                pagination.page_query(recipe_query, after), pagination.recipe_projection(info)
+            ).sort("_id", 1).limit(pagination.fetch_size(limit))
+            payload = build_recipes_page(recipes_cursor, limit, recipe_query)
+        logger.info("Resolver payload: %s", structured_logging.Summary(payload))
     except Exception as error:
         logger.error(f"Error: {error}")
         payload = {
             "success": False,
+            "errors": [str(error)],
             "results": []
         }
     return payload
 
 
+# totalCount counts the whole filtered collection, so it only runs when a client asks for it
+@recipes_result.field("totalCount")
+def resolve_total_count(result, info):
+    if "matchCount" in result:
+        return result["matchCount"]
+    if "query" not in result:
+        return None
+    return db.recipes.count_documents(result["query"])
+
+
+# recipes with the highest amount of a nutrient, optionally within the ranges of a filter
+@query.field("topRecipesByNutrient")
+def resolve_top_recipes_by_nutrient(_, info, nutrient, first=None, filter=None):
+    try:
+        limit = pagination.page_size(pagination.DEFAULT_PAGE_SIZE if first is None else first)
+        nutrition_index.ensure_built(db.recipes, recipe_versions.current_version(db))
+        ids = nutrition_index.top(nutrient, limit, filter)
+        recipes = db.recipes.find(pagination.ids_query(ids), pagination.recipe_projection(info))
+        rank = {object_id: position for position, object_id in enumerate(ids)}
+        payload = build_recipes_page(sorted(recipes, key=lambda recipe: rank[recipe["_id"]]), limit, None)
+        payload.pop("query")
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        payload = {"success": False, "errors": [str(error)], "results": []}
+    return payload
+
+
+# ranked search over recipe names and ingredients, served from the in-process index
+# With includeExternal, a search without local results falls through to Spoonacular
+@query.field("searchRecipes")
+def resolve_search_recipes(_, info, query, first=None, includeExternal=False):
+    try:
+        limit = pagination.page_size(first or search.DEFAULT_RESULTS)
+        search_index.ensure_built(db.recipes, recipe_versions.current_version(db))
+        payload = search.build_search_payload(search_index.search(query, limit))
+        if not payload["results"] and includeExternal:
+            payload["source"] = "spoonacular"
+            payload["external"] = get_recipe_collection(query, limit).get("results", [])
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        payload = {"success": False, "errors": [str(error)], "results": []}
+    return payload
+
+
 # mutation so a user can add their own recipe
 @mutation.field("addRecipe")
 def add_recipe(_, info, recipe):
     try:
         logger.info("Add recipe mutation called")
+        states = index_states()
         # Insert the recipe into the database
         db.recipes.insert_one(recipe)
 
@@ -113,13 +302,15 @@ def add_recipe(_, info, recipe):
         dbRecipe = db.recipes.find_one({"recipeName": recipe["recipeName"]})
         if dbRecipe is None:
             raise Exception("Failed to add the recipe")
+        index_recipe(dbRecipe)
+        bump_recipes_version(states)
 
         payload = {
             "success": True,
             "message": "Recipe added successfully",
             "recipe": dbRecipe
         }
-        logger.info("Resolver Payload:", payload)
+        logger.info("Resolver payload: %s", structured_logging.Summary(payload))
     except Exception as error:
         logger.error(f"Error: {error}")
         payload = {
@@ -134,20 +325,24 @@ def add_recipe(_, info, recipe):
 def remove_recipe(_, info, recipe):
     try:
         logger.info("Add recipe mutation called")
+        states = index_states()
         # Insert the recipe into the database
-        db.recipes.delete_one(recipe)
+        deleted = db.recipes.delete_one(recipe).deleted_count
 
         # Fetch the recipe from the database
         dbRecipe = db.recipes.find_one({"recipeName": recipe["recipeName"]})
         if dbRecipe is not None:
             raise Exception("Failed to remove the recipe")
+        unindex_recipe(recipe["recipeName"])
+        if deleted:
+            bump_recipes_version(states)
 
         payload = {
             "success": True,
             "message": "Recipe removed successfully",
             "recipe": recipe
         }
-        logger.info("Resolver Payload:", payload)
+        logger.info("Resolver payload: %s", structured_logging.Summary(payload))
     except Exception as error:
         logger.error(f"Error: {error}")
         payload = {
@@ -157,12 +352,92 @@ def remove_recipe(_, info, recipe):
     return payload
 
 
+# Chunk size of the bulk writes issued by addRecipes, removeRecipes and import-recipes
+bulk_chunk_size = int(os.getenv('BULK_WRITE_CHUNK_SIZE', str(bulk.DEFAULT_CHUNK_SIZE)))
+
+
+# mutation adding many recipes with unordered batched inserts
+# Each recipe gets its own result, e.g. a duplicate recipeName does not fail the others
+@mutation.field("addRecipes")
+def add_recipes(_, info, recipes):
+    try:
+        bulk.check_bulk_size(recipes)
+        states = index_states()
+        results = bulk.insert_recipes(db.recipes, recipes, bulk_chunk_size)
+        for result in results:
+            if result["success"]:
+                index_recipe(recipes[result["index"]])
+        payload = bulk.build_bulk_payload(results)
+        if payload["succeeded"]:
+            bump_recipes_version(states)
+        logger.info(f"Added {payload['succeeded']} recipes, {payload['failed']} failed")
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        payload = {"success": False, "errors": [str(error)], "results": []}
+    return payload
+
+
+# mutation removing many recipes by name
+@mutation.field("removeRecipes")
+def remove_recipes(_, info, recipeNames):
+    try:
+        bulk.check_bulk_size(recipeNames)
+        states = index_states()
+        results = bulk.remove_recipes(db.recipes, recipeNames, bulk_chunk_size)
+        for result in results:
+            if result["success"]:
+                unindex_recipe(result["recipeName"])
+        payload = bulk.build_bulk_payload(results)
+        if payload["succeeded"]:
+            bump_recipes_version(states)
+        logger.info(f"Removed {payload['succeeded']} recipes, {payload['failed']} failed")
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        payload = {"success": False, "errors": [str(error)], "results": []}
+    return payload
+
+
 # Set the path to the schema file and load it
 schema_directory = os.path.dirname(os.path.abspath(__file__))
 schema_path = os.path.join(schema_directory, "schema.graphql")
 type_defs = load_schema_from_path(schema_path)
-logger.info("Type Definitions Loaded: %s", type_defs)
-schema = make_executable_schema(type_defs, query, mutation)
+logger.info("Type definitions loaded", extra={"characters": len(type_defs)})
+schema = make_executable_schema(type_defs, query, mutation, recipes_result)
+
+# Persisted queries (APQ) and the parsed/validated document cache for the GraphQL endpoint
+# PERSISTED_QUERIES_FILE optionally points to a JSON file of {sha256 hash: query} to preload
+persisted_queries = PersistedQueryRegistry(
+    max_entries=int(os.getenv('PERSISTED_QUERIES_MAX_ENTRIES', '1000')),
+    registry=metrics.registry,
+    path=os.getenv('PERSISTED_QUERIES_FILE')
+)
+document_cache = DocumentCache(
+    max_entries=int(os.getenv('GRAPHQL_DOCUMENT_CACHE_SIZE', '500')),
+    registry=metrics.registry
+)
+
+# Static cost, depth, alias and field limits checked before an operation is executed, see query_cost.py
+# Paged fields are charged per requested recipe; the default budget lets a full page of
+# MAX_PAGE_SIZE recipes with every field through. recipes without 'first' reads every recipe
+# and is charged like a full page.
+FIELD_COSTS = {
+    "Query.recipes": FieldCost(20, multiplier="first", default=pagination.MAX_PAGE_SIZE),
+    "Query.searchRecipes": FieldCost(5, multiplier="first", default=search.DEFAULT_RESULTS),
+    "Query.topRecipesByNutrient": FieldCost(10, multiplier="first", default=pagination.DEFAULT_PAGE_SIZE),
+    "Mutation.addRecipe": FieldCost(10),
+    "Mutation.removeRecipe": FieldCost(10),
+    "Mutation.addRecipes": FieldCost(50),
+    "Mutation.removeRecipes": FieldCost(50)
+}
+query_cost_limiter = QueryCostLimiter(
+    schema,
+    FIELD_COSTS,
+    max_cost=int(os.getenv('GRAPHQL_MAX_COST', '5000')),
+    max_depth=int(os.getenv('GRAPHQL_MAX_DEPTH', '15')),
+    max_aliases=int(os.getenv('GRAPHQL_MAX_ALIASES', '30')),
+    max_fields=int(os.getenv('GRAPHQL_MAX_FIELDS', '2000')),
+    registry=metrics.registry
+)
 
 
 # Set up the GraphQL server
@@ -170,27 +445,40 @@ schema = make_executable_schema(type_defs, query, mutation)
 def graphql_server():
     logger.info("Received a POST request")
     data = request.get_json()
+    try:
+        data = persisted_queries.resolve(data)
+    except PersistedQueryError as error:
+        return jsonify(error.response), error.status_code
     success, result = graphql_sync(
         schema,
         data,
         context_value=request,
+        query_parser=document_cache.parse,
+        query_validator=document_cache.validate,
+        validation_rules=query_cost_limiter.validation_rules,
+        middleware=[resolver_metrics],
         debug=True
     )
     status_code = 200 if success else 400
-    return jsonify(result), status_code
+    body, headers = response_serializer.encode(result, request.headers.get("Accept-Encoding"))
+    return Response(body, status=status_code, headers=headers)
 
 
-# Define the HTML for the GraphQL Playground
+# Define the HTML for the GraphQL Playground, read on its first request
 GRAPHQL_PLAYGROUND_HTML_FP = os.path.join(schema_directory, "templates", "graphql_playground.html")
-with open(GRAPHQL_PLAYGROUND_HTML_FP, 'r', encoding='utf-8') as file:
-    html_content = file.read()
+
+
+@functools.lru_cache(maxsize=None)
+def playground_html():
+    with open(GRAPHQL_PLAYGROUND_HTML_FP, 'r', encoding='utf-8') as file:
+        return file.read()
 
 
 # graphql playground for health check
 @app.route('/recipes/graphql', methods=['GET'])
 def graphql_playground():
     logger.info("Received a GET request")
-    return html_content, 200
+    return playground_html(), 200
 
 
 # rest endpoint serving as a health check and welcome page
@@ -207,7 +495,15 @@ def submit():
     count = request.form.get('count')
 
     if recipe and count:
-        data = get_recipe_collection(recipe, count)
+        try:
+            recipe, count = normalize_search(recipe, count)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        try:
+            data = get_recipe_collection(recipe, count)
+        except SpoonacularError as error:
+            logger.error(f"Error: {error}")
+            return jsonify({"error": "Failed to fetch recipes from external API"}), 502
 
         # example: use for testing to avoid hitting the daily spoonacular api request quota with the free tier
         # data = {
@@ -236,21 +532,23 @@ def submit():
         return jsonify({"error": "Please provide both a recipe name and count"}), 400
 
 
-@app.route('/api/recipecollection', methods=['GET'])
+# fetch recipes from the Spoonacular API through the search cache
 def get_recipe_collection(recipe, count):
-    # fetch recipes from the Spoonacular API
-    params = {
-        'apiKey': spoonacular_api_key,
-        'query': recipe,
-        'number': count
-    }
-    response = requests.get(spoonacular_api_url, params=params)
+    return recipe_search.search(recipe, count)
 
-    if response.status_code == 200:
-        return response.json()
 
-    else:
-        return jsonify({"error": "Failed to fetch recipes from external API"}), 500
+# JSON version of the recipe search, e.g. /api/recipecollection?recipe=pasta&count=5
+@app.route('/api/recipecollection', methods=['GET'])
+def recipe_collection():
+    try:
+        recipe, count = normalize_search(request.args.get('recipe', ''), request.args.get('count', 10))
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    try:
+        return jsonify(get_recipe_collection(recipe, count))
+    except SpoonacularError as error:
+        logger.error(f"Error: {error}")
+        return jsonify({"error": "Failed to fetch recipes from external API"}), 502
 
 
 # Language selection function
@@ -267,5 +565,43 @@ def set_language():
     return redirect(url_for('index'))
 
 
+# CLI command to create the declared indexes
+# Usage: flask --app app ensure-indexes
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    for collection, names in indexes.ensure_indexes(db).items():
+        click.echo(f"{collection}: {', '.join(names)}")
+
+
+# CLI command failing when a hot-path query would scan a whole collection
+# Usage: flask --app app check-query-plans
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    violations = indexes.check_query_plans(db)
+    if violations:
+        raise click.ClickException(f"COLLSCAN in query plans: {', '.join(violations)}")
+    click.echo("All hot-path queries use an index")
+
+
+# CLI command importing a recipe catalogue from a JSON array or NDJSON file
+# Usage: flask --app app import-recipes recipes.ndjson --chunk-size 1000
+@app.cli.command("import-recipes")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--chunk-size", type=click.IntRange(min=1), default=None, help="Recipes per bulk insert")
+def import_recipes_command(file, chunk_size):
+    started = time.perf_counter()
+    imported = failed = 0
+    for result in bulk.insert_recipes(db.recipes, bulk.read_recipes(file), chunk_size or bulk_chunk_size):
+        if result["success"]:
+            imported += 1
+        else:
+            failed += 1
+            click.echo(f"Recipe {result['index']} ({result['recipeName']}): {result['error']}", err=True)
+    elapsed = time.perf_counter() - started
+    if imported:
+        recipe_versions.bump_version(db)
+    click.echo(f"Imported {imported} recipes, {failed} failed in {elapsed:.2f}s ({(imported + failed) / max(elapsed, 1e-9):.0f} recipes/s)")
+
+
 if __name__ == "__main__":
     app.run(debug=False, host='0.0.0.0', port=5051)
@@ -0,0 +1,277 @@
+import contextlib
+import logging
+
+from ariadne import MutationType, ObjectType, QueryType, make_executable_schema
+from ariadne.asgi import GraphQL
+from ariadne.asgi.handlers import GraphQLHTTPHandler
+from ariadne.exceptions import HttpError
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from prometheus_client import make_asgi_app
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+
+import bulk
+import nutrition
+import pagination
+import recipe_versions
+import search
+from app import (
+    build_recipes_page, bulk_chunk_size, document_cache, index_recipe, index_states, metrics, mongo_command_metrics,
+    mongo_db, mongo_pool_metrics, mongo_settings, mongo_uri, nutrition_index, persisted_queries, query_cost_limiter, recipe_search,
+    recipes_written, resolver_metrics, response_serializer, search_index, type_defs, unindex_recipe, uses_nutrition_index
+)
+from graphql_cache import PersistedQueryError
+
+# Async serving mode for the recipes GraphQL API
+# Run with: uvicorn asgi:app --host 0.0.0.0 --port 5051
+# The resolvers use the non-blocking Motor driver, so one worker serves many requests
+# concurrently while a request waits on Mongo. The Flask app in app.py (including the
+# Spoonacular search pages) is unchanged.
+
+logger = logging.getLogger(__name__)
+
+query = QueryType()
+mutation = MutationType()
+recipes_result = ObjectType("RecipesResult")
+
+# The Motor client is bound to the event loop, so it is created on startup rather than import
+mongo = {}
+
+
+def get_db():
+    return mongo["db"]
+
+
+@query.field("recipes")
+async def resolve_recipes(_, info, first=None, after=None, filter=None):
+    try:
+        limit = pagination.page_size(first)
+        recipe_query = pagination.build_recipe_query(filter)
+        if uses_nutrition_index(filter):
+            await ensure_nutrition_index()
+            matches = nutrition_index.match(filter)
+            after_id = pagination.decode_cursor(after) if after else None
+            recipes_cursor = get_db().recipes.find(
+                pagination.ids_query(nutrition.page_ids(matches, after_id, pagination.fetch_size(limit))), pagination.recipe_projection(info)
+            ).sort("_id", 1)
+            payload = build_recipes_page(await recipes_cursor.to_list(None), limit, recipe_query)
+            payload["matchCount"] = len(matches)
+            return payload
+        recipes_cursor = get_db().recipes.find(
+            pagination.page_query(recipe_query, after), pagination.recipe_projection(info)
+        ).sort("_id", 1).limit(pagination.fetch_size(limit))
+        return build_recipes_page(await recipes_cursor.to_list(None), limit, recipe_query)
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+@recipes_result.field("totalCount")
+async def resolve_total_count(result, info):
+    if "matchCount" in result:
+        return result["matchCount"]
+    if "query" not in result:
+        return None
+    return await get_db().recipes.count_documents(result["query"])
+
+
+# Shared recipes version, see recipe_versions.py
+async def recipes_version():
+    return recipe_versions.version_of(
+        await get_db()[recipe_versions.VERSIONS_COLLECTION].find_one(recipe_versions.VERSION_QUERY)
+    )
+
+
+async def bump_recipes_version(states):
+    document = await get_db()[recipe_versions.VERSIONS_COLLECTION].find_one_and_update(
+        recipe_versions.VERSION_QUERY, recipe_versions.BUMP_UPDATE, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    recipes_written(states, recipe_versions.version_of(document))
+
+
+async def ensure_nutrition_index():
+    version = await recipes_version()
+    if nutrition_index.needs_build(version):
+        nutrition_index.build(await get_db().recipes.find({}, nutrition.RECIPE_PROJECTION).to_list(None), version)
+
+
+@query.field("topRecipesByNutrient")
+async def resolve_top_recipes_by_nutrient(_, info, nutrient, first=None, filter=None):
+    try:
+        limit = pagination.page_size(pagination.DEFAULT_PAGE_SIZE if first is None else first)
+        await ensure_nutrition_index()
+        ids = nutrition_index.top(nutrient, limit, filter)
+        recipes = await get_db().recipes.find(pagination.ids_query(ids), pagination.recipe_projection(info)).to_list(None)
+        rank = {object_id: position for position, object_id in enumerate(ids)}
+        payload = build_recipes_page(sorted(recipes, key=lambda recipe: rank[recipe["_id"]]), limit, None)
+        payload.pop("query")
+        return payload
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+@query.field("searchRecipes")
+async def resolve_search_recipes(_, info, query, first=None, includeExternal=False):
+    try:
+        limit = pagination.page_size(first or search.DEFAULT_RESULTS)
+        version = await recipes_version()
+        if search_index.needs_build(version):
+            search_index.build(await get_db().recipes.find({}, search.RECIPE_PROJECTION).to_list(None), version)
+        payload = search.build_search_payload(search_index.search(query, limit))
+        if not payload["results"] and includeExternal:
+            payload["source"] = "spoonacular"
+            payload["external"] = (await run_in_threadpool(recipe_search.search, query, limit)).get("results", [])
+        return payload
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+@mutation.field("addRecipe")
+async def add_recipe(_, info, recipe):
+    try:
+        states = index_states()
+        await get_db().recipes.insert_one(recipe)
+        dbRecipe = await get_db().recipes.find_one({"recipeName": recipe["recipeName"]})
+        if dbRecipe is None:
+            raise Exception("Failed to add the recipe")
+        index_recipe(dbRecipe)
+        await bump_recipes_version(states)
+        return {"success": True, "message": "Recipe added successfully", "recipe": dbRecipe}
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "message": "Failed to add the recipe"}
+
+
+@mutation.field("removeRecipe")
+async def remove_recipe(_, info, recipe):
+    try:
+        states = index_states()
+        deleted = (await get_db().recipes.delete_one(recipe)).deleted_count
+        dbRecipe = await get_db().recipes.find_one({"recipeName": recipe["recipeName"]})
+        if dbRecipe is not None:
+            raise Exception("Failed to remove the recipe")
+        unindex_recipe(recipe["recipeName"])
+        if deleted:
+            await bump_recipes_version(states)
+        return {"success": True, "message": "Recipe removed successfully", "recipe": recipe}
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "message": "Failed to remove the recipe"}
+
+
+async def insert_chunk(chunk, offset):
+    documents, rejected = bulk.prepare_insert(chunk, offset)
+    if not documents:
+        return rejected
+    try:
+        await get_db().recipes.insert_many([recipe for _, recipe in documents], ordered=False)
+    except BulkWriteError as error:
+        return bulk.insert_results(documents, rejected, error.details.get("writeErrors", []))
+    return bulk.insert_results(documents, rejected)
+
+
+@mutation.field("addRecipes")
+async def add_recipes(_, info, recipes):
+    try:
+        bulk.check_bulk_size(recipes)
+        states = index_states()
+        results = []
+        for offset, chunk in bulk.chunked(recipes, bulk_chunk_size):
+            results.extend(await insert_chunk(chunk, offset))
+        for result in results:
+            if result["success"]:
+                index_recipe(recipes[result["index"]])
+        payload = bulk.build_bulk_payload(results)
+        if payload["succeeded"]:
+            await bump_recipes_version(states)
+        return payload
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+@mutation.field("removeRecipes")
+async def remove_recipes(_, info, recipeNames):
+    try:
+        bulk.check_bulk_size(recipeNames)
+        states = index_states()
+        results = []
+        for offset, chunk in bulk.chunked(recipeNames, bulk_chunk_size):
+            found = set(await get_db().recipes.distinct("recipeName", bulk.names_query(chunk)))
+            if found:
+                await get_db().recipes.delete_many(bulk.names_query(found))
+            results.extend(bulk.remove_results(chunk, offset, found))
+        for result in results:
+            if result["success"]:
+                unindex_recipe(result["recipeName"])
+        payload = bulk.build_bulk_payload(results)
+        if payload["succeeded"]:
+            await bump_recipes_version(states)
+        return payload
+    except Exception as error:
+        logger.error(f"Error: {error}")
+        return {"success": False, "errors": [str(error)], "results": []}
+
+
+schema = make_executable_schema(type_defs, query, mutation, recipes_result)
+
+
+# HTTP handler resolving persisted queries (APQ) before the query is executed
+class PersistedQueryHTTPHandler(GraphQLHTTPHandler):
+    async def graphql_http_server(self, request):
+        try:
+            data = await self.extract_data_from_request(request)
+        except HttpError as error:
+            return PlainTextResponse(error.message or error.status, status_code=400)
+        try:
+            data = persisted_queries.resolve(data)
+        except PersistedQueryError as error:
+            return JSONResponse(error.response, status_code=error.status_code)
+        success, result = await self.execute_graphql_query(request, data)
+        return await self.create_json_response(request, result, success)
+
+    # Encoded and compressed like the responses of the Flask app, see serialization.py
+    async def create_json_response(self, request, result, success):
+        body, headers = response_serializer.encode(result, request.headers.get("accept-encoding"))
+        return Response(body, status_code=200 if success else 400, headers=headers)
+
+
+graphql_app = GraphQL(
+    schema,
+    query_parser=document_cache.parse,
+    query_validator=document_cache.validate,
+    validation_rules=query_cost_limiter.validation_rules,
+    http_handler=PersistedQueryHTTPHandler(middleware=[resolver_metrics]),
+    debug=True
+)
+
+
+async def health(request):
+    await get_db().command("ping")
+    return JSONResponse({"status": "ok"})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    client = AsyncIOMotorClient(mongo_uri, event_listeners=[mongo_command_metrics, mongo_pool_metrics], **mongo_settings)
+    mongo["db"] = client[mongo_db]
+    try:
+        yield
+    finally:
+        client.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/", health),
+        Route("/recipes/graphql", graphql_app, methods=["GET", "POST"]),
+        Mount("/metrics", make_asgi_app(registry=metrics.registry))
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,139 @@
+import itertools
+import json
+
+from pymongo.errors import BulkWriteError
+
+# Bulk recipe writes: recipes are sent in unordered chunks, so one failing recipe does not
+# stop the rest of its chunk, and the per-recipe outcome is read from the write result
+# instead of querying every recipe again
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_BULK_RECIPES = 10000
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+# Yields (offset, chunk) pairs of at most size items; works on any iterable, so a file can
+# be imported without loading it into memory
+def chunked(items, size):
+    items = iter(items)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield offset, chunk
+        offset += len(chunk)
+
+
+def item_result(index, recipe_name, error=None):
+    return {"index": index, "recipeName": recipe_name, "success": error is None, "error": error}
+
+
+def write_error_message(write_error):
+    if write_error.get("code") == DUPLICATE_KEY_ERROR:
+        return "Recipe already exists"
+    return write_error.get("errmsg", "Write failed")
+
+
+# Splits a chunk into the documents to insert, as (index, recipe) pairs, and the results of
+# the recipes that cannot be inserted at all
+def prepare_insert(chunk, offset):
+    documents = []
+    rejected = []
+    for position, recipe in enumerate(chunk):
+        index = offset + position
+        if not isinstance(recipe, dict) or not recipe.get("recipeName"):
+            rejected.append(item_result(index, None, "recipeName is required"))
+        else:
+            documents.append((index, recipe))
+    return documents, rejected
+
+
+# Per-recipe results of one insert_many call; write_errors index into documents
+def insert_results(documents, rejected, write_errors=()):
+    errors = {write_error["index"]: write_error_message(write_error) for write_error in write_errors}
+    results = rejected + [
+        item_result(index, recipe["recipeName"], errors.get(position))
+        for position, (index, recipe) in enumerate(documents)
+    ]
+    return sorted(results, key=lambda result: result["index"])
+
+
+def insert_chunk(collection, chunk, offset):
+    documents, rejected = prepare_insert(chunk, offset)
+    if not documents:
+        return rejected
+    try:
+        collection.insert_many([recipe for _, recipe in documents], ordered=False)
+    except BulkWriteError as error:
+        return insert_results(documents, rejected, error.details.get("writeErrors", []))
+    return insert_results(documents, rejected)
+
+
+# Inserts the recipes in unordered chunks and returns one result per recipe, in input order
+def insert_recipes(collection, recipes, chunk_size=DEFAULT_CHUNK_SIZE):
+    results = []
+    for offset, chunk in chunked(recipes, chunk_size):
+        results.extend(insert_chunk(collection, chunk, offset))
+    return results
+
+
+# Per-name results of a removal; found is the set of names that existed and were deleted
+def remove_results(recipe_names, offset, found):
+    results = []
+    removed = set()
+    for position, name in enumerate(recipe_names):
+        error = None if name in found and name not in removed else "Recipe not found"
+        removed.add(name)
+        results.append(item_result(offset + position, name, error))
+    return results
+
+
+# Filter on the recipes with one of the given names
+def names_query(names):
+    return {"recipeName": {"$in": list(names)}}
+
+
+# Removes recipes by name in chunks
+# Bulk delete results only carry a total count, so each chunk first reads the names that
+# exist (answered from the unique recipeName index) and then deletes them in one call
+def remove_recipes(collection, recipe_names, chunk_size=DEFAULT_CHUNK_SIZE):
+    results = []
+    for offset, chunk in chunked(recipe_names, chunk_size):
+        found = set(collection.distinct("recipeName", names_query(chunk)))
+        if found:
+            collection.delete_many(names_query(found))
+        results.extend(remove_results(chunk, offset, found))
+    return results
+
+
+# BulkRecipesResult payload for the addRecipes/removeRecipes mutations
+def build_bulk_payload(results):
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "success": failed == 0,
+        "errors": [],
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }
+
+
+def check_bulk_size(items, max_items=MAX_BULK_RECIPES):
+    if len(items) > max_items:
+        raise ValueError(f"At most {max_items} recipes can be written at once")
+
+
+# Yields the recipes of an import file: NDJSON (one recipe per line, streamed) for .ndjson
+# and .jsonl files, otherwise a JSON array
+def read_recipes(file):
+    if file.name.endswith((".ndjson", ".jsonl")):
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+        return
+    recipes = json.load(file)
+    if not isinstance(recipes, list):
+        raise ValueError("The import file must contain a JSON array of recipes")
+    yield from recipes
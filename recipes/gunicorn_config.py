@@ -0,0 +1,100 @@
+import gc
+import os
+import sys
+
+# Gunicorn settings of the service: gunicorn -c gunicorn_config.py -b 0.0.0.0:<port> app:app
+# The app is imported once in the master (preload_app) and the workers are forked from it, so
+# they start without importing anything and share the master's memory pages. Resources that do
+# not survive a fork are per process: the MongoDB client is created on first use in each worker
+# (see mongo_client.py), the log listener thread is restarted in post_fork, and the master's
+# own client, used to ensure the indexes while preloading, is closed once the app is loaded.
+# Workers are replaced after max_requests requests, give or take max_requests_jitter, so slow
+# leaks and fragmentation do not build up.
+#
+# Environment: WEB_CONCURRENCY (workers), GUNICORN_WORKER_CLASS (gthread, gevent or sync),
+# GUNICORN_THREADS, GUNICORN_WORKER_CONNECTIONS, GUNICORN_PRELOAD, GUNICORN_MAX_REQUESTS,
+# GUNICORN_MAX_REQUESTS_JITTER, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE
+
+WORKER_CLASSES = ("gthread", "gevent", "sync")
+
+# Module name of the WSGI app, as given on the command line
+APP_MODULE = "app"
+
+
+# CPUs this process may use: the affinity mask, capped by a cgroup v2 quota when the
+# container is limited to fewer CPUs than the host has
+def available_cpus(cpu_max_path="/sys/fs/cgroup/cpu.max"):
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open(cpu_max_path, encoding="utf-8") as file:
+            quota, period = file.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(int(quota) // int(period), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+# The usual (2 x CPUs) + 1 for sync workers, which serve one request at a time; gthread and
+# gevent workers serve many, so one per CPU is enough, with at least two so a worker being
+# recycled never leaves the service without one
+def default_workers(worker_class, cpus):
+    if worker_class not in WORKER_CLASSES:
+        raise ValueError(f"Unsupported worker class: {worker_class}")
+    if worker_class == "sync":
+        return cpus * 2 + 1
+    return max(cpus, 2)
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() == "true"
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY") or default_workers(worker_class, available_cpus()))
+# More than one thread would turn sync workers into gthread ones
+threads = int(os.getenv("GUNICORN_THREADS", "4" if worker_class == "gthread" else "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+preload_app = env_flag("GUNICORN_PRELOAD", "true")
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Worker heartbeats go to a tmpfs rather than the container's overlay filesystem, where a
+# slow write can get a busy worker killed
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+# gevent patches the standard library; with a preloaded app this has to happen before the app
+# (and pymongo's threads and sockets) are imported, not in the forked workers
+if worker_class == "gevent":
+    from gevent import monkey  # optional dependency, see the 'gevent' poetry group
+    monkey.patch_all()
+
+
+def loaded_app():
+    return sys.modules.get(APP_MODULE)
+
+
+# Master, once the app is preloaded and before the first fork: closes the master's MongoDB
+# client and moves the loaded objects out of the garbage collector's reach, so collections in
+# the workers do not write to (and copy) the pages they share with the master
+def when_ready(server):
+    service = loaded_app()
+    if service is None:
+        return
+    if getattr(service, "client", None) is not None:
+        service.client.close()
+    gc.freeze()
+
+
+# Worker, right after the fork: the log listener thread of the master is not inherited
+def post_fork(server, worker):
+    service = loaded_app()
+    if service is not None and getattr(service, "async_logging", None) is not None:
+        service.async_logging.restart()
@@ -0,0 +1,82 @@
+import logging
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+
+import bulk
+import pagination
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the hot-path queries of the recipes service, per collection
+# create_indexes is a no-op for indexes that already exist with the same spec, so
+# ensure_indexes can run on every startup
+INDEXES = {
+    "recipes": [
+        IndexModel([("recipeName", ASCENDING)], name="recipeName", unique=True)
+    ]
+}
+
+
+# Creates the declared indexes and returns the names created per collection
+def ensure_indexes(db):
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = db[collection].create_indexes(indexes)
+    return created
+
+
+# Explain command bodies of the queries issued by the resolvers
+def find_command(collection, query, sort=None):
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    return command
+
+
+def count_command(collection, query):
+    return {"count": collection, "query": query}
+
+
+# Hot-path queries as (name, explain command), built with representative values by the same
+# builders the resolvers and the bulk mutations use, so a change to a query is checked as it
+# is issued. Calorie and nutrient ranges are answered by the nutrition index, not by Mongo.
+def hot_path_queries():
+    after = pagination.encode_cursor(ObjectId())
+    by_name = pagination.build_recipe_query({"recipeName": "recipe"})
+    return [
+        ("recipe by name", find_command("recipes", by_name)),
+        ("recipes page", find_command("recipes", pagination.page_query(pagination.build_recipe_query(None), after), [("_id", 1)])),
+        ("recipes page by name", find_command("recipes", pagination.page_query(by_name, after), [("_id", 1)])),
+        ("recipe count by name", count_command("recipes", by_name)),
+        ("recipes by id", find_command("recipes", pagination.ids_query([ObjectId(), ObjectId()]), [("_id", 1)])),
+        ("bulk recipes by name", find_command("recipes", bulk.names_query(["recipe", "other recipe"])))
+    ]
+
+
+# Returns the stages of a query plan that scan a whole collection
+# Handles find and aggregate explain output, including sharded and multi-input plans
+def find_collscans(plan):
+    collscans = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            collscans.append(plan)
+        for key, value in plan.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            collscans.extend(find_collscans(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            collscans.extend(find_collscans(item))
+    return collscans
+
+
+# Explains every hot-path query and returns the names of the ones doing a COLLSCAN
+# Only the query planner runs; the queries are not executed
+def check_query_plans(db):
+    violations = []
+    for name, command in hot_path_queries():
+        if find_collscans(db.command("explain", command, verbosity="queryPlanner")):
+            logger.warning(f"Query plan for '{name}' is a COLLSCAN")
+            violations.append(name)
+    return violations
@@ -0,0 +1,219 @@
+import bisect
+import itertools
+import threading
+import time
+
+# In-process columnar index over recipe calories and nutrient amounts
+# Each column keeps the values sorted next to the matching recipe _ids, so a range filter
+# is two binary searches and a top-k query reads the end of a column. Like the search index,
+# it is built from the collection on first use, updated by the recipe mutations of this
+# process and rebuilt when the shared recipes version moves or every refresh_seconds
+
+RECIPE_PROJECTION = {"recipeName": 1, "calories": 1, "nutrients": 1}
+
+
+def is_amount(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# Returns (calories, {nutrient: amount}) with the numeric values of a recipe
+def recipe_values(recipe):
+    calories = recipe.get("calories") if is_amount(recipe.get("calories")) else None
+    nutrients = {}
+    for item in recipe.get("nutrients") or []:
+        if item and item.get("nutrient") and is_amount(item.get("amount")):
+            nutrients[item["nutrient"]] = item["amount"]
+    return calories, nutrients
+
+
+def has_range_filter(recipe_filter):
+    return bool(recipe_filter) and any(
+        recipe_filter.get(field) is not None for field in ("caloriesMin", "caloriesMax", "nutrientMin")
+    )
+
+
+# Mongo filter equivalent to the range conditions of a RecipeFilter
+def range_query(recipe_filter):
+    query = {}
+    calories = {}
+    if recipe_filter.get("caloriesMin") is not None:
+        calories["$gte"] = recipe_filter["caloriesMin"]
+    if recipe_filter.get("caloriesMax") is not None:
+        calories["$lte"] = recipe_filter["caloriesMax"]
+    if calories:
+        query["calories"] = calories
+    conditions = [
+        {"$elemMatch": {"nutrient": condition["nutrient"], "amount": {"$gte": condition["amount"]}}}
+        for condition in recipe_filter.get("nutrientMin") or []
+    ]
+    if conditions:
+        query["nutrients"] = {"$all": conditions}
+    return query
+
+
+# Sorted values with the recipe _id of each value at the same position
+class SortedColumn:
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs)
+        self.values = [value for value, _ in pairs]
+        self.ids = [object_id for _, object_id in pairs]
+
+    def __len__(self):
+        return len(self.values)
+
+    def insert(self, value, object_id):
+        position = bisect.bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.ids.insert(position, object_id)
+
+    def remove(self, value, object_id):
+        start = bisect.bisect_left(self.values, value)
+        end = bisect.bisect_right(self.values, value)
+        position = self.ids.index(object_id, start, end)
+        del self.values[position]
+        del self.ids[position]
+
+    def range_ids(self, minimum=None, maximum=None):
+        start = 0 if minimum is None else bisect.bisect_left(self.values, minimum)
+        end = len(self.values) if maximum is None else bisect.bisect_right(self.values, maximum)
+        return self.ids[start:end]
+
+    # Ids from the highest value down
+    def descending_ids(self):
+        return reversed(self.ids)
+
+
+class NutritionIndex:
+    def __init__(self, refresh_seconds=300, clock=time.monotonic):
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self._calories = SortedColumn()
+        # nutrient -> SortedColumn
+        self._nutrients = {}
+        # _id -> (calories, {nutrient: amount})
+        self._values = {}
+        self._ids_by_name = {}
+        self._built_at = None
+        # Version of the recipes collection the index was built at, see recipe_versions.py
+        self._version = None
+        self._builds = 0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def needs_build(self, version=None):
+        return (
+            self._built_at is None or version != self._version
+            or self.clock() - self._built_at >= self.refresh_seconds
+        )
+
+    # Taken before a write of this process, and passed to advance once it is bumped
+    def state(self):
+        with self._lock:
+            return self._builds, self._version
+
+    # Moves the index to the version bumped by a write of this process, already applied with
+    # add or remove, unless the index was rebuilt or another write was bumped in between
+    def advance(self, state, version):
+        with self._lock:
+            if state == (self._builds, self._version) and self._version is not None and version == self._version + 1:
+                self._version = version
+
+    # Replaces the index content with the given recipes (which must include _id)
+    def build(self, recipes, version=None):
+        values = {}
+        ids_by_name = {}
+        for recipe in recipes:
+            values[recipe["_id"]] = recipe_values(recipe)
+            ids_by_name[recipe.get("recipeName")] = recipe["_id"]
+        calories = SortedColumn((value[0], object_id) for object_id, value in values.items() if value[0] is not None)
+        pairs = sorted(
+            (nutrient, amount, object_id)
+            for object_id, (_, nutrients) in values.items()
+            for nutrient, amount in nutrients.items()
+        )
+        nutrients = {
+            nutrient: SortedColumn((amount, object_id) for _, amount, object_id in group)
+            for nutrient, group in itertools.groupby(pairs, key=lambda pair: pair[0])
+        }
+        with self._lock:
+            self._calories = calories
+            self._nutrients = nutrients
+            self._values = values
+            self._ids_by_name = ids_by_name
+            self._built_at = self.clock()
+            self._version = version
+            self._builds += 1
+
+    def ensure_built(self, collection, version=None):
+        if not self.needs_build(version):
+            return
+        with self._build_lock:
+            if self.needs_build(version):
+                self.build(collection.find({}, RECIPE_PROJECTION), version)
+
+    def add(self, recipe):
+        with self._lock:
+            if self._built_at is None or "_id" not in recipe:
+                return
+            self.remove(recipe.get("recipeName"))
+            object_id = recipe["_id"]
+            calories, nutrients = self._values[object_id] = recipe_values(recipe)
+            self._ids_by_name[recipe.get("recipeName")] = object_id
+            if calories is not None:
+                self._calories.insert(calories, object_id)
+            for nutrient, amount in nutrients.items():
+                self._nutrients.setdefault(nutrient, SortedColumn()).insert(amount, object_id)
+
+    def remove(self, recipe_name):
+        with self._lock:
+            object_id = self._ids_by_name.pop(recipe_name, None)
+            if object_id is None:
+                return
+            calories, nutrients = self._values.pop(object_id)
+            if calories is not None:
+                self._calories.remove(calories, object_id)
+            for nutrient, amount in nutrients.items():
+                self._nutrients[nutrient].remove(amount, object_id)
+
+    # Sets of ids matching each range condition of the filter
+    def _matching_sets(self, recipe_filter):
+        sets = []
+        if recipe_filter.get("caloriesMin") is not None or recipe_filter.get("caloriesMax") is not None:
+            sets.append(set(self._calories.range_ids(recipe_filter.get("caloriesMin"), recipe_filter.get("caloriesMax"))))
+        for condition in recipe_filter.get("nutrientMin") or []:
+            column = self._nutrients.get(condition["nutrient"])
+            sets.append(set(column.range_ids(condition["amount"])) if column else set())
+        return sets
+
+    # Returns the _ids of the recipes matching the range conditions of the filter, in _id order
+    def match(self, recipe_filter):
+        with self._lock:
+            sets = sorted(self._matching_sets(recipe_filter), key=len)
+        if not sets:
+            return sorted(self._values)
+        matches = sets[0].intersection(*sets[1:])
+        return sorted(matches)
+
+    # Returns the _ids of the limit recipes with the most of a nutrient, optionally
+    # restricted to the recipes matching the range conditions of a filter
+    def top(self, nutrient, limit, recipe_filter=None):
+        with self._lock:
+            column = self._nutrients.get(nutrient)
+            if column is None:
+                return []
+            allowed = set(self.match(recipe_filter)) if has_range_filter(recipe_filter) else None
+            ranked = (object_id for object_id in column.descending_ids() if allowed is None or object_id in allowed)
+            return list(itertools.islice(ranked, limit))
+
+
+# Returns the ids of one page: the first limit ids after the cursor id (all of them for 0)
+def page_ids(ids, after_id, limit):
+    start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+    return ids[start:start + limit] if limit else ids[start:]
@@ -0,0 +1,113 @@
+import base64
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+import nutrition
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+CURSOR_PREFIX = "recipe:"
+
+# Recipe fields stored in Mongo under the same name as the GraphQL field
+RECIPE_FIELDS = ("recipeName", "ingredients", "calories", "nutrients")
+
+
+# Cursors are opaque to clients: base64 of the recipe _id
+def encode_cursor(object_id):
+    return base64.b64encode(f"{CURSOR_PREFIX}{object_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        decoded = base64.b64decode(cursor.encode(), validate=True).decode()
+        if not decoded.startswith(CURSOR_PREFIX):
+            raise ValueError
+        return ObjectId(decoded[len(CURSOR_PREFIX):])
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# Recipes per page, None for every recipe when 'first' is omitted: clients written before
+# pagination (e.g. the frontend's recipe list) send no 'first' and expect the whole collection
+def page_size(first):
+    if first is None:
+        return None
+    if not 1 <= first <= MAX_PAGE_SIZE:
+        raise ValueError(f"'first' must be between 1 and {MAX_PAGE_SIZE}")
+    return first
+
+
+# Recipes to read for a page: one more than its size, to know whether there is a next page
+# 0 reads every recipe, as it does for a MongoDB limit
+def fetch_size(limit):
+    return 0 if limit is None else limit + 1
+
+
+# Translates the GraphQL RecipeFilter input into a Mongo filter
+def build_recipe_query(recipe_filter):
+    query = {}
+    if recipe_filter and recipe_filter.get("recipeName"):
+        query["recipeName"] = recipe_filter["recipeName"]
+    if recipe_filter:
+        query.update(nutrition.range_query(recipe_filter))
+    return query
+
+
+# Filter on the recipes with the given ids, e.g. those matched by the nutrition index
+def ids_query(ids):
+    return {"_id": {"$in": ids}}
+
+
+# Restricts a recipe filter to the recipes after the given cursor
+def page_query(recipe_query, after=None):
+    query = dict(recipe_query)
+    if after:
+        query["_id"] = {"$gt": decode_cursor(after)}
+    return query
+
+
+# Yields the fields selected directly under a selection set, expanding fragments
+def _selected_fields(selection_set, fragments):
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _selected_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from _selected_fields(fragment.selection_set, fragments)
+
+
+# Collects the Recipe fields requested under 'results' and 'edges { node }' of a
+# RecipesResult, and whether the result's own field (e.g. totalCount) was requested
+def requested_recipe_fields(info):
+    fields = set()
+    for field_node in info.field_nodes:
+        for child in _selected_fields(field_node.selection_set, info.fragments):
+            recipe_nodes = []
+            if child.name.value == "results":
+                recipe_nodes.append(child)
+            elif child.name.value == "edges":
+                recipe_nodes.extend(
+                    edge_child for edge_child in _selected_fields(child.selection_set, info.fragments)
+                    if edge_child.name.value == "node"
+                )
+            for recipe_node in recipe_nodes:
+                fields.update(
+                    recipe_field.name.value
+                    for recipe_field in _selected_fields(recipe_node.selection_set, info.fragments)
+                )
+    return fields
+
+
+# Builds a Mongo projection that only fetches the requested Recipe fields
+def recipe_projection(info):
+    projection = {field: 1 for field in requested_recipe_fields(info) if field in RECIPE_FIELDS}
+    projection["_id"] = 1
+    return projection
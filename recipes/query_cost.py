@@ -0,0 +1,250 @@
+from collections import defaultdict
+
+from graphql import GraphQLError, get_named_type, is_leaf_type
+from graphql.language import FieldNode, FragmentDefinitionNode, FragmentSpreadNode, InlineFragmentNode, OperationDefinitionNode
+from graphql.type import SchemaMetaFieldDef, TypeMetaFieldDef, TypeNameMetaFieldDef
+from graphql.utilities import value_from_ast_untyped
+from graphql.validation import ValidationRule
+from prometheus_client import Counter, Histogram
+
+# Static cost analysis of GraphQL operations, checked before they are executed
+# Every field has a cost: leaf fields are free, object fields cost 1, and the fields backed by
+# database work are given explicit costs by the service. A field's selections are counted
+# once, or once per item when the field takes a page size or a list argument, so
+# 'recipes(first: 500)' costs more than 'recipes(first: 5)'. Operations over the cost budget,
+# nested too deeply, using too many aliases or selecting too many fields once their fragments
+# are expanded are rejected with a validation error. The default depth and field limits let
+# the standard introspection query of GraphQL clients through.
+#
+# The cost depends on the variables, so it is checked through Ariadne's validation_rules hook,
+# which runs on every request; the document cache only remembers documents that passed the
+# standard rules, and a rejection is reported by a rule built for that request alone
+
+QUERY_TOO_COMPLEX = "QUERY_TOO_COMPLEX"
+
+COST_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+# Cost of one field: cost itself, plus the cost of its selections times a multiplier read from
+# an argument (an Int page size or the length of a list), or default when it is not given
+class FieldCost:
+    def __init__(self, cost, multiplier=None, default=1):
+        self.cost = cost
+        self.multiplier = multiplier
+        self.default = default
+
+    def times(self, field_node, variables):
+        if self.multiplier is None:
+            return 1
+        for argument in field_node.arguments:
+            if argument.name.value == self.multiplier:
+                value = value_from_ast_untyped(argument.value, variables)
+                if isinstance(value, list):
+                    return len(value)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    return max(value, 0)
+        return self.default
+
+
+LEAF_COST = FieldCost(0)
+OBJECT_COST = FieldCost(1)
+
+
+# Cost, depth, alias count and number of fields (once fragments are expanded) of one operation
+class QueryCost:
+    def __init__(self, cost=0, depth=0, aliases=0, fields=0):
+        self.cost = cost
+        self.depth = depth
+        self.aliases = aliases
+        self.fields = fields
+
+
+def find_operation(document, operation_name=None):
+    operations = [node for node in document.definitions if isinstance(node, OperationDefinitionNode)]
+    if operation_name:
+        return next((node for node in operations if node.name and node.name.value == operation_name), None)
+    return operations[0] if len(operations) == 1 else None
+
+
+# Names of the fragments spread in a selection set, at any level
+def _spread_names(selection_set):
+    names = set()
+    pending = [selection_set]
+    while pending:
+        current = pending.pop()
+        for selection in current.selections if current else ():
+            if isinstance(selection, FragmentSpreadNode):
+                names.add(selection.name.value)
+            else:
+                pending.append(selection.selection_set)
+    return names
+
+
+# Whether fragments spread each other in a cycle, which the NoFragmentCycles rule reports
+# Fragments are resolved once every fragment they spread is; the ones left are on a cycle
+def has_fragment_cycles(fragments):
+    spreads = {name: _spread_names(node.selection_set) & fragments.keys() for name, node in fragments.items()}
+    pending = {name: len(names) for name, names in spreads.items()}
+    spread_by = defaultdict(list)
+    for name, names in spreads.items():
+        for spread in names:
+            spread_by[spread].append(name)
+    ready = [name for name, count in pending.items() if count == 0]
+    resolved = 0
+    while ready:
+        resolved += 1
+        for name in spread_by[ready.pop()]:
+            pending[name] -= 1
+            if pending[name] == 0:
+                ready.append(name)
+    return resolved < len(fragments)
+
+
+# Walks the selections of an operation, expanding fragments
+# Fields the schema does not know are skipped; validation reports them
+class _CostWalker:
+    def __init__(self, schema, document, field_costs, variables):
+        self.schema = schema
+        self.field_costs = field_costs
+        self.variables = variables or {}
+        self.fragments = {node.name.value: node for node in document.definitions if isinstance(node, FragmentDefinitionNode)}
+        self.aliases = 0
+        self.depth = 0
+        self.fields = 0
+        # (fragment name, type name, depth) -> (cost, depth, aliases, fields) of the spreads walked
+        self._spreads = {}
+
+    # Returns the cost of a selection set on parent_type at the given depth
+    def selections(self, selection_set, parent_type, depth):
+        cost = 0
+        for selection in selection_set.selections if selection_set else ():
+            if isinstance(selection, FieldNode):
+                cost += self.field(selection, parent_type, depth)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = self._condition_type(selection, parent_type)
+                cost += self.selections(selection.selection_set, fragment_type, depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                cost += self.spread(selection, parent_type, depth)
+        return cost
+
+    # A fragment spread on a type at a depth always adds the same cost, depth, aliases and fields, so
+    # each one is walked once: fragments spreading the previous one twice would otherwise
+    # double the work at every level
+    def spread(self, node, parent_type, depth):
+        fragment = self.fragments.get(node.name.value)
+        if fragment is None:
+            return 0
+        fragment_type = self._condition_type(fragment, parent_type)
+        key = (node.name.value, fragment_type.name, depth)
+        if key not in self._spreads:
+            outer = self.depth, self.aliases, self.fields
+            self.depth = self.aliases = self.fields = 0
+            cost = self.selections(fragment.selection_set, fragment_type, depth)
+            self._spreads[key] = (cost, self.depth, self.aliases, self.fields)
+            self.depth, self.aliases, self.fields = outer
+        cost, reached, aliases, fields = self._spreads[key]
+        self.depth = max(self.depth, reached)
+        self.aliases += aliases
+        self.fields += fields
+        return cost
+
+    def _condition_type(self, node, parent_type):
+        if node.type_condition is None:
+            return parent_type
+        return self.schema.get_type(node.type_condition.name.value) or parent_type
+
+    # Introspection fields are walked like any other, so they count towards the depth limit
+    def _definition(self, parent_type, name):
+        if name == "__typename":
+            return TypeNameMetaFieldDef
+        if parent_type is self.schema.query_type and name in ("__schema", "__type"):
+            return SchemaMetaFieldDef if name == "__schema" else TypeMetaFieldDef
+        return (getattr(parent_type, "fields", None) or {}).get(name)
+
+    def field(self, node, parent_type, depth):
+        self.depth = max(self.depth, depth)
+        self.fields += 1
+        if node.alias is not None:
+            self.aliases += 1
+        definition = self._definition(parent_type, node.name.value)
+        if definition is None:
+            return 0
+        field_type = get_named_type(definition.type)
+        default = LEAF_COST if is_leaf_type(field_type) else OBJECT_COST
+        field_cost = self.field_costs.get(f"{parent_type.name}.{node.name.value}", default)
+        children = self.selections(node.selection_set, field_type, depth + 1)
+        return field_cost.cost + field_cost.times(node, self.variables) * children
+
+
+# Returns the QueryCost of the operation a request executes
+# Documents with fragment cycles are left to validation, which rejects them
+def analyze(schema, document, field_costs, variables=None, operation_name=None):
+    operation = find_operation(document, operation_name)
+    if operation is None:
+        return QueryCost()
+    root_type = schema.get_root_type(operation.operation)
+    if root_type is None:
+        return QueryCost()
+    walker = _CostWalker(schema, document, field_costs, variables)
+    if has_fragment_cycles(walker.fragments):
+        return QueryCost()
+    cost = walker.selections(operation.selection_set, root_type, 1)
+    return QueryCost(cost, walker.depth, walker.aliases, walker.fields)
+
+
+# Validation rule reporting the given errors, built for a single rejected request
+# The request fails whatever the other rules find, so DocumentCache.validate runs this rule
+# alone: the standard rules expand fragments at every use, which a document with too many
+# fields makes as slow as executing it
+def rejection_rule(errors):
+    class QueryComplexityRule(ValidationRule):
+        rejects_operation = True
+
+        def enter_document(self, *_):
+            for error in errors:
+                self.report_error(error)
+    return QueryComplexityRule
+
+
+class QueryCostLimiter:
+    def __init__(self, schema, field_costs, max_cost=2000, max_depth=15, max_aliases=30, max_fields=2000, registry=None):
+        self.schema = schema
+        self.field_costs = field_costs
+        self.max_cost = max_cost
+        self.max_depth = max_depth
+        self.max_aliases = max_aliases
+        self.max_fields = max_fields
+        self.costs = self.rejections = None
+        if registry is not None:
+            self.costs = Histogram('graphql_query_cost', 'Static cost of the GraphQL operations received', buckets=COST_BUCKETS, registry=registry)
+            self.rejections = Counter('graphql_query_rejections_total', 'GraphQL operations rejected before execution', ['reason'], registry=registry)
+
+    # Returns the GraphQL errors of an operation breaking a limit
+    def check(self, document, variables=None, operation_name=None):
+        report = analyze(self.schema, document, self.field_costs, variables, operation_name)
+        if self.costs is not None:
+            self.costs.observe(report.cost)
+        errors = []
+        if report.cost > self.max_cost:
+            errors.append(self._error("cost", f"Query cost {report.cost} exceeds the maximum of {self.max_cost}", report))
+        if report.depth > self.max_depth:
+            errors.append(self._error("depth", f"Query depth {report.depth} exceeds the maximum of {self.max_depth}", report))
+        if report.aliases > self.max_aliases:
+            errors.append(self._error("aliases", f"Query uses {report.aliases} aliases, the maximum is {self.max_aliases}", report))
+        if report.fields > self.max_fields:
+            errors.append(self._error("fields", f"Query selects {report.fields} fields, the maximum is {self.max_fields}", report))
+        return errors
+
+    def _error(self, reason, message, report):
+        if self.rejections is not None:
+            self.rejections.labels(reason=reason).inc()
+        return GraphQLError(message, extensions={
+            "code": QUERY_TOO_COMPLEX, "cost": report.cost, "depth": report.depth, "aliases": report.aliases,
+            "fields": report.fields
+        })
+
+    # Ariadne validation_rules hook, called for every request with its parsed document
+    # Returns no extra rule for operations within the limits, so their validation stays cached
+    def validation_rules(self, context_value, document, data):
+        errors = self.check(document, data.get("variables"), data.get("operationName"))
+        return [rejection_rule(errors)] if errors else []
@@ -0,0 +1,28 @@
+from pymongo import ReturnDocument
+
+# Version of the recipes collection, shared by every worker through MongoDB
+# The search and nutrition indexes are kept in each process. Every write to the recipes bumps
+# this counter once the write is done, and the indexes remember the version they were built
+# at, so a read that finds another version rebuilds them and sees the recipes written through
+# other workers. A worker applies its own writes to its indexes and, when its bump is the only
+# one since, moves them to the new version without a rebuild.
+
+VERSIONS_COLLECTION = "recipe_versions"
+VERSION_QUERY = {"_id": "recipes"}
+BUMP_UPDATE = {"$inc": {"version": 1}}
+
+
+# Version held by the counter document, 0 before the first write
+def version_of(document):
+    return document["version"] if document else 0
+
+
+def current_version(db):
+    return version_of(db[VERSIONS_COLLECTION].find_one(VERSION_QUERY))
+
+
+# Bumps the version after a write and returns the new one
+def bump_version(db):
+    return version_of(db[VERSIONS_COLLECTION].find_one_and_update(
+        VERSION_QUERY, BUMP_UPDATE, upsert=True, return_document=ReturnDocument.AFTER
+    ))
@@ -0,0 +1,165 @@
+import heapq
+import math
+import re
+import threading
+import time
+
+# In-process full-text index over recipe names and ingredient item names
+# Recipes are keyed by recipeName (unique in the collection). The index is built from the
+# collection on first use, kept up to date by the recipe mutations of this process, and
+# rebuilt when the shared recipes version shows a write made by another process (see
+# recipe_versions.py), or every refresh_seconds for writes made outside the service
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# A query token found in the recipe name counts more than one found in an ingredient
+NAME_WEIGHT = 2.0
+INGREDIENT_WEIGHT = 1.0
+
+# Fields kept in memory so search results are served without a database round trip
+RECIPE_FIELDS = ("recipeName", "ingredients", "calories", "nutrients")
+RECIPE_PROJECTION = dict({field: 1 for field in RECIPE_FIELDS}, _id=0)
+
+DEFAULT_RESULTS = 10
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text or "").lower())
+
+
+# Returns {token: weight} for one recipe
+def recipe_terms(recipe):
+    terms = {}
+    for item in recipe.get("ingredients") or []:
+        for token in tokenize((item or {}).get("itemName")):
+            terms[token] = INGREDIENT_WEIGHT
+    for token in tokenize(recipe.get("recipeName")):
+        terms[token] = NAME_WEIGHT
+    return terms
+
+
+class RecipeSearchIndex:
+    def __init__(self, refresh_seconds=300, clock=time.monotonic):
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        # token -> {recipeName: weight}
+        self._postings = {}
+        # recipeName -> (recipe, terms)
+        self._recipes = {}
+        self._built_at = None
+        # Version of the recipes collection the index was built at, see recipe_versions.py
+        self._version = None
+        self._builds = 0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._recipes)
+
+    # Forces a rebuild on the next search, e.g. after a bulk import
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def needs_build(self, version=None):
+        return (
+            self._built_at is None or version != self._version
+            or self.clock() - self._built_at >= self.refresh_seconds
+        )
+
+    # Taken before a write of this process, and passed to advance once it is bumped
+    def state(self):
+        with self._lock:
+            return self._builds, self._version
+
+    # Moves the index to the version bumped by a write of this process, already applied with
+    # add or remove, unless the index was rebuilt or another write was bumped in between
+    def advance(self, state, version):
+        with self._lock:
+            if state == (self._builds, self._version) and self._version is not None and version == self._version + 1:
+                self._version = version
+
+    # Replaces the index content with the given recipes
+    def build(self, recipes, version=None):
+        postings = {}
+        indexed = {}
+        for recipe in recipes:
+            if not recipe.get("recipeName"):
+                continue
+            name = recipe["recipeName"]
+            terms = recipe_terms(recipe)
+            indexed[name] = ({field: recipe.get(field) for field in RECIPE_FIELDS}, terms)
+            for token, weight in terms.items():
+                postings.setdefault(token, {})[name] = weight
+        with self._lock:
+            self._postings = postings
+            self._recipes = indexed
+            self._built_at = self.clock()
+            self._version = version
+            self._builds += 1
+
+    # Builds the index from the recipes collection when it is missing, behind the given version
+    # of the recipes or due for a refresh
+    # Searches keep using the previous index while it is rebuilt
+    def ensure_built(self, collection, version=None):
+        if not self.needs_build(version):
+            return
+        with self._build_lock:
+            if self.needs_build(version):
+                self.build(collection.find({}, RECIPE_PROJECTION), version)
+
+    def add(self, recipe):
+        with self._lock:
+            if self._built_at is None or not recipe.get("recipeName"):
+                return
+            self.remove(recipe["recipeName"])
+            name = recipe["recipeName"]
+            terms = recipe_terms(recipe)
+            self._recipes[name] = ({field: recipe.get(field) for field in RECIPE_FIELDS}, terms)
+            for token, weight in terms.items():
+                self._postings.setdefault(token, {})[name] = weight
+
+    def remove(self, recipe_name):
+        with self._lock:
+            entry = self._recipes.pop(recipe_name, None)
+            if entry is None:
+                return
+            for token in entry[1]:
+                postings = self._postings.get(token)
+                postings.pop(recipe_name, None)
+                if not postings:
+                    del self._postings[token]
+
+    # Returns up to limit (recipe, score) pairs containing every query token, best first
+    # Scores sum the field weight times the inverse document frequency of each token; ties
+    # are ordered by recipe name
+    def search(self, query, limit):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return []
+            total = len(self._recipes)
+            postings.sort(key=len)
+            scores = {}
+            for name in postings[0]:
+                if all(name in token_postings for token_postings in postings[1:]):
+                    scores[name] = sum(
+                        token_postings[name] * math.log(1 + total / len(token_postings))
+                        for token_postings in postings
+                    )
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+            return [(self._recipes[name][0], round(score, 4)) for name, score in ranked]
+
+
+# SearchRecipesResult payload for the ranked (recipe, score) hits of searchRecipes
+def build_search_payload(hits):
+    return {
+        "success": True,
+        "source": "local",
+        "results": [recipe for recipe, _ in hits],
+        "scores": [score for _, score in hits],
+        "external": []
+    }
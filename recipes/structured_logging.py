@@ -0,0 +1,202 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from prometheus_client import Counter
+
+# Logging for the request paths: structured, lazily formatted, sampled and written off the
+# request thread
+# configure_logging installs a QueueHandler on the root logger: a request thread only puts
+# the record on a bounded queue, and a listener thread formats and writes it. Messages use
+# %-style arguments so they are only formatted when written, Summary stands in for large
+# payloads (counts instead of bodies), and SamplingFilter keeps a fraction of the INFO and
+# DEBUG records of chosen loggers. Warnings and errors are never sampled out.
+#
+#     logger.info("Stats resolved", extra={"results": len(results)})
+#     logger.info("Resolver payload: %s", Summary(payload))
+
+FORMATS = ("json", "text")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+MAX_STRING_LENGTH = 100
+MAX_KEYS = 20
+MAX_DEPTH = 2
+
+# Attributes every LogRecord has; the others come from extra= and are written as fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+# Size-capped summary of a payload: lists become their length, strings are cut, and nested
+# documents are summarized down to MAX_DEPTH levels and MAX_KEYS keys
+def summarize(value, depth=0):
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return {"keys": len(value)}
+        summary = {str(key): summarize(item, depth + 1) for key, item in list(value.items())[:MAX_KEYS]}
+        if len(value) > MAX_KEYS:
+            summary["..."] = len(value) - MAX_KEYS
+        return summary
+    if isinstance(value, (list, tuple, set)):
+        return {"count": len(value)}
+    if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+        return value[:MAX_STRING_LENGTH] + "..."
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return type(value).__name__
+
+
+# Log argument summarizing a payload only when the record is written
+class Summary:
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return summarize(self.value)
+
+    def __str__(self):
+        return json.dumps(self.to_dict(), default=str)
+
+
+def _field(value):
+    return value.to_dict() if isinstance(value, Summary) else value
+
+
+# One JSON object per line: time, level, logger, message, the extra= fields and the traceback
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = _field(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Keeps rate (0 to 1) of the records below WARNING of the loggers in rates, by logger name;
+# a rate applies to the logger's children unless they have their own
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates, sample=random.random):
+        super().__init__()
+        self.rates = dict(rates)
+        self.sample = sample
+
+    def rate(self, name):
+        while True:
+            if name in self.rates:
+                return self.rates[name]
+            if "." not in name:
+                return 1.0
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or self.sample() < rate
+
+
+# Returns {logger name: rate} from a LOG_SAMPLING setting, e.g. "app=0.1,werkzeug=0.01"
+def parse_sampling(value):
+    rates = {}
+    for item in (value or "").split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+# QueueHandler that hands records over unformatted and drops them when the queue is full
+# The standard QueueHandler formats the message on the calling thread so records can be
+# pickled; here the queue never leaves the process, so formatting is left to the listener.
+# Arguments logged should therefore not be mutated after the call.
+class AsyncQueueHandler(QueueHandler):
+    def __init__(self, log_queue, dropped=None):
+        super().__init__(log_queue)
+        self.dropped = dropped
+        self.dropped_count = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+            if self.dropped is not None:
+                self.dropped.inc()
+
+
+# Writes the queued records from a background thread; the thread is started by start() and
+# restarted after a fork by restart(), since threads do not survive fork
+class AsyncLogging:
+    def __init__(self, handler, target):
+        self.handler = handler
+        self.target = target
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.listener is None:
+                self.listener = QueueListener(self.handler.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+
+    def stop(self):
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    # In a forked child the listener of the parent is gone; its queue is replaced since it may
+    # hold records and locks taken by the parent's threads
+    def restart(self):
+        self.handler.queue = queue.Queue(self.handler.queue.maxsize)
+        self._lock = threading.Lock()
+        self.listener = None
+        self.start()
+
+
+def create_formatter(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported log format: {fmt}")
+    return JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+# Configures the root logger of a service
+# With asynchronous=True records are written by a listener thread, otherwise directly by the
+# logging thread; returns the AsyncLogging, or None for synchronous logging
+def configure_logging(level="INFO", fmt="json", sampling=None, asynchronous=True, queue_size=10000, registry=None, stream=None):
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(create_formatter(fmt))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    handler, async_logging = target, None
+    if asynchronous:
+        dropped = None
+        if registry is not None:
+            dropped = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full', registry=registry)
+        handler = AsyncQueueHandler(queue.Queue(queue_size), dropped)
+        async_logging = AsyncLogging(handler, target)
+        async_logging.start()
+        atexit.register(async_logging.stop)
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    root.addHandler(handler)
+    return async_logging
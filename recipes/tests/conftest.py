@@ -1,8 +1,13 @@
+import os
 from unittest.mock import patch
 
 import mongomock
 import pytest
 
+# test_recipes.py imports the app before MongoClient is patched; creating indexes at import
+# would then wait for a real server, tests that need indexes create them on mongomock
+os.environ.setdefault('ENSURE_INDEXES', 'false')
+
 
 @pytest.fixture(scope='session')
 def mock_mongo():
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("motor")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def asgi_client(mock_mongo, monkeypatch):
+    import asgi
+    monkeypatch.setattr("asgi.AsyncIOMotorClient", mongomock_motor.AsyncMongoMockClient)
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_asgi_add_and_page_recipes(asgi_client):
+    """Test the async addRecipe mutation and recipes query."""
+
+    mutation = """
+    mutation {
+      addRecipe(recipe: { recipeName: "Curry", ingredients: [{ itemName: "rice", amount: 200 }], calories: 700 }) {
+        success
+        recipe { recipeName }
+      }
+    }
+    """
+    response = asgi_client.post('/recipes/graphql', json={'query': mutation})
+    assert response.json()['data']['addRecipe']['success'] is True
+
+    query = """
+    query {
+        recipes(first: 1) {
+            success
+            totalCount
+            results { recipeName calories }
+            pageInfo { hasNextPage }
+        }
+    }
+    """
+    response = asgi_client.post('/recipes/graphql', json={'query': query})
+    recipes = response.json()['data']['recipes']
+    assert recipes['success'] is True
+    assert recipes['totalCount'] == 1
+    assert recipes['results'] == [{"recipeName": "Curry", "calories": 700}]
+    assert recipes['pageInfo']['hasNextPage'] is False
+
+
+def test_asgi_bulk_recipe_mutations(asgi_client):
+    """Test the async addRecipes and removeRecipes mutations."""
+
+    mutation = """
+    mutation {
+      addRecipes(recipes: [{ recipeName: "Dal", ingredients: [] }, { recipeName: "Naan", ingredients: [] }]) {
+        success succeeded
+      }
+    }
+    """
+    response = asgi_client.post('/recipes/graphql', json={'query': mutation})
+    assert response.json()['data']['addRecipes'] == {"success": True, "succeeded": 2}
+
+    mutation = 'mutation { removeRecipes(recipeNames: ["Dal", "Rice"]) { succeeded failed } }'
+    response = asgi_client.post('/recipes/graphql', json={'query': mutation})
+    assert response.json()['data']['removeRecipes'] == {"succeeded": 1, "failed": 1}
+
+
+def test_asgi_nutrient_filters(asgi_client):
+    """Test the async calorie range filter and topRecipesByNutrient."""
+    import asgi
+    asgi.nutrition_index.invalidate()
+
+    mutation = """
+    mutation {
+      addRecipes(recipes: [
+        { recipeName: "Eggs", ingredients: [], calories: 200, nutrients: [{ nutrient: "Protein", amount: 12 }] },
+        { recipeName: "Lasagne", ingredients: [], calories: 900, nutrients: [{ nutrient: "Protein", amount: 45 }] }
+      ]) { success }
+    }
+    """
+    asgi_client.post('/recipes/graphql', json={'query': mutation})
+
+    query = 'query { recipes(filter: { caloriesMax: 500 }) { totalCount results { recipeName } } }'
+    recipes = asgi_client.post('/recipes/graphql', json={'query': query}).json()['data']['recipes']
+    assert recipes == {"totalCount": 1, "results": [{"recipeName": "Eggs"}]}
+
+    query = 'query { topRecipesByNutrient(nutrient: "Protein", first: 1) { results { recipeName } } }'
+    top = asgi_client.post('/recipes/graphql', json={'query': query}).json()['data']['topRecipesByNutrient']
+    assert top['results'] == [{"recipeName": "Lasagne"}]
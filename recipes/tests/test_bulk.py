@@ -0,0 +1,46 @@
+import io
+
+import mongomock
+import pytest
+
+import bulk
+import indexes
+
+
+@pytest.fixture
+def recipes_collection():
+    db = mongomock.MongoClient()['bulk_test']
+    indexes.ensure_indexes(db)
+    return db.recipes
+
+
+def test_chunked_keeps_offsets():
+    assert list(bulk.chunked(range(5), 2)) == [(0, [0, 1]), (2, [2, 3]), (4, [4])]
+
+
+def test_insert_recipes_reports_each_recipe_across_chunks(recipes_collection):
+    recipes = [{"recipeName": "A"}, {"calories": 100}, {"recipeName": "B"}, {"recipeName": "A"}, {"recipeName": "C"}]
+    results = bulk.insert_recipes(recipes_collection, recipes, chunk_size=2)
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert [result["error"] for result in results] == [
+        None, "recipeName is required", None, "Recipe already exists", None
+    ]
+    assert recipes_collection.count_documents({}) == 3
+
+
+def test_remove_recipes_reports_missing_and_repeated_names(recipes_collection):
+    recipes_collection.insert_many([{"recipeName": "A"}, {"recipeName": "B"}])
+    results = bulk.remove_recipes(recipes_collection, ["A", "X", "A", "B"], chunk_size=3)
+    assert [result["success"] for result in results] == [True, False, False, True]
+    assert recipes_collection.count_documents({}) == 0
+
+
+def test_read_recipes_accepts_json_arrays_only():
+    file = io.StringIO('[{"recipeName": "A"}]')
+    file.name = "recipes.json"
+    assert list(bulk.read_recipes(file)) == [{"recipeName": "A"}]
+
+    file = io.StringIO('{"recipeName": "A"}')
+    file.name = "recipes.json"
+    with pytest.raises(ValueError):
+        list(bulk.read_recipes(file))
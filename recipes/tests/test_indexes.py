@@ -0,0 +1,56 @@
+import os
+
+import mongomock
+import pytest
+
+import bulk
+import indexes
+import pagination
+
+
+def test_ensure_indexes_is_idempotent():
+    db = mongomock.MongoClient()['indexes_test']
+    indexes.ensure_indexes(db)
+    indexes.ensure_indexes(db)
+    assert db.recipes.index_information()["recipeName"]["unique"] is True
+
+
+def test_find_collscans_ignores_rejected_plans():
+    plan = {"queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "recipeName"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}]
+    }}
+    assert indexes.find_collscans(plan) == []
+    assert len(indexes.find_collscans({"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}})) == 1
+
+
+def test_hot_path_queries_are_the_issued_ones():
+    db = mongomock.MongoClient()['indexes_test']
+    db.recipes.insert_one({"recipeName": "recipe"})
+    commands = dict(indexes.hot_path_queries())
+    for command in commands.values():
+        if "find" in command:
+            cursor = db[command["find"]].find(command["filter"])
+            if "sort" in command:
+                cursor = cursor.sort(list(command["sort"].items()))
+            list(cursor)
+        else:
+            db[command["count"]].count_documents(command["query"])
+    assert commands["recipe by name"]["filter"] == pagination.build_recipe_query({"recipeName": "recipe"})
+    assert commands["bulk recipes by name"]["filter"] == bulk.names_query(["recipe", "other recipe"])
+
+
+# Query plans can only be checked against a real MongoDB; CI runs this against a MongoDB
+# service container (see .github/workflows/deploy_develop.yml), locally e.g.
+# MONGO_TEST_URI=mongodb://localhost:27017 poetry run pytest tests/test_indexes.py
+@pytest.mark.skipif(not os.getenv('MONGO_TEST_URI'), reason="MONGO_TEST_URI is not set")
+def test_hot_path_queries_do_not_collscan():
+    from pymongo import MongoClient
+
+    client = MongoClient(os.getenv('MONGO_TEST_URI'))
+    db = client['recipes_index_test']
+    try:
+        indexes.ensure_indexes(db)
+        assert indexes.check_query_plans(db) == []
+    finally:
+        client.drop_database('recipes_index_test')
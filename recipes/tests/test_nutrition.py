@@ -0,0 +1,74 @@
+from bson import ObjectId
+
+import nutrition
+from nutrition import NutritionIndex
+
+
+def recipe(name, calories, **nutrients):
+    return {
+        "_id": ObjectId(),
+        "recipeName": name,
+        "calories": calories,
+        "nutrients": [{"nutrient": nutrient, "amount": amount} for nutrient, amount in nutrients.items()]
+    }
+
+
+RECIPES = [
+    recipe("Omelette", 350, Protein=25, Fat=20),
+    recipe("Chicken Salad", 450, Protein=40, Fat=10),
+    recipe("Steak", 700, Protein=60, Fat=35),
+    recipe("Fruit Bowl", 200, Fat=1),
+    recipe("Mystery", None, Protein=5),
+]
+
+
+def names(ids):
+    by_id = {item["_id"]: item["recipeName"] for item in RECIPES}
+    return [by_id[object_id] for object_id in ids]
+
+
+def built_index():
+    index = NutritionIndex()
+    index.build(RECIPES)
+    return index
+
+
+def test_range_filters_intersect_columns():
+    index = built_index()
+    assert names(index.match({"caloriesMax": 500})) == ["Omelette", "Chicken Salad", "Fruit Bowl"]
+    assert names(index.match({"caloriesMax": 500, "nutrientMin": [{"nutrient": "Protein", "amount": 30}]})) == ["Chicken Salad"]
+    assert names(index.match({"caloriesMin": 350, "caloriesMax": 450})) == ["Omelette", "Chicken Salad"]
+    assert index.match({"nutrientMin": [{"nutrient": "Fibre", "amount": 1}]}) == []
+
+
+def test_top_by_nutrient_respects_filter():
+    index = built_index()
+    assert names(index.top("Protein", 2)) == ["Steak", "Chicken Salad"]
+    assert names(index.top("Protein", 5, {"caloriesMax": 500})) == ["Chicken Salad", "Omelette"]
+    assert index.top("Fibre", 5) == []
+
+
+def test_add_and_remove_keep_columns_sorted():
+    index = built_index()
+    shake = recipe("Protein Shake", 300, Protein=50)
+    index.add(shake)
+    assert index.top("Protein", 2)[1] == shake["_id"]
+    assert shake["_id"] in index.match({"caloriesMax": 300})
+    index.remove("Steak")
+    index.remove("Protein Shake")
+    assert names(index.top("Protein", 1)) == ["Chicken Salad"]
+    assert names(index.match({"caloriesMin": 600})) == []
+
+
+def test_range_query_matches_the_index():
+    query = nutrition.range_query({"caloriesMax": 500, "nutrientMin": [{"nutrient": "Protein", "amount": 30}]})
+    assert query == {
+        "calories": {"$lte": 500},
+        "nutrients": {"$all": [{"$elemMatch": {"nutrient": "Protein", "amount": {"$gte": 30}}}]}
+    }
+
+
+def test_page_ids_starts_after_the_cursor():
+    ids = sorted(item["_id"] for item in RECIPES)
+    assert nutrition.page_ids(ids, None, 2) == ids[:2]
+    assert nutrition.page_ids(ids, ids[1], 2) == ids[2:4]
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from bson import ObjectId
+from graphql import parse
+from graphql.language import FragmentDefinitionNode, OperationDefinitionNode
+import pytest
+
+import pagination
+
+
+def _info(document):
+    # Minimal stand-in for GraphQLResolveInfo built from a query string
+    ast = parse(document)
+    operation = next(d for d in ast.definitions if isinstance(d, OperationDefinitionNode))
+    fragments = {d.name.value: d for d in ast.definitions if isinstance(d, FragmentDefinitionNode)}
+    return SimpleNamespace(field_nodes=[operation.selection_set.selections[0]], fragments=fragments)
+
+
+def test_recipe_projection_follows_selection_set():
+    info = _info("""
+    query {
+        recipes {
+            totalCount
+            results { recipeName }
+            edges { node { ...RecipeCalories } }
+        }
+    }
+    fragment RecipeCalories on Recipe { calories }
+    """)
+    assert pagination.recipe_projection(info) == {"recipeName": 1, "calories": 1, "_id": 1}
+
+
+def test_cursor_round_trip():
+    object_id = ObjectId()
+    assert pagination.decode_cursor(pagination.encode_cursor(object_id)) == object_id
+    with pytest.raises(ValueError):
+        pagination.decode_cursor("bm90LWEtcmVjaXBl")
+
+
+def test_page_size_bounds():
+    assert pagination.page_size(None) is None
+    assert pagination.fetch_size(None) == 0 and pagination.fetch_size(10) == 11
+    with pytest.raises(ValueError):
+        pagination.page_size(pagination.MAX_PAGE_SIZE + 1)
@@ -5,6 +5,7 @@ import mongomock
 import pytest
 from ariadne import load_schema_from_path
 
+import pagination
 from app import app
 
 
@@ -145,3 +146,265 @@ def test_schema_loading():
     # Check schema loaded as expected
     assert type_defs is not None, "Type definitions are not loaded."
     assert "schema {" in type_defs, "Schema definition is missing."
+
+
+def test_graphql_recipes_pagination(client, mock_mongo):
+    """Test paging through recipes with first/after and the totalCount field."""
+
+    query = """
+    query Recipes($first: Int, $after: String) {
+        recipes(first: $first, after: $after) {
+            success
+            totalCount
+            edges {
+                cursor
+                node {
+                    recipeName
+                }
+            }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+        }
+    }
+    """
+
+    mock_mongo['recipes'].recipes.insert_many([
+        {"recipeName": name, "ingredients": [], "calories": 100} for name in ("Soup", "Salad", "Stew")
+    ])
+
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'first': 2}})
+    page = json.loads(response.data)['data']['recipes']
+    assert page['success'] is True
+    assert page['totalCount'] == 3
+    assert [edge['node']['recipeName'] for edge in page['edges']] == ["Soup", "Salad"]
+    assert page['pageInfo']['hasNextPage'] is True
+
+    variables = {'first': 2, 'after': page['pageInfo']['endCursor']}
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': variables})
+    page = json.loads(response.data)['data']['recipes']
+    assert [edge['node']['recipeName'] for edge in page['edges']] == ["Stew"]
+    assert page['pageInfo']['hasNextPage'] is False
+
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'after': 'not-a-cursor'}})
+    page = json.loads(response.data)['data']['recipes']
+    assert page['success'] is False
+
+
+def test_graphql_recipes_without_first_returns_every_recipe(client, mock_mongo):
+    """Test that clients sending no 'first', like the frontend, still get the whole collection."""
+    mock_mongo['recipes'].recipes.insert_many([
+        {"recipeName": f"Recipe {number}", "ingredients": []} for number in range(pagination.DEFAULT_PAGE_SIZE + 5)
+    ])
+    response = client.post('/recipes/graphql', json={'query': '{ recipes { results { recipeName } pageInfo { hasNextPage } } }'})
+    page = json.loads(response.data)['data']['recipes']
+    assert len(page['results']) == pagination.DEFAULT_PAGE_SIZE + 5
+    assert page['pageInfo']['hasNextPage'] is False
+
+
+def test_graphql_persisted_query(client, mock_mongo):
+    """Test that a registered persisted query can be executed by its hash only."""
+    from graphql_cache import query_hash
+
+    query = "query { recipes { success } }"
+    extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+
+    response = client.post('/recipes/graphql', json={'extensions': extensions})
+    assert json.loads(response.data)['errors'][0]['message'] == "PersistedQueryNotFound"
+
+    client.post('/recipes/graphql', json={'query': query, 'extensions': extensions})
+    response = client.post('/recipes/graphql', json={'extensions': extensions})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['recipes']['success'] is True
+
+
+def test_graphql_bulk_recipe_mutations(client, mock_mongo):
+    """Test addRecipes/removeRecipes with per-recipe results."""
+    import indexes
+    indexes.ensure_indexes(mock_mongo['recipes'])
+
+    mutation = """
+    mutation AddRecipes($recipes: [RecipeInput!]!) {
+      addRecipes(recipes: $recipes) {
+        success succeeded failed
+        results { index recipeName success error }
+      }
+    }
+    """
+    recipes = [{"recipeName": name, "ingredients": []} for name in ("Soup", "Salad", "Soup")]
+    response = client.post('/recipes/graphql', json={'query': mutation, 'variables': {'recipes': recipes}})
+    added = json.loads(response.data)['data']['addRecipes']
+    assert added['success'] is False
+    assert (added['succeeded'], added['failed']) == (2, 1)
+    assert added['results'][2] == {"index": 2, "recipeName": "Soup", "success": False, "error": "Recipe already exists"}
+    assert mock_mongo['recipes'].recipes.count_documents({}) == 2
+
+    mutation = """
+    mutation RemoveRecipes($names: [String!]!) {
+      removeRecipes(recipeNames: $names) { success succeeded failed results { recipeName error } }
+    }
+    """
+    response = client.post('/recipes/graphql', json={'query': mutation, 'variables': {'names': ["Salad", "Stew"]}})
+    removed = json.loads(response.data)['data']['removeRecipes']
+    assert (removed['succeeded'], removed['failed']) == (1, 1)
+    assert removed['results'][1] == {"recipeName": "Stew", "error": "Recipe not found"}
+    assert mock_mongo['recipes'].recipes.count_documents({}) == 1
+
+
+def test_import_recipes_command(mock_mongo, tmp_path):
+    """Test the import-recipes CLI command with an NDJSON file."""
+    path = tmp_path / "recipes.ndjson"
+    path.write_text("\n".join(json.dumps({"recipeName": f"Recipe {n}", "ingredients": []}) for n in range(25)))
+
+    result = app.test_cli_runner().invoke(args=["import-recipes", str(path), "--chunk-size", "10"])
+    assert result.exit_code == 0, result.output
+    assert "Imported 25 recipes, 0 failed" in result.output
+    assert mock_mongo['recipes'].recipes.count_documents({}) == 25
+
+
+def test_graphql_search_recipes(client, mock_mongo, monkeypatch):
+    """Test searchRecipes ranking and the Spoonacular fallthrough on misses."""
+    import app as recipes_app
+    recipes_app.search_index.invalidate()
+    mock_mongo['recipes'].recipes.insert_one({"recipeName": "Lentil Soup", "ingredients": [{"itemName": "lentils"}]})
+
+    add = 'mutation { addRecipe(recipe: { recipeName: "Lentil Curry", ingredients: [{ itemName: "rice" }] }) { success } }'
+    client.post('/recipes/graphql', json={'query': add})
+
+    query = """
+    query Search($query: String!) {
+        searchRecipes(query: $query, first: 5, includeExternal: true) {
+            success source results { recipeName } external { title }
+        }
+    }
+    """
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'query': 'lentil'}})
+    found = json.loads(response.data)['data']['searchRecipes']
+    assert found['source'] == "local"
+    assert [recipe['recipeName'] for recipe in found['results']] == ["Lentil Curry", "Lentil Soup"]
+
+    monkeypatch.setattr(recipes_app, "get_recipe_collection", lambda recipe, count: {"results": [{"title": "Ramen"}]})
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'query': 'ramen'}})
+    found = json.loads(response.data)['data']['searchRecipes']
+    assert found['source'] == "spoonacular"
+    assert found['results'] == [] and found['external'] == [{"title": "Ramen"}]
+
+
+def test_graphql_search_sees_recipes_added_by_other_workers(client, mock_mongo):
+    """Test that recipes written by another worker are searchable once it bumps the recipes version."""
+    import app as recipes_app
+    import recipe_versions
+    recipes_app.search_index.invalidate()
+    query = '{ searchRecipes(query: "miso") { results { recipeName } } }'
+
+    def found():
+        response = client.post('/recipes/graphql', json={'query': query})
+        return [recipe['recipeName'] for recipe in json.loads(response.data)['data']['searchRecipes']['results']]
+
+    assert found() == []
+    add = 'mutation { addRecipe(recipe: { recipeName: "Miso Soup", ingredients: [{ itemName: "miso" }] }) { success } }'
+    client.post('/recipes/graphql', json={'query': add})
+    # This worker's own write is applied in place, without a rebuild
+    builds = recipes_app.search_index.state()[0]
+    assert found() == ["Miso Soup"]
+    assert recipes_app.search_index.state()[0] == builds
+
+    # Another worker's write only shows through the shared version
+    mock_mongo['recipes'].recipes.insert_one({"recipeName": "Miso Ramen", "ingredients": [{"itemName": "miso"}]})
+    recipe_versions.bump_version(mock_mongo['recipes'])
+    assert sorted(found()) == ["Miso Ramen", "Miso Soup"]
+
+
+def test_graphql_recipes_nutrient_filters(client, mock_mongo):
+    """Test calorie/nutrient range filters and topRecipesByNutrient."""
+    import app as recipes_app
+    recipes_app.nutrition_index.invalidate()
+    mock_mongo['recipes'].recipes.insert_many([
+        {"recipeName": name, "ingredients": [], "calories": calories, "nutrients": [{"nutrient": "Protein", "amount": protein}]}
+        for name, calories, protein in (("Tofu Bowl", 450, 30), ("Steak", 800, 60), ("Porridge", 300, 10), ("Chicken Wrap", 480, 35))
+    ])
+
+    query = """
+    query Recipes($filter: RecipeFilter, $after: String) {
+        recipes(first: 1, after: $after, filter: $filter) {
+            success totalCount results { recipeName } pageInfo { hasNextPage endCursor }
+        }
+    }
+    """
+    variables = {'filter': {'caloriesMax': 500, 'nutrientMin': [{'nutrient': 'Protein', 'amount': 30}]}}
+    page = json.loads(client.post('/recipes/graphql', json={'query': query, 'variables': variables}).data)['data']['recipes']
+    assert page['totalCount'] == 2
+    assert page['results'] == [{"recipeName": "Tofu Bowl"}]
+    assert page['pageInfo']['hasNextPage'] is True
+
+    variables['after'] = page['pageInfo']['endCursor']
+    page = json.loads(client.post('/recipes/graphql', json={'query': query, 'variables': variables}).data)['data']['recipes']
+    assert page['results'] == [{"recipeName": "Chicken Wrap"}]
+    assert page['pageInfo']['hasNextPage'] is False
+
+    add = 'mutation { addRecipe(recipe: { recipeName: "Shake", ingredients: [], calories: 250, nutrients: [{ nutrient: "Protein", amount: 40 }] }) { success } }'
+    client.post('/recipes/graphql', json={'query': add})
+    top = 'query { topRecipesByNutrient(nutrient: "Protein", first: 2, filter: { caloriesMax: 500 }) { results { recipeName } } }'
+    results = json.loads(client.post('/recipes/graphql', json={'query': top}).data)['data']['topRecipesByNutrient']['results']
+    assert [recipe['recipeName'] for recipe in results] == ["Shake", "Chicken Wrap"]
+
+
+def test_graphql_query_cost_limits(client, mock_mongo):
+    """Test that oversized pages and deeply aliased queries are rejected before execution."""
+
+    query = "query($first: Int) { recipes(first: $first) { success results { recipeName ingredients { itemName } } } }"
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'first': 100000}})
+    assert response.status_code == 400
+    error = json.loads(response.data)['errors'][0]
+    assert error['extensions']['code'] == "QUERY_TOO_COMPLEX"
+    assert "cost" in error['message']
+
+    response = client.post('/recipes/graphql', json={'query': query, 'variables': {'first': 500}})
+    assert response.status_code == 200
+
+    aliases = " ".join(f'r{index}: recipes(first: 1) {{ success }}' for index in range(31))
+    response = client.post('/recipes/graphql', json={'query': '{ %s }' % aliases})
+    assert response.status_code == 400
+    assert "aliases" in json.loads(response.data)['errors'][0]['message']
+
+    # Fragment cycles are reported by validation, and fragments spread at every level of a
+    # nesting are counted once per spread without walking them again
+    cycle = '{ __type(name: "Query") { ...F } } fragment F on __Type { fields { type { ...F } } }'
+    response = client.post('/recipes/graphql', json={'query': cycle})
+    assert response.status_code == 400
+    assert "within itself" in json.loads(response.data)['errors'][0]['message']
+
+    nested = ["fragment L0 on __Type { name }"] + [
+        f"fragment L{level} on __Type {{ name ...L{level - 1} ...L{level - 1} }}" for level in range(1, 31)
+    ]
+    response = client.post('/recipes/graphql', json={'query': '{ __type(name: "Query") { ...L30 } } ' + " ".join(nested)})
+    assert response.status_code == 400
+    assert "fields" in json.loads(response.data)['errors'][0]['message']
+
+
+def test_resolver_metrics(client, mock_mongo):
+    """Test that the GraphQL resolvers are timed per field and operation on /metrics."""
+
+    response = client.post('/recipes/graphql', json={'query': 'query Page { recipes(first: 1) { success totalCount } }'})
+    assert response.status_code == 200
+    metrics = client.get('/metrics').data.decode()
+    assert 'graphql_resolver_duration_seconds_count{field="Query.recipes",operation="Page"} 1.0' in metrics
+    assert 'graphql_resolver_duration_seconds_count{field="RecipesResult.totalCount",operation="Page"} 1.0' in metrics
+
+
+def test_graphql_response_compression(client, mock_mongo):
+    """Test that large GraphQL responses are gzip-compressed for clients accepting it."""
+    import gzip
+
+    mock_mongo['recipes'].recipes.insert_many([
+        {"recipeName": f"Recipe {number}", "ingredients": [{"itemName": "salt", "amount": 1}], "calories": number}
+        for number in range(50)
+    ])
+    query = {'query': '{ recipes(first: 50) { edges { node { recipeName ingredients { itemName amount } } } } }'}
+    plain = client.post('/recipes/graphql', json=query)
+    compressed = client.post('/recipes/graphql', json=query, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(compressed.data)) == json.loads(plain.data)
+    assert len(json.loads(plain.data)['data']['recipes']['edges']) == 50
@@ -0,0 +1,85 @@
+import mongomock
+
+from search import RecipeSearchIndex, tokenize
+
+RECIPES = [
+    {"recipeName": "Tomato Soup", "ingredients": [{"itemName": "tomato", "amount": 400}], "calories": 200},
+    {"recipeName": "Pasta Bake", "ingredients": [{"itemName": "pasta"}, {"itemName": "tomato sauce"}]},
+    {"recipeName": "Garden Salad", "ingredients": [{"itemName": "lettuce"}, {"itemName": "cherry tomato"}]},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def names(hits):
+    return [recipe["recipeName"] for recipe, _ in hits]
+
+
+def test_tokenize_ignores_case_and_punctuation():
+    assert tokenize("Mac & Cheese, 2-Ways!") == ["mac", "cheese", "2", "ways"]
+    assert tokenize(None) == []
+
+
+def test_name_matches_rank_above_ingredient_matches():
+    index = RecipeSearchIndex()
+    index.build(RECIPES)
+    assert names(index.search("tomato", 10)) == ["Tomato Soup", "Garden Salad", "Pasta Bake"]
+    assert names(index.search("TOMATO pasta", 10)) == ["Pasta Bake"]
+    assert index.search("tomato", 10)[0][0]["calories"] == 200
+    assert index.search("tomato chocolate", 10) == []
+    assert names(index.search("tomato", 1)) == ["Tomato Soup"]
+
+
+def test_add_and_remove_update_the_index():
+    index = RecipeSearchIndex()
+    index.build(RECIPES)
+    index.add({"recipeName": "Tomato Curry", "ingredients": [{"itemName": "rice"}]})
+    assert "Tomato Curry" in names(index.search("tomato", 10))
+    index.remove("Tomato Curry")
+    index.remove("Tomato Soup")
+    assert names(index.search("tomato", 10)) == ["Garden Salad", "Pasta Bake"]
+    assert index.search("rice", 10) == []
+
+
+def test_index_is_built_from_the_collection_and_refreshed():
+    collection = mongomock.MongoClient()['search_test'].recipes
+    collection.insert_many([dict(recipe) for recipe in RECIPES])
+    clock = FakeClock()
+    index = RecipeSearchIndex(refresh_seconds=60, clock=clock)
+    index.ensure_built(collection)
+    assert len(index) == 3
+
+    collection.insert_one({"recipeName": "Tomato Bruschetta", "ingredients": []})
+    index.ensure_built(collection)
+    assert len(index) == 3
+    clock.now = 60
+    index.ensure_built(collection)
+    assert "Tomato Bruschetta" in names(index.search("tomato", 10))
+
+
+def test_index_follows_the_shared_recipes_version():
+    collection = mongomock.MongoClient()['search_test'].recipes
+    collection.insert_many([dict(recipe) for recipe in RECIPES])
+    index = RecipeSearchIndex()
+    index.ensure_built(collection, version=1)
+
+    # A write of this process, applied to the index, moves it to the version it bumped
+    state = index.state()
+    index.add({"recipeName": "Tomato Curry", "ingredients": []})
+    index.advance(state, 2)
+    assert not index.needs_build(2)
+
+    # A write bumped by another worker in between cannot be skipped
+    state = index.state()
+    index.add({"recipeName": "Tomato Tart", "ingredients": []})
+    index.advance(state, 4)
+    assert index.needs_build(4)
+    collection.insert_one({"recipeName": "Tomato Bruschetta", "ingredients": []})
+    index.ensure_built(collection, version=4)
+    assert "Tomato Bruschetta" in names(index.search("tomato", 10))
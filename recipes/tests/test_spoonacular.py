@@ -0,0 +1,185 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import spoonacular
+from spoonacular import SpoonacularClient, SpoonacularError
+
+
+# Local stand-in for the Spoonacular complexSearch endpoint
+# statuses are answered first (one per request), then 200 with the searched query, or with
+# body when it is set
+class FakeSpoonacular(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeSpoonacularHandler)
+        self.requests = []
+        self.statuses = []
+        self.delay = 0
+        self.body = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/recipes/complexSearch"
+
+
+class FakeSpoonacularHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        self.server.requests.append(params)
+        time.sleep(self.server.delay)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = json.dumps({
+            "results": [{"id": len(self.server.requests), "title": params["query"][0]}],
+            "number": int(params["number"][0])
+        }).encode() if self.server.body is None else self.server.body
+        # The client is gone when it timed out during the delay
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_spoonacular():
+    server = FakeSpoonacular()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def search_client(fake_spoonacular, clock):
+    return SpoonacularClient(
+        fake_spoonacular.url, "test-key", session=spoonacular.create_session(backoff_factor=0),
+        timeout=2, ttl=60, stale_ttl=600, max_entries=2, clock=clock
+    )
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_normalized_searches_share_a_cache_entry(search_client, fake_spoonacular):
+    first = search_client.search("  Pasta  Bake", "5")
+    assert search_client.search("pasta bake", 5) == first
+    assert len(fake_spoonacular.requests) == 1
+    assert fake_spoonacular.requests[0]["query"] == ["pasta bake"]
+    assert fake_spoonacular.requests[0]["apiKey"] == ["test-key"]
+
+
+def test_cache_is_bounded(search_client, fake_spoonacular):
+    for query in ("soup", "salad", "stew", "soup"):
+        search_client.search(query, 1)
+    assert len(fake_spoonacular.requests) == 4
+
+
+def test_stale_entries_are_served_while_revalidating(search_client, fake_spoonacular, clock):
+    first = search_client.search("soup", 1)
+    clock.now = 61
+    assert search_client.search("soup", 1) == first
+    wait_for(lambda: search_client.search("soup", 1) != first)
+    assert len(fake_spoonacular.requests) == 2
+
+    clock.now = 61 + 61 + 600
+    assert search_client.search("soup", 1)["results"][0]["id"] == 3
+
+
+def test_concurrent_searches_are_coalesced(search_client, fake_spoonacular):
+    fake_spoonacular.delay = 0.3
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search_client.search("curry", 3))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8 and all(result == results[0] for result in results)
+    assert len(fake_spoonacular.requests) == 1
+
+
+def test_server_errors_are_retried(search_client, fake_spoonacular):
+    fake_spoonacular.statuses = [503, 503]
+    assert search_client.search("soup", 1)["results"]
+    assert len(fake_spoonacular.requests) == 3
+
+    fake_spoonacular.statuses = [402]
+    with pytest.raises(SpoonacularError):
+        search_client.search("salad", 1)
+
+
+def test_timeouts_raise_spoonacular_error(fake_spoonacular):
+    fake_spoonacular.delay = 0.5
+    client = SpoonacularClient(
+        fake_spoonacular.url, "test-key", session=spoonacular.create_session(retries=0), timeout=0.1
+    )
+    with pytest.raises(SpoonacularError):
+        client.search("soup", 1)
+
+
+def test_submit_renders_cached_search(fake_spoonacular, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.recipe_search, "api_url", fake_spoonacular.url)
+    app.recipe_search.clear()
+    with app.app.test_client() as client:
+        for _ in range(2):
+            response = client.post('/submit', data={'recipe': 'Pasta', 'count': '2'})
+            assert response.status_code == 200
+            assert b"pasta" in response.data
+        response = client.post('/submit', data={'recipe': 'Pasta', 'count': 'many'})
+        assert response.status_code == 400
+    assert len(fake_spoonacular.requests) == 1
+
+
+def test_invalid_upstream_bodies_are_bad_gateways(fake_spoonacular, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.recipe_search, "api_url", fake_spoonacular.url)
+    app.recipe_search.clear()
+    with app.app.test_client() as client:
+        for body in (b"<html>quota exceeded</html>", b"[]"):
+            fake_spoonacular.body = body
+            response = client.post('/submit', data={'recipe': 'Soup', 'count': '2'})
+            assert response.status_code == 502
+            response = client.get('/api/recipecollection?recipe=soup&count=3')
+            assert response.status_code == 502
+        response = client.get('/api/recipecollection?recipe=soup&count=many')
+        assert response.status_code == 400
+    assert len(fake_spoonacular.requests) == 4
+
+
+def test_session_is_created_by_the_first_search(fake_spoonacular):
+    client = SpoonacularClient(fake_spoonacular.url, "test-key", retries=0)
+    assert client._session is None
+    client.search("soup", 1)
+    assert client.session is client._session is not None